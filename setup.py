@@ -11,6 +11,7 @@ import sys
 
 from setuptools import setup, find_packages
 from setuptools import Command
+from setuptools.command.build_py import build_py
 from setuptools.command.test import test as TestCommand
 
 from wsgidav._version import __version__
@@ -30,6 +31,19 @@ class ToxCommand(TestCommand):
         sys.exit(errcode)
 
 
+# Modules that use Python 3 syntax and would fail to byte-compile on Python 2
+PY3_ONLY_MODULES = [("wsgidav.server", "asyncio_server")]
+
+
+# Override 'setup.py build_py' command
+class BuildPyCommand(build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 0):
+            modules = [m for m in modules if (m[0], m[1]) not in PY3_ONLY_MODULES]
+        return modules
+
+
 # Add custom command 'setup.py sphinx'
 # See https://dankeder.com/posts/adding-custom-commands-to-setup-py/
 # and http://stackoverflow.com/a/22273180/19166
@@ -195,6 +209,7 @@ setup(
     zip_safe=False,
     extras_require={},
     cmdclass={
+        "build_py": BuildPyCommand,
         "test": ToxCommand,
         "sphinx": SphinxCommand,
         },
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+    Functional test for the asyncio server (Python 3.4+).
+
+    Starts wsgidav.server.asyncio_server in a thread and sends requests over
+    keep-alive connections with http.client.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import socket
+import sys
+import threading
+import unittest
+from tempfile import gettempdir
+
+from wsgidav.fs_dav_provider import FilesystemProvider
+from wsgidav.wsgidav_app import DEFAULT_CONFIG, WsgiDAVApp
+
+
+# ========================================================================
+# AsyncioServerTest
+# ========================================================================
+@unittest.skipIf(sys.version_info < (3, 4), "asyncio server requires Python 3.4+")
+class AsyncioServerTest(unittest.TestCase):
+
+    def setUp(self):
+        from wsgidav.server.asyncio_server import AsyncioServer
+
+        self.rootpath = os.path.join(gettempdir(), "wsgidav-test-asyncio")
+        if os.path.exists(self.rootpath):
+            shutil.rmtree(self.rootpath)
+        os.mkdir(self.rootpath)
+
+        config = DEFAULT_CONFIG.copy()
+        config.update({
+            "provider_mapping": {"/": FilesystemProvider(self.rootpath)},
+            "user_mapping": {},
+            "verbose": 1,
+            "enable_loggers": [],
+            "propsmanager": None,
+            "locksmanager": True,
+            "domaincontroller": None,
+            "acceptbasic": True,
+            "acceptdigest": True,
+            "defaultdigest": True,
+            })
+        self.server = AsyncioServer(WsgiDAVApp(config), "127.0.0.1", 0, workers=2,
+                                    keepalive_timeout=5)
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.server.serve, args=(started, ))
+        self.thread.daemon = True
+        self.thread.start()
+        self.assertTrue(started.wait(5))
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join(5)
+        shutil.rmtree(self.rootpath, ignore_errors=True)
+
+    def _connect(self):
+        import http.client
+        return http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+
+    def testKeepAlive(self):
+        """Several requests on one connection."""
+        conn = self._connect()
+        data = b"Hello, world!\n" * 1000
+
+        conn.request("PUT", "/file1.txt", body=data)
+        res = conn.getresponse()
+        res.read()
+        self.assertEqual(res.status, 201)
+        sock = conn.sock
+        self.assertIsNotNone(sock)
+
+        conn.request("GET", "/file1.txt")
+        res = conn.getresponse()
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.read(), data)
+        self.assertIn("asyncio", res.getheader("Server"))
+
+        conn.request("PROPFIND", "/", headers={"Depth": "1"})
+        res = conn.getresponse()
+        self.assertEqual(res.status, 207)
+        self.assertIn(b"file1.txt", res.read())
+
+        conn.request("GET", "/file%20missing.txt")
+        res = conn.getresponse()
+        res.read()
+        self.assertEqual(res.status, 404)
+
+        # All requests were sent over the same socket
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def testExpectContinue(self):
+        """Send '100 Continue' when the body is read."""
+        sock = socket.create_connection(("127.0.0.1", self.server.port), timeout=5)
+        sock.sendall(b"PUT /file2.txt HTTP/1.1\r\nHost: localhost\r\n"
+                     b"Content-Length: 5\r\nExpect: 100-continue\r\n\r\n")
+        self.assertTrue(sock.recv(1024).startswith(b"HTTP/1.1 100 Continue"))
+        sock.sendall(b"12345")
+        self.assertTrue(sock.recv(1024).startswith(b"HTTP/1.1 201 "))
+        sock.close()
+        with open(os.path.join(self.rootpath, "file2.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"12345")
+
+    def testBadRequest(self):
+        sock = socket.create_connection(("127.0.0.1", self.server.port), timeout=5)
+        sock.sendall(b"GARBAGE\r\n\r\n")
+        self.assertTrue(sock.recv(1024).startswith(b"HTTP/1.1 400 "))
+        sock.close()
+
+    def testMultiprocess(self):
+        """'wsgi.multiprocess' is True for prefork workers."""
+        from wsgidav.server.asyncio_server import AsyncioServer
+
+        class _Writer(object):
+            def get_extra_info(self, name):
+                return None
+
+        head = b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        environ, _keepAlive = self.server._makeEnviron(head, _Writer())
+        self.assertIs(environ["wsgi.multiprocess"], False)
+        server = AsyncioServer(None, "127.0.0.1", 0, multiprocess=True)
+        environ, _keepAlive = server._makeEnviron(head, _Writer())
+        self.assertIs(environ["wsgi.multiprocess"], True)
+
+
+# ========================================================================
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+    Tests for the worker pool and response writing of ext_wsgiutils_server.
+"""
+from __future__ import print_function
+
+import socket
+import sys
+import threading
+import unittest
+
+from wsgidav.server.ext_wsgiutils_server import ExtHandler, ExtServer
+
+
+class _FakeSocket(object):
+    """Accepts at most 3 bytes per sendmsg() call."""
+
+    def __init__(self):
+        self.data = b""
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        chunk = b"".join(bytes(b) for b in buffers)[:3]
+        self.data += chunk
+        return len(chunk)
+
+
+# ========================================================================
+# ExtServerTest
+# ========================================================================
+class ExtServerTest(unittest.TestCase):
+
+    def testSendBuffers(self):
+        handler = ExtHandler.__new__(ExtHandler)
+        handler.connection = sock = _FakeSocket()
+        if not hasattr(socket.socket, "sendmsg"):
+            return  # sendall() fallback
+        handler._sendBuffers([b"HTTP/1.1 200 OK\r\n\r\n", b"", b"Hello"])
+        self.assertEqual(sock.data, b"HTTP/1.1 200 OK\r\n\r\nHello")
+        self.assertEqual(sock.calls, 8)
+
+    def testQueueLimit(self):
+        """Connections beyond the queue limit are refused with 503."""
+        entered = threading.Event()
+        release = threading.Event()
+
+        def app(environ, start_response):
+            entered.set()
+            release.wait(5)
+            start_response("200 OK", [("Content-Length", "2")])
+            return [b"OK"]
+
+        server = ExtServer(("127.0.0.1", 0), {"": app}, numThreads=1, maxQueued=1)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        address = server.server_address
+        socks = []
+        try:
+            for i in range(3):
+                sock = socket.create_connection(address, timeout=5)
+                sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+                socks.append(sock)
+                if i == 0:
+                    self.assertTrue(entered.wait(5))
+            # One connection is processed, one is queued, one is refused
+            self.assertTrue(socks[2].recv(1024).startswith(b"HTTP/1.1 503 "))
+            release.set()
+            for sock in socks[:2]:
+                res = sock.recv(1024)
+                self.assertTrue(res.startswith(b"HTTP/1.1 200 "))
+                self.assertTrue(res.endswith(b"\r\n\r\nOK"))
+        finally:
+            release.set()
+            for sock in socks:
+                sock.close()
+            server.shutdown()
+            server.server_close()
+            thread.join(5)
+
+    @unittest.skipIf(sys.version_info < (3, 0), "Python 2 ignores 'Expect: 100-continue'")
+    def testExpectContinue(self):
+        """'100 Continue' is only sent when the application reads the body."""
+        def app(environ, start_response):
+            if environ["PATH_INFO"] == "/read":
+                body = environ["wsgi.input"].read(5)
+                start_response("201 Created", [("Content-Length", "5")])
+                return [body]
+            start_response("401 Not Authorized", [("Content-Length", "0"),
+                                                  ("Connection", "close")])
+            return [b""]
+
+        server = ExtServer(("127.0.0.1", 0), {"": app}, numThreads=1)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            request = (b"PUT {} HTTP/1.1\r\nHost: localhost\r\n"
+                       b"Content-Length: 5\r\nExpect: 100-continue\r\n\r\n")
+            sock = socket.create_connection(server.server_address, timeout=5)
+            sock.sendall(request.replace(b"{}", b"/reject"))
+            self.assertTrue(sock.recv(1024).startswith(b"HTTP/1.1 401 "))
+            sock.close()
+
+            sock = socket.create_connection(server.server_address, timeout=5)
+            sock.sendall(request.replace(b"{}", b"/read"))
+            self.assertEqual(sock.recv(1024), b"HTTP/1.1 100 Continue\r\n\r\n")
+            sock.sendall(b"12345")
+            res = sock.recv(1024)
+            self.assertTrue(res.startswith(b"HTTP/1.1 201 "))
+            self.assertTrue(res.endswith(b"\r\n\r\n12345"))
+            sock.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join(5)
+
+
+# ========================================================================
+
+
+if __name__ == "__main__":
+    unittest.main()
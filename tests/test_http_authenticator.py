@@ -0,0 +1,210 @@
+# -*- coding: iso-8859-1 -*-
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""Unit tests for wsgidav.http_authenticator"""
+from __future__ import print_function
+
+import base64
+import unittest
+from hashlib import md5
+
+from wsgidav import compat
+from wsgidav.domain_controller import HA1CacheMixin, WsgiDAVDomainController
+from wsgidav.http_authenticator import (
+    CredentialCache,
+    HTTPAuthenticator,
+    SimpleDomainController,
+    )
+
+
+class CountingDomainController(SimpleDomainController):
+    """SimpleDomainController that counts calls to authDomainUser()."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingDomainController, self).__init__(*args, **kwargs)
+        self.authCalls = 0
+        self.realmCalls = 0
+
+    def getDomainRealm(self, inputRelativeURL, environ):
+        self.realmCalls += 1
+        return super(CountingDomainController, self).getDomainRealm(inputRelativeURL, environ)
+
+    def authDomainUser(self, realmname, username, password, environ):
+        self.authCalls += 1
+        return super(CountingDomainController, self).authDomainUser(
+            realmname, username, password, environ)
+
+
+class AuthenticatorTest(unittest.TestCase):
+    """Test HTTPAuthenticator."""
+
+    def _makeAuthenticator(self, **config):
+        self.dc = CountingDomainController({"tester": "secret"}, "/dav")
+        config.setdefault("domaincontroller", self.dc)
+        config.setdefault("acceptdigest", False)
+        config.setdefault("defaultdigest", False)
+
+        def app(environ, start_response):
+            start_response("200 OK", [])
+            return [compat.to_bytes(environ["http_authenticator.username"])]
+
+        return HTTPAuthenticator(app, config)
+
+    def _request(self, authenticator, user=None, password=None, cookie=None, digest=None):
+        environ = {"PATH_INFO": "/dav/file.txt", "REQUEST_METHOD": "GET"}
+        if cookie:
+            environ["HTTP_COOKIE"] = cookie
+        if digest:
+            environ["HTTP_AUTHORIZATION"] = digest
+        if user is not None:
+            cred = compat.to_bytes("{}:{}".format(user, password))
+            environ["HTTP_AUTHORIZATION"] = "Basic " + compat.to_native(
+                base64.b64encode(cred))
+        status = []
+
+        def start_response(s, headers, exc_info=None):
+            status.append(s)
+            self.responseHeaders = dict(headers)
+
+        body = b"".join(authenticator(environ, start_response))
+        return status[0], body
+
+    def testCredentialCache(self):
+        cache = CredentialCache(ttl=60, maxSize=2, failBackoff=10)
+        assert cache.lookup("r", "u", "p") is None
+        cache.store("r", "u", "p", True)
+        assert cache.lookup("r", "u", "p") is True
+        assert cache.lookup("r", "u", "wrong") is None
+
+        # Failures are cached with a growing backoff
+        cache.store("r", "u", "wrong", False)
+        assert cache.lookup("r", "u", "wrong") is False
+        cache.store("r", "u", "wrong", False)
+        entry = cache._entries[cache._makeKey("r", "u", "wrong")]
+        assert entry[2] == 2
+
+        # Passwords are not stored in clear text
+        assert all(len(key[2]) == 64 for key in cache._entries)
+
+        # LRU eviction
+        cache.store("r", "u2", "p", True)
+        assert len(cache._entries) == 2
+        assert cache.lookup("r", "u", "p") is None
+
+        stats = cache.getStats()
+        assert stats["hits"] == 1 and stats["negativeHits"] == 1
+
+    def testBasicAuthCache(self):
+        auth = self._makeAuthenticator(auth_cache_ttl=60)
+        assert auth.getCredentialCache() is not None
+
+        assert self._request(auth)[0].startswith("401")
+        for _ in range(3):
+            status, body = self._request(auth, "tester", "secret")
+            assert status == "200 OK" and body == b"tester"
+        assert self.dc.authCalls == 1
+        # The realm is only resolved once per request
+        assert self.dc.realmCalls == 4
+
+        for _ in range(3):
+            assert self._request(auth, "tester", "wrong")[0].startswith("401")
+        assert self.dc.authCalls == 2
+        assert auth.getCredentialCache().negativeHits == 2
+
+        # Disabled cache: every request is verified
+        auth = self._makeAuthenticator(auth_cache_ttl=0)
+        assert auth.getCredentialCache() is None
+        for _ in range(2):
+            assert self._request(auth, "tester", "secret")[0] == "200 OK"
+        assert self.dc.authCalls == 2
+
+    def testSessionCookie(self):
+        auth = self._makeAuthenticator(auth_session_ttl=60, auth_secret="s3cr3t")
+
+        assert self._request(auth, "tester", "secret")[0] == "200 OK"
+        setCookie = self.responseHeaders["Set-Cookie"]
+        assert setCookie.startswith("wsgidav_session=")
+        assert "HttpOnly" in setCookie and "Max-Age=60" in setCookie
+        assert "; SameSite=Strict" in setCookie
+        cookie = setCookie.split(";")[0]
+
+        # The cookie is accepted without credentials (and not re-issued)
+        status, body = self._request(auth, cookie="foo=bar; " + cookie)
+        assert status == "200 OK" and body == b"tester"
+        assert "Set-Cookie" not in self.responseHeaders
+        assert self.dc.authCalls == 1
+
+        # Tokens are stateless: a second instance with the same secret accepts it
+        auth2 = self._makeAuthenticator(auth_session_ttl=60, auth_secret="s3cr3t")
+        assert self._request(auth2, cookie=cookie)[0] == "200 OK"
+
+        # Forged, expired, or foreign-realm tokens are challenged
+        expires, user, sig = cookie.split("=", 1)[1].split(".")
+        forged = "wsgidav_session={}.{}.{}".format(int(expires) + 100, user, sig)
+        assert self._request(auth, cookie=forged)[0].startswith("401")
+        token = auth._signSession(1, "/dav", "tester")
+        expired = "wsgidav_session=1.{}.{}".format(user, token)
+        assert self._request(auth, cookie=expired)[0].startswith("401")
+        assert auth._getSessionUser({}, "/dav") == (None, False)
+        assert auth._getSessionUser({"HTTP_COOKIE": cookie}, "/other") == (None, False)
+        assert self._request(auth, cookie="wsgidav_session=garbage")[0].startswith("401")
+
+        # Sessions past half of their lifetime are renewed
+        auth._sessionTtl = 200
+        assert auth._getSessionUser({"HTTP_COOKIE": cookie}, "/dav") == ("tester", True)
+        assert self._request(auth, cookie=cookie)[0] == "200 OK"
+        assert "Set-Cookie" in self.responseHeaders
+
+    def _digestHeader(self, auth, nonce, nc="00000001", password="secret"):
+        response = auth.computeDigestResponse(
+            "tester", "/dav", password, "GET", "/dav/file.txt", nonce, "abc", "auth", nc)
+        return ('Digest username="tester", realm="/dav", nonce="{}", uri="/dav/file.txt", '
+                'response="{}", algorithm=MD5, qop=auth, nc={}, cnonce="abc"'
+                .format(nonce, response, nc))
+
+    def testDigestNonce(self):
+        auth = self._makeAuthenticator(acceptdigest=True, defaultdigest=True,
+                                       auth_secret="s3cr3t", auth_nonce_ttl=60)
+        status, _body = self._request(auth)
+        assert status.startswith("401")
+        challenge = self.responseHeaders["WWW-Authenticate"]
+        assert challenge.startswith("Digest ") and "stale" not in challenge
+        nonce = challenge.split('nonce="')[1].split('"')[0]
+
+        # Nonces are stateless: another instance with the same secret accepts them
+        auth2 = self._makeAuthenticator(acceptdigest=True, auth_secret="s3cr3t")
+        status, body = self._request(auth2, digest=self._digestHeader(auth2, nonce))
+        assert status == "200 OK" and body == b"tester"
+
+        # Re-used nonce counts are renewed with stale=true, new counts accepted
+        assert self._request(auth2, digest=self._digestHeader(auth2, nonce))[0].startswith("401")
+        assert "stale=true" in self.responseHeaders["WWW-Authenticate"]
+        header = self._digestHeader(auth2, nonce, nc="00000002")
+        assert self._request(auth2, digest=header)[0] == "200 OK"
+
+        # Expired or forged nonces are stale, a wrong password is not
+        forged = nonce[:-1] + ("1" if nonce.endswith("0") else "0")
+        for badNonce in (auth.makeDigestNonce(timestamp=1), forged, "garbage"):
+            assert self._request(auth, digest=self._digestHeader(auth, badNonce))[0] != "200 OK"
+            assert "stale=true" in self.responseHeaders["WWW-Authenticate"]
+        header = self._digestHeader(auth, auth.makeDigestNonce(), password="wrong")
+        assert self._request(auth, digest=header)[0].startswith("401")
+        assert "stale" not in self.responseHeaders["WWW-Authenticate"]
+
+        # HA1 is computed once per user
+        assert self.dc.getRealmUserHA1("/dav", "tester", {}) == auth.md5h("tester:/dav:secret")
+        assert list(self.dc._ha1Cache.keys()) == [("/dav", "tester")]
+        assert self.dc.getRealmUserHA1("/dav", "unknown", {}) is None
+
+    def testHA1Cache(self):
+        dc = WsgiDAVDomainController({"/dav": {"tester": {"password": "secret"}}})
+        assert isinstance(dc, HA1CacheMixin)
+        assert dc.getRealmUserHA1("/dav", "tester", {}) == md5(b"tester:/dav:secret").hexdigest()
+        dc.userMap["/dav"]["tester"]["password"] = "changed"
+        assert dc.getRealmUserHA1("/dav", "tester", {}) == md5(b"tester:/dav:changed").hexdigest()
+        assert dc.getRealmUserHA1("/dav", "unknown", {}) is None
+
+
+if __name__ == "__main__":
+    unittest.main()
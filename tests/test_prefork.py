@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+    Tests for the pre-forking multi-process server.
+
+    The functional test runs the supervisor in a subprocess, because it
+    installs signal handlers.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+from tempfile import gettempdir
+
+from wsgidav.lock_manager import LockManager
+from wsgidav.lock_storage import LockStorageDict
+from wsgidav.property_manager import PropertyManager, SQLitePropertyManager
+from wsgidav.server.prefork import checkMultiProcessSafe
+
+_SERVER_SCRIPT = """
+import sys
+from wsgidav import util
+from wsgidav.server.prefork import PreforkServer
+from wsgidav.wsgidav_app import DEFAULT_CONFIG
+
+util.initLogging(1, [])
+config = DEFAULT_CONFIG.copy()
+config.update({{
+    "host": "127.0.0.1",
+    "port": {port},
+    "provider_mapping": {{"/": {root!r}}},
+    "user_mapping": {{}},
+    "verbose": 1,
+    "enable_loggers": [],
+    "locksmanager": None,
+    "propsmanager": None,
+    "domaincontroller": None,
+    "server_args": {{"workers": 2}},
+    }})
+PreforkServer(config, workers=2, shutdown_timeout=5).serve()
+"""
+
+
+class _SafeStorage(LockStorageDict):
+    multiProcessSafe = True
+
+
+# ========================================================================
+# PreforkTest
+# ========================================================================
+class PreforkTest(unittest.TestCase):
+
+    def testCheckMultiProcessSafe(self):
+        config = {"locksmanager": True,
+                  "propsmanager": PropertyManager(),
+                  "provider_mapping": {"/a": "/tmp",
+                                       "/b": {"provider": "/tmp", "locksmanager": None},
+                                       },
+                  }
+        problems = checkMultiProcessSafe(config)
+        self.assertEqual(len(problems), 2)
+        self.assertTrue(problems[0].startswith("locksmanager: in-memory"))
+
+        sqlitePath = os.path.join(gettempdir(), "wsgidav-test-prefork.sqlite")
+        config = {"locksmanager": LockManager(_SafeStorage()),
+                  "propsmanager": SQLitePropertyManager(sqlitePath),
+                  "provider_mapping": {"/a": {"provider": "/tmp",
+                                              "locksmanager": LockStorageDict()},
+                                       },
+                  }
+        problems = checkMultiProcessSafe(config)
+        self.assertEqual(problems, ["locksmanager of share '/a': LockStorageDict"])
+
+        config["provider_mapping"] = {}
+        self.assertEqual(checkMultiProcessSafe(config), [])
+
+    @unittest.skipIf(sys.version_info < (3, 5) or not hasattr(socket, "SO_REUSEPORT"),
+                     "prefork requires Python 3.5+ and SO_REUSEPORT")
+    def testServeAndShutdown(self):
+        import http.client
+
+        rootpath = os.path.join(gettempdir(), "wsgidav-test-prefork")
+        if os.path.exists(rootpath):
+            shutil.rmtree(rootpath)
+        os.mkdir(rootpath)
+        with open(os.path.join(rootpath, "file1.txt"), "wb") as f:
+            f.write(b"Hello")
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        proc = subprocess.Popen([sys.executable, "-c",
+                                 _SERVER_SCRIPT.format(port=port, root=rootpath)])
+        try:
+            # Wait for the workers
+            for _i in range(100):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    break
+                except socket.error:
+                    time.sleep(0.1)
+
+            for _i in range(4):
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+                conn.request("GET", "/file1.txt")
+                res = conn.getresponse()
+                self.assertEqual(res.status, 200)
+                self.assertEqual(res.read(), b"Hello")
+                conn.close()
+
+            proc.send_signal(signal.SIGTERM)
+            self.assertEqual(proc.wait(10), 0)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            shutil.rmtree(rootpath, ignore_errors=True)
+
+
+# ========================================================================
+
+
+if __name__ == "__main__":
+    unittest.main()
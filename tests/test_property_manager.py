@@ -3,12 +3,24 @@
 # Licensed under the MIT license:
 # http://www.opensource.org/licenses/mit-license.php
 """Unit test for property_manager.py"""
+import gc
 import os
+import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
+import types
 import unittest
 from tempfile import gettempdir
 
-from wsgidav import property_manager
+from wsgidav import compat, fs_dav_provider, property_manager
+
+try:
+    import mongomock
+    from wsgidav.addons import mongo_property_manager
+except ImportError:
+    mongomock = None
 
 
 # ========================================================================
@@ -72,6 +84,50 @@ class BasicTest(unittest.TestCase):
         pm.writeProperty(url, "foo", "my name is joe")
         assert pm.getProperty(url, "foo") == "my name is joe"
 
+    def testTree(self):
+        """Copy, move, and remove collections with their descendants."""
+        pm = self.pm
+        for url in ("/dav/a/", "/dav/a/b", "/dav/a/c/", "/dav/a/c/d", "/dav/ab"):
+            pm.writeProperty(url, "{ns1:}foo", b"<foo>" + url.encode("utf8") + b"</foo>")
+
+        pm.copyProperties("/dav/a/", "/dav/x/", withChildren=True)
+        assert pm.getProperty("/dav/x/c/d", "{ns1:}foo") == b"<foo>/dav/a/c/d</foo>"
+        assert pm.getProperty("/dav/a/c/d", "{ns1:}foo") is not None
+
+        pm.moveProperties("/dav/a/", "/dav/y/", withChildren=True)
+        urls = pm.getPropertyDicts(
+            ["/dav/a/", "/dav/a/b", "/dav/y/", "/dav/y/b", "/dav/y/c/d", "/dav/ab"])
+        assert sorted(urls.keys()) == ["/dav/ab", "/dav/y/", "/dav/y/b", "/dav/y/c/d"]
+        assert urls["/dav/y/c/d"] == {"{ns1:}foo": b"<foo>/dav/a/c/d</foo>"}
+
+        pm.moveProperties("/dav/ab", "/dav/z", withChildren=False)
+        assert pm.getProperties("/dav/ab") == []
+        assert pm.getProperties("/dav/z") == ["{ns1:}foo"]
+
+        pm.removeProperties("/dav/y/", withChildren=True)
+        assert pm.getPropertyDicts(["/dav/y/", "/dav/y/c/d"]) == {}
+        assert pm.getProperties("/dav/x/c/") == ["{ns1:}foo"]
+
+    def testTransaction(self):
+        """Staged changes are written on commit and discarded on rollback."""
+        pm = self.pm
+        url = "/dav/tx"
+        pm.removeProperties(url)
+        pm.writeProperty(url, "{ns1:}foo", b"<foo/>")
+
+        tx = pm.beginTransaction()
+        tx.stage(url, "{ns1:}bar", b"<bar/>")
+        tx.stage(url, "{ns1:}foo", None)
+        assert pm.getProperties(url) == ["{ns1:}foo"], "Nothing written before commit"
+        tx.commit()
+        assert pm.getProperties(url) == ["{ns1:}bar"]
+
+        tx = pm.beginTransaction()
+        tx.stage(url, "{ns1:}baz", b"<baz/>")
+        tx.rollback()
+        self.assertRaises(AssertionError, tx.stage, url, "{ns1:}baz", b"<baz/>")
+        assert pm.getProperties(url) == ["{ns1:}bar"]
+
 
 # ========================================================================
 # ShelveTest
@@ -100,6 +156,456 @@ class ShelveTest(BasicTest):
 #        os.remove(self.path)
 
 
+# ========================================================================
+# WriteBehindTest
+# ========================================================================
+class WriteBehindTest(BasicTest):
+    """Test property_manager.ShelvePropertyManager(writeBehind=True)."""
+
+    def setUp(self):
+        if sys.version_info < (3, 0):
+            modifier = "-py2"  # shelve formats are incompatible
+        else:
+            modifier = "-py3"
+        self.path = os.path.join(
+            gettempdir(), "wsgidav-props-wb{}.shelve".format(modifier))
+        self.pm = self._open(commitSize=4)
+        self.pm.clear()
+
+    def tearDown(self):
+        self.pm._close()
+        self.pm = None
+
+    def _open(self, commitSize):
+        pm = property_manager.ShelvePropertyManager(
+            self.path, writeBehind=True, commitInterval=None, commitSize=commitSize)
+        pm._verbose = 2
+        return pm
+
+    def testBatches(self):
+        """Modifications are visible at once, but committed in batches."""
+        pm = self.pm
+        pm.writeProperty("/dav/a", "{ns1:}foo", "1")
+        pm.writeProperty("/dav/b", "{ns1:}foo", "2")
+        pm.moveProperties("/dav/b", "/dav/c", withChildren=False)
+        assert pm.getProperty("/dav/a", "{ns1:}foo") == "1"
+        assert pm.getProperties("/dav/b") == []
+        assert pm.getProperty("/dav/c", "{ns1:}foo") == "2"
+        assert len(pm._dict.pending) == 3
+        assert "/dav/a" not in pm._dict._shelf
+
+        pm.writeProperty("/dav/d", "{ns1:}foo", "4")
+        assert not pm._dict.pending, "commitSize reached"
+        assert sorted(pm._dict._shelf.keys()) == ["/dav/a", "/dav/c", "/dav/d"]
+
+        pm.removeProperties("/dav/a")
+        pm.commit()
+        assert "/dav/a" not in pm._dict._shelf
+        assert pm.getProperty("/dav/c", "{ns1:}foo") == "2"
+
+    def testReplay(self):
+        """Uncommitted modifications are recovered from the journal."""
+        pm = self.pm
+        pm.writeProperty("/dav/a", "{ns1:}foo", "1")
+        pm.writeProperty("/dav/a", "{ns1:}bar", "2")
+        # Simulate a crash: release the files without committing
+        pm._dict._journal.close()
+        pm._dict._shelf.close()
+        pm._dict = None
+        pm._loaded = False
+
+        self.pm = pm = self._open(commitSize=4)
+        assert sorted(pm.getProperties("/dav/a")) == ["{ns1:}bar", "{ns1:}foo"]
+        assert not pm._dict.pending, "Journal is committed on open"
+
+    def testCommitFsync(self):
+        """The journal is fsynced once per commit, before the shelve is written."""
+        pm = self.pm
+        pm.writeProperty("/dav/a", "{ns1:}foo", "1")
+        journalFd = pm._dict._journal.fileno()
+        calls = []
+
+        def fsync(fd):
+            calls.append("journal" if fd == journalFd else "shelve")
+            realFsync(fd)
+
+        realFsync = os.fsync
+        os.fsync = fsync
+        try:
+            pm.writeProperty("/dav/b", "{ns1:}foo", "2")
+            assert calls == []
+            pm.commit()
+        finally:
+            os.fsync = realFsync
+        assert calls[0] == "journal"
+        assert calls.count("journal") == 1
+        assert "shelve" in calls
+
+
+# ========================================================================
+# SQLiteTest
+# ========================================================================
+class SQLiteTest(BasicTest):
+    """Test property_manager.SQLitePropertyManager()."""
+
+    def setUp(self):
+        self.path = os.path.join(gettempdir(), "wsgidav-props.sqlite")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.pm = property_manager.SQLitePropertyManager(self.path)
+        self.pm._verbose = 2
+
+    def tearDown(self):
+        self.pm._close()
+        self.pm = None
+
+    def testValidation(self):
+        """Property manager should raise errors on bad args."""
+        pm = self.pm
+        self.assertRaises(AssertionError,
+                          pm.writeProperty, None, "{ns1:}foo", "hurz", False)
+        self.assertRaises(AssertionError,
+                          pm.writeProperty, "/dav/res", None, "hurz", False)
+        self.assertRaises(AssertionError,
+                          pm.writeProperty, "/dav/res", "{ns1:}foo", None, False)
+        assert pm.getPropertyDicts(["/dav/res"]) == {}
+
+    def testThreadConnections(self):
+        """Connections are closed when their thread ends."""
+        pm = self.pm
+        pm.writeProperty("/dav/res", "{ns1:}foo", b"<foo/>")
+        cons = []
+
+        def worker():
+            cons.append(pm._getConnection())
+            assert pm.getProperty("/dav/res", "{ns1:}foo") == b"<foo/>"
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        gc.collect()
+        self.assertRaises(sqlite3.ProgrammingError, cons[0].execute, "SELECT 1")
+
+        con = pm._getConnection()
+        pm._close()
+        self.assertRaises(sqlite3.ProgrammingError, con.execute, "SELECT 1")
+
+
+# ========================================================================
+# XattrTest
+# ========================================================================
+@unittest.skipUnless(fs_dav_provider._xattrSupported, "Extended attributes not supported")
+class XattrTest(unittest.TestCase):
+    """Test fs_dav_provider.XattrPropertyManager()."""
+
+    def setUp(self):
+        self.rootPath = tempfile.mkdtemp(prefix="wsgidav-xattr-")
+        self.provider = fs_dav_provider.FilesystemProvider(self.rootPath, xattrProperties=True)
+        self.provider.setSharePath("/dav")
+        self.fallback = property_manager.PropertyManager()
+        self.provider.setPropManager(self.fallback)
+        self.pm = self.provider.propManager
+        os.mkdir(os.path.join(self.rootPath, "a"))
+        with open(os.path.join(self.rootPath, "a", "b.txt"), "wb") as f:
+            f.write(b"test")
+
+    def tearDown(self):
+        shutil.rmtree(self.rootPath)
+
+    def testReadWrite(self):
+        pm = self.pm
+        assert isinstance(pm, fs_dav_provider.XattrPropertyManager)
+        pm.writeProperty("/dav/a/b.txt", "{ns1:}foo", b"<foo/>")
+        pm.writeProperty("/dav/a/", "{ns1:}bar", b"<bar/>")
+        assert pm.getProperty("/dav/a/b.txt", "{ns1:}foo") == b"<foo/>"
+        assert pm.getProperties("/dav/a/") == ["{ns1:}bar"]
+        assert pm.getPropertyDicts(["/dav/a/", "/dav/a/b.txt", "/dav/c"]) == {
+            "/dav/a/": {"{ns1:}bar": b"<bar/>"},
+            "/dav/a/b.txt": {"{ns1:}foo": b"<foo/>"},
+            }
+        assert not self.fallback._dict, "Fallback is not used"
+
+        # Properties travel with the files
+        os.rename(os.path.join(self.rootPath, "a"), os.path.join(self.rootPath, "c"))
+        assert pm.getProperty("/dav/c/b.txt", "{ns1:}foo") == b"<foo/>"
+
+        pm.removeProperty("/dav/c/b.txt", "{ns1:}foo")
+        assert pm.getProperties("/dav/c/b.txt") == []
+        assert pm.getProperty("/dav/c/b.txt", "{ns1:}foo") is None
+
+    def testFallback(self):
+        pm = self.pm
+        # Too large for an extended attribute
+        value = b"<foo>" + b"x" * 100000 + b"</foo>"
+        pm.writeProperty("/dav/a/b.txt", "{ns1:}foo", value)
+        assert self.fallback.getProperty("/dav/a/b.txt", "{ns1:}foo") == value
+        assert pm.getProperty("/dav/a/b.txt", "{ns1:}foo") == value
+        assert pm.getProperties("/dav/a/b.txt") == ["{ns1:}foo"]
+
+        pm.writeProperty("/dav/a/b.txt", "{ns1:}bar", b"<bar/>")
+        assert pm.getPropertyDicts(["/dav/a/", "/dav/a/b.txt"]) == {
+            "/dav/a/b.txt": {"{ns1:}foo": value, "{ns1:}bar": b"<bar/>"},
+            }
+
+        pm.writeProperty("/dav/a/b.txt", "{ns1:}foo", b"<foo/>")
+        assert self.fallback.getProperties("/dav/a/b.txt") == []
+        assert pm.getProperty("/dav/a/b.txt", "{ns1:}foo") == b"<foo/>"
+
+    def testFallbackCalls(self):
+        """The fallback is only written if needed, and read in batches."""
+        calls = []
+
+        def record(name, method):
+            def wrapper(*args, **kwargs):
+                calls.append(name)
+                return method(*args, **kwargs)
+            return wrapper
+
+        for name in ("removeProperty", "getPropertyDicts", "getProperty"):
+            setattr(self.fallback, name, record(name, getattr(self.fallback, name)))
+
+        pm = self.pm
+        pm.writeProperty("/dav/a/b.txt", "{ns1:}foo", b"<foo/>")
+        assert "removeProperty" not in calls
+        del calls[:]
+        assert pm.getPropertyDicts(["/dav/a/", "/dav/a/b.txt"]) == {
+            "/dav/a/b.txt": {"{ns1:}foo": b"<foo/>"},
+            }
+        assert calls == ["getPropertyDicts"]
+
+        # Missing properties are only looked up in the fallback, if it is used
+        del calls[:]
+        assert pm.getProperty("/dav/a/b.txt", "{ns1:}bar") is None
+        pm.removeProperty("/dav/a/b.txt", "{ns1:}foo")
+        assert calls == []
+        pm.writeProperty("/dav/a/b.txt", "{ns1:}big", b"<big>" + b"x" * 100000 + b"</big>")
+        del calls[:]
+        assert pm.getProperty("/dav/a/b.txt", "{ns1:}bar") is None
+        assert calls == ["getProperty"]
+
+    def testEnviron(self):
+        """File paths are resolved with the request environment."""
+        environs = []
+        locToFilePath = self.provider._locToFilePath
+
+        def _locToFilePath(path, environ=None):
+            environs.append(environ)
+            return locToFilePath(path, environ)
+
+        self.provider._locToFilePath = _locToFilePath
+        environ = {"wsgidav.user": "tester"}
+        self.pm.writeProperty("/dav/a/b.txt", "{ns1:}foo", b"<foo/>", False, environ)
+        assert self.pm.getProperty("/dav/a/b.txt", "{ns1:}foo", environ) == b"<foo/>"
+        self.pm.getProperties("/dav/a/b.txt", environ)
+        self.pm.getPropertyDicts(["/dav/a/b.txt"], environ)
+        self.pm.removeProperty("/dav/a/b.txt", "{ns1:}foo", False, environ)
+        assert environs and all(e is environ for e in environs)
+
+
+# ========================================================================
+# MongoTest
+# ========================================================================
+@unittest.skipIf(mongomock is None, "Requires pymongo and mongomock")
+class MongoTest(BasicTest):
+    """Test mongo_property_manager.MongoPropertyManager() with mongomock."""
+
+    def setUp(self):
+        self.pm = mongo_property_manager.MongoPropertyManager(
+            {"client": mongomock.MongoClient()})
+
+    def tearDown(self):
+        self.pm = None
+
+    def testOpen(self):
+        """Indexes are created on first use."""
+        assert self.pm.conn is None
+        assert "_url_1" in self.pm.collection.index_information()
+
+    def testFork(self):
+        """The connection is opened per process."""
+        pm = mongo_property_manager.MongoPropertyManager({"host": "localhost"})
+        assert pm.multiProcessSafe and pm.conn is None
+        # A passed client is shared by forked processes
+        assert not self.pm.multiProcessSafe
+
+        connect = self.pm._connect
+        connects = []
+
+        def _connect():
+            connects.append(True)
+            connect()
+
+        self.pm._connect = _connect
+        self.pm.writeProperty("/dav/a", "{ns1:}foo", "1")
+        self.pm.getProperty("/dav/a", "{ns1:}foo")
+        assert len(connects) == 1
+        self.pm._pid = -1  # Simulate a fork
+        assert self.pm.getProperty("/dav/a", "{ns1:}foo") == "1"
+        assert len(connects) == 2
+
+    def testValidation(self):
+        """Property manager should raise errors on bad args."""
+        pm = self.pm
+        self.assertRaises(AssertionError,
+                          pm.writeProperty, None, "{ns1:}foo", "hurz", False)
+        self.assertRaises(AssertionError,
+                          pm.writeProperty, "/dav/res", "_url", "hurz", False)
+
+    def testTree(self):
+        """Bulk reads and recursive moves."""
+        pm = self.pm
+        for url in ("/dav/a/", "/dav/a/b", "/dav/a/c/", "/dav/a/c/d", "/dav/ab"):
+            pm.writeProperty(url, "{ns1:}foo.bar", url)
+        pm.writeProperty("/dav/y/old", "{ns1:}foo.bar", "old")
+
+        pm.moveProperties("/dav/a/", "/dav/y/", withChildren=True)
+        urls = pm.getPropertyDicts(
+            ["/dav/a/", "/dav/a/b", "/dav/y/", "/dav/y/b", "/dav/y/c/d", "/dav/y/old", "/dav/ab"])
+        assert sorted(urls.keys()) == ["/dav/ab", "/dav/y/", "/dav/y/b", "/dav/y/c/d"]
+        assert urls["/dav/y/c/d"] == {"{ns1:}foo.bar": "/dav/a/c/d"}
+
+        pm.copyProperties("/dav/ab", "/dav/z")
+        pm.moveProperties("/dav/ab", "/dav/x", withChildren=False)
+        assert pm.getProperties("/dav/ab") == []
+        assert pm.getProperty("/dav/x", "{ns1:}foo.bar") == "/dav/ab"
+        assert pm.getProperty("/dav/z", "{ns1:}foo.bar") == "/dav/ab"
+
+        pm.copyProperties("/dav/y/", "/dav/w/", withChildren=True)
+        assert pm.getProperty("/dav/w/c/d", "{ns1:}foo.bar") == "/dav/a/c/d"
+        pm.removeProperties("/dav/y/", withChildren=True)
+        assert pm.getPropertyDicts(["/dav/y/", "/dav/y/c/d"]) == {}
+        assert pm.getProperties("/dav/w/") == ["{ns1:}foo.bar"]
+
+
+# ========================================================================
+# CouchTest
+# ========================================================================
+class _Row(object):
+    def __init__(self, doc):
+        self.key = doc["url"]
+        self.doc = doc
+
+
+class _FakeCouchDB(object):
+    """Emulate the key range lookup of the 'properties/by_url' view."""
+
+    def __init__(self, urls):
+        self.docs = [{"url": url} for url in sorted(urls)]
+        self.queries = []
+
+    def view(self, name, key=None, startkey=None, endkey=None, include_docs=False):
+        self.queries.append((name, startkey, endkey))
+        return [_Row(doc) for doc in self.docs
+                if (startkey is None or doc["url"] >= startkey)
+                and (endkey is None or doc["url"] <= endkey)]
+
+
+class CouchTest(unittest.TestCase):
+    """Test couch_property_manager.CouchPropertyManager() with a fake view."""
+
+    def setUp(self):
+        # The view is mocked, so the couchdb package is not needed
+        savedModule = sys.modules.get("couchdb")
+        if savedModule is None:
+            sys.modules["couchdb"] = types.ModuleType("couchdb")
+        try:
+            from wsgidav.addons import couch_property_manager
+        finally:
+            if savedModule is None:
+                del sys.modules["couchdb"]
+        self.pm = couch_property_manager.CouchPropertyManager.__new__(
+            couch_property_manager.CouchPropertyManager)
+        self.pm.db = _FakeCouchDB(["/dav/a", "/dav/a-x", "/dav/a/b", "/dav/a/c/d",
+                                   u"/dav/a/\u00e4", "/dav/ab"])
+
+    def testDescendents(self):
+        """Descendants are found with one key range query."""
+        docs = self.pm._findDocs("/dav/a/", True)
+        assert sorted(doc["url"] for doc in docs) == [
+            "/dav/a", "/dav/a/b", "/dav/a/c/d", u"/dav/a/\u00e4"]
+        assert self.pm.db.queries == [("properties/by_url", "/dav/a", u"/dav/a/\ufff0")]
+        assert compat.is_unicode(self.pm.db.queries[0][2])
+
+
+# ========================================================================
+# StripedTest
+# ========================================================================
+class StripedTest(BasicTest):
+    """Test property_manager.StripedPropertyManager()."""
+
+    def setUp(self):
+        self.pm = property_manager.StripedPropertyManager()
+        self.pm._verbose = 2
+
+    def testValidation(self):
+        """Property manager should raise errors on bad args."""
+        pm = self.pm
+        self.assertRaises(AssertionError,
+                          pm.writeProperty, None, "{ns1:}foo", "hurz", False)
+        self.assertRaises(AssertionError,
+                          pm.writeProperty, "/dav/res", None, "hurz", False)
+
+    def testFactory(self):
+        """Partitions must be dict based."""
+        path = os.path.join(gettempdir(), "wsgidav-props.sqlite")
+        pm = property_manager.StripedPropertyManager(
+            lambda prefix: property_manager.SQLitePropertyManager(path))
+        self.assertRaises(AssertionError, pm.getProperties, "/dav/res")
+
+    def testPartitions(self):
+        """Shares are stored in separate partitions."""
+        pm = self.pm
+        for url in ("/dav/a/", "/dav/a/b", "/dav/ab", "/other/c"):
+            pm.writeProperty(url, "{ns1:}foo", url)
+        assert sorted(pm._partitions.keys()) == ["/dav", "/other"]
+        assert pm._partitions["/dav"]._lock is not pm._partitions["/other"]._lock
+
+        # Move between partitions
+        pm.moveProperties("/dav/a/", "/other/x/", withChildren=True)
+        assert pm.getProperties("/dav/a/b") == []
+        assert pm.getProperty("/other/x/b", "{ns1:}foo") == "/dav/a/b"
+        assert pm.getProperty("/dav/ab", "{ns1:}foo") == "/dav/ab"
+
+        pm.copyProperties("/other/c", "/dav/c")
+        assert pm.getProperty("/dav/c", "{ns1:}foo") == "/other/c"
+        assert pm.getProperty("/other/c", "{ns1:}foo") == "/other/c"
+
+        # Move inside one partition
+        pm.moveProperties("/other/x/", "/other/y/", withChildren=True)
+        assert pm.getProperty("/other/y/b", "{ns1:}foo") == "/dav/a/b"
+        assert sorted(pm._partitions["/other"]._dict.keys()) == [
+            "/other/c", "/other/y/", "/other/y/b"]
+
+        # Remove the root collection from all partitions
+        pm.removeProperties("/", withChildren=True)
+        assert pm.getResourceCount() == 0
+
+    def testPartitionLock(self):
+        """The partitions lock is only acquired to create a partition."""
+        pm = self.pm
+        acquired = []
+
+        class RecordingLock(object):
+            def __init__(self):
+                self._lock = threading.Lock()
+
+            def __enter__(self):
+                acquired.append(True)
+                return self._lock.__enter__()
+
+            def __exit__(self, *args):
+                return self._lock.__exit__(*args)
+
+        pm._partitionsLock = RecordingLock()
+        pm.writeProperty("/dav/a", "{ns1:}foo", "1")
+        assert len(acquired) == 1
+        pm.writeProperty("/dav/b", "{ns1:}foo", "2")
+        assert pm.getProperty("/dav/a", "{ns1:}foo") == "1"
+        assert len(acquired) == 1
+        pm.getProperties("/other/c")
+        assert len(acquired) == 2
+
+
 # ========================================================================
 
 
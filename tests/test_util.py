@@ -5,13 +5,17 @@
 """Unit tests for wsgidav.util"""
 from __future__ import print_function
 
+import json
 import logging
 import logging.handlers
+import time
 import unittest
 
+from wsgidav import access_log
 from wsgidav.compat import StringIO
 
 from wsgidav.util import (
+    PassThroughIterator,
     initLogging,
     isChildUri,
     isEqualOrChildUri,
@@ -21,6 +25,8 @@ from wsgidav.util import (
     shiftPath,
     getModuleLogger, BASE_LOGGER_NAME,
     )
+from wsgidav.share_router import ShareRouter
+from wsgidav.xml_tools import XMLValueCache
 
 
 class BasicTest(unittest.TestCase):
@@ -84,6 +90,24 @@ class BasicTest(unittest.TestCase):
         self.assertEqual(shiftPath("/a/b/c", ""),
                          ("", "/a/b/c", ""))
 
+    def testPassThroughIterator(self):
+        """Return the first chunk, then the rest, and pass on close()."""
+        closed = []
+
+        def gen():
+            try:
+                yield b"b"
+                yield b"c"
+            finally:
+                closed.append("gen")
+
+        app_iter = gen()
+        it = PassThroughIterator([b"a"], app_iter, onClose=lambda: closed.append("cb"))
+        assert list(it) == [b"a", b"b", b"c"]
+        it.close()
+        it.close()
+        assert closed == ["gen", "cb"]
+
 
 class LoggerTest(unittest.TestCase):
     """Test configurable logging."""
@@ -198,5 +222,110 @@ class LoggerTest(unittest.TestCase):
         assert baseOutput == ""
 
 
+class AccessLogTest(unittest.TestCase):
+    """Test AccessLogger."""
+
+    def setUp(self):
+        self.buffer = StringIO()
+        self.handler = logging.StreamHandler(self.buffer)
+        logging.getLogger(BASE_LOGGER_NAME).addHandler(self.handler)
+
+    def tearDown(self):
+        access_log.stopAsyncWriter()
+        logging.getLogger(BASE_LOGGER_NAME).removeHandler(self.handler)
+        self.handler.close()
+
+    def _log(self, logger, method, status="200 OK", **environ):
+        environ.update({"REQUEST_METHOD": method,
+                        "PATH_INFO": "/dav/file.txt",
+                        "REMOTE_ADDR": "127.0.0.1",
+                        })
+        logger.log(environ, status, time.time() - 0.5)
+
+    def testAccessLog(self):
+        logger = access_log.AccessLogger({"access_log_format": "json",
+                                          "access_log_sampling": {"propfind": 0},
+                                          })
+        self._log(logger, "GET", HTTP_DEPTH="1", CONTENT_LENGTH="")
+        self._log(logger, "PROPFIND")
+        self._log(logger, "PROPFIND", status="404 Not Found")
+        # Pending entries are written on stop
+        access_log.stopAsyncWriter()
+        entries = [json.loads(line) for line in self.buffer.getvalue().splitlines()]
+        assert [(e["method"], e["status"]) for e in entries] == [("GET", 200), ("PROPFIND", 404)]
+        assert entries[0]["depth"] == "1" and "length" not in entries[0]
+        assert entries[0]["elapsed_ms"] >= 500 and entries[0]["user"] is None
+        assert entries[1]["sample_rate"] == 0
+
+        logger = access_log.AccessLogger({"access_log_async": False})
+        assert not logger.asyncWrite
+        self._log(logger, "MOVE", "201 Created", HTTP_DESTINATION="/dav/b.txt",
+                  **{"http_authenticator.username": "tester"})
+        line = self.buffer.getvalue().splitlines()[-1]
+        assert line.startswith("127.0.0.1 - tester - [")
+        assert '"MOVE /dav/file.txt" dest="/dav/b.txt", elap=0.5' in line
+        assert line.endswith(" -> 201 Created")
+
+
+class XMLValueCacheTest(unittest.TestCase):
+    """Test xml_tools.XMLValueCache."""
+
+    def testCache(self):
+        cache = XMLValueCache(maxSize=2)
+        v1 = b'<ns0:foo xmlns:ns0="ns1:">1</ns0:foo>'
+        v2 = b'<ns0:foo xmlns:ns0="ns1:">2</ns0:foo>'
+
+        el = cache.getElement("/a", "{ns1:}foo", v1)
+        assert el.text == "1"
+        el2 = cache.getElement("/a", "{ns1:}foo", v1)
+        assert el2.text == "1" and el2 is not el, "Must return copies"
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # A modified value is never served from cache
+        assert cache.getElement("/a", "{ns1:}foo", v2).text == "2"
+        assert cache.misses == 2
+
+        # LRU eviction by resource
+        cache.getElement("/b/c", "{ns1:}foo", v1)
+        cache.getElement("/b/d", "{ns1:}foo", v1)
+        assert list(cache._urls.keys()) == ["/b/c", "/b/d"]
+
+        cache.invalidate("/b", withChildren=True)
+        assert not cache._urls and cache._count == 0
+
+
+class ShareRouterTest(unittest.TestCase):
+    """Test ShareRouter."""
+
+    def testResolve(self):
+        router = ShareRouter(["/pub", "/home/joe", "/home"])
+        assert len(router) == 3
+        assert router.resolve("/") is None
+        assert router.resolve("/pub") == "/pub"
+        assert router.resolve("/PUB/a/b.txt") == "/pub"
+        assert router.resolve("/pub2/a") is None
+        assert router.resolve("/home/Joe/") == "/home/joe"
+        assert router.resolve("/home/jane") == "/home"
+        assert router.resolve("/homes") is None
+
+        router.addShare("/")
+        assert router.resolve("/pub2/a") == "/"
+        assert router.resolve("*") == "/"
+        assert router.resolve("") == "/"
+
+        assert router.removeShare("/home/joe")
+        assert not router.removeShare("/home/joe")
+        assert not router.removeShare("/home/joe/sub")
+        assert router.resolve("/home/joe/a") == "/home"
+        assert router.removeShare("/home")
+        assert "HOME" not in router._root.children, "Empty branches are pruned"
+        assert sorted(router.getShares()) == ["/", "/pub"]
+
+    def testManyShares(self):
+        router = ShareRouter("/user{}".format(i) for i in range(5000))
+        assert router.resolve("/user4711/file.txt") == "/user4711"
+        assert router.resolve("/user5000/file.txt") is None
+
+
 if __name__ == "__main__":
     unittest.main()
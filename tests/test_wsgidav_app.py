@@ -13,14 +13,19 @@
 """
 from __future__ import print_function
 
+import marshal
 import os
 import shutil
 import sys
 import unittest
 from tempfile import gettempdir
 
-from wsgidav import compat, util
+from wsgidav import compat, fs_dav_provider, util
+from wsgidav.error_printer import ErrorPrinter
 from wsgidav.fs_dav_provider import FilesystemProvider
+from wsgidav.metrics import WsgiDavMetrics
+from wsgidav.profiler import WsgiDavProfiler
+from wsgidav.property_manager import PropertyManager, SQLitePropertyManager
 from wsgidav.wsgidav_app import DEFAULT_CONFIG, WsgiDAVApp
 
 try:
@@ -41,7 +46,7 @@ except ImportError:
 class ServerTest(unittest.TestCase):
     """Test wsgidav_app using paste.fixture."""
 
-    def _makeWsgiDAVApp(self, withAuthentication):
+    def _makeWsgiDAVApp(self, withAuthentication, configOverrides=None):
         self.rootpath = os.path.join(gettempdir(), "wsgidav-test")
         if not os.path.exists(self.rootpath):
             os.mkdir(self.rootpath)
@@ -70,6 +75,9 @@ class ServerTest(unittest.TestCase):
             config["acceptdigest"] = False
             config["defaultdigest"] = False
 
+        if configOverrides:
+            config.update(configOverrides)
+
         return WsgiDAVApp(config)
 
     def setUp(self):
@@ -199,6 +207,493 @@ class ServerTest(unittest.TestCase):
         # Male sign (only utf8)
         __testrw(unicode_to_url(u"/file male(\u2642).txt"))
 
+    def testWin32Props(self):
+        """Map Win32 properties to file metadata."""
+        wsgi_app = self._makeWsgiDAVApp(False, {"propsmanager": True, "map_win32_props": True})
+        app = webtest.TestApp(wsgi_app)
+        app.put("/file1.txt", params=b"test", status=201)
+        propManager = wsgi_app.providerMap["/"]["provider"].propManager
+        deadReads = []
+        getProperty = propManager.getProperty
+
+        def _getProperty(normurl, propname, environ=None):
+            deadReads.append(propname)
+            return getProperty(normurl, propname, environ)
+
+        propManager.getProperty = _getProperty
+
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="urn:schemas-microsoft-com:"><D:set><D:prop>
+<Z:Win32CreationTime>Wed, 04 Apr 2018 10:00:00 GMT</Z:Win32CreationTime>
+<Z:Win32LastModifiedTime>Thu, 05 Apr 2018 10:00:00 GMT</Z:Win32LastModifiedTime>
+<Z:Win32FileAttributes>00000021</Z:Win32FileAttributes>
+</D:prop></D:set></D:propertyupdate>"""
+        res = app.request("/file1.txt", method="PROPPATCH", body=body, status=207)
+        assert res.body.count(b"200 OK") == 1
+        filePath = os.path.join(self.rootpath, "file1.txt")
+        assert os.stat(filePath).st_mtime == 1522922400
+        assert propManager.getProperties("/file1.txt") == [], "No dead properties"
+        if fs_dav_provider._xattrSupported:
+            assert deadReads == [], "Stored as extended attribute without dead fallback"
+
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propfind xmlns:D="DAV:" xmlns:Z="urn:schemas-microsoft-com:"><D:prop>
+<Z:Win32LastModifiedTime/><Z:Win32FileAttributes/>
+</D:prop></D:propfind>"""
+        res = app.request("/file1.txt", method="PROPFIND", body=body,
+                          headers={"Depth": "0"}, status=207)
+        assert b">Thu, 05 Apr 2018 10:00:00 GMT<" in res.body
+        assert b">00000021<" in res.body
+
+        # Default attributes are not stored
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="urn:schemas-microsoft-com:"><D:set><D:prop>
+<Z:Win32FileAttributes>00000020</Z:Win32FileAttributes>
+</D:prop></D:set></D:propertyupdate>"""
+        app.request("/file1.txt", method="PROPPATCH", body=body, status=207)
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propfind xmlns:D="DAV:" xmlns:Z="urn:schemas-microsoft-com:"><D:prop>
+<Z:Win32FileAttributes/></D:prop></D:propfind>"""
+        res = app.request("/file1.txt", method="PROPFIND", body=body,
+                          headers={"Depth": "0"}, status=207)
+        assert b">00000020<" in res.body
+        if fs_dav_provider._xattrSupported:
+            assert deadReads == []
+
+    def testWin32PropsFallback(self):
+        """Store Win32FileAttributes as dead property without extended attributes."""
+        wsgi_app = self._makeWsgiDAVApp(False, {"propsmanager": True, "map_win32_props": True})
+        app = webtest.TestApp(wsgi_app)
+        propManager = wsgi_app.providerMap["/"]["provider"].propManager
+        app.put("/file1.txt", params=b"test", status=201)
+        xattrSupported = fs_dav_provider._xattrSupported
+        fs_dav_provider._xattrSupported = False
+        try:
+            body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="urn:schemas-microsoft-com:"><D:set><D:prop>
+<Z:Win32FileAttributes>00000021</Z:Win32FileAttributes>
+</D:prop></D:set></D:propertyupdate>"""
+            app.request("/file1.txt", method="PROPPATCH", body=body, status=207)
+            assert propManager.getProperties("/file1.txt") == [
+                "{urn:schemas-microsoft-com:}Win32FileAttributes"]
+
+            # The attributes are moved with the file
+            app.request("/file1.txt", method="MOVE", headers={"Destination": "/file2.txt"},
+                        status=201)
+            body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propfind xmlns:D="DAV:" xmlns:Z="urn:schemas-microsoft-com:"><D:prop>
+<Z:Win32FileAttributes/></D:prop></D:propfind>"""
+            res = app.request("/file2.txt", method="PROPFIND", body=body,
+                              headers={"Depth": "0"}, status=207)
+            assert b">00000021<" in res.body
+
+            # Default attributes are not stored
+            body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="urn:schemas-microsoft-com:"><D:set><D:prop>
+<Z:Win32FileAttributes>00000020</Z:Win32FileAttributes>
+</D:prop></D:set></D:propertyupdate>"""
+            app.request("/file2.txt", method="PROPPATCH", body=body, status=207)
+            assert propManager.getProperties("/file2.txt") == []
+        finally:
+            fs_dav_provider._xattrSupported = xattrSupported
+
+    def testAddRemoveProvider(self):
+        """Publish and unpublish shares at runtime."""
+        wsgi_app = self._makeWsgiDAVApp(False)
+        app = webtest.TestApp(wsgi_app)
+        app.put("/file1.txt", params=b"test", status=201)
+        os.mkdir(os.path.join(self.rootpath, "sub"))
+
+        provider = wsgi_app.addProvider("/Sub/Share", os.path.join(self.rootpath, "sub"))
+        assert isinstance(provider, FilesystemProvider)
+        app.put("/sub/share/file2.txt", params=b"test2", status=201)
+        assert os.path.isfile(os.path.join(self.rootpath, "sub", "file2.txt"))
+
+        # Request servers are re-used per provider
+        servers = wsgi_app._requestResolver._servers
+        server = servers[provider]
+        app.get("/sub/share/file2.txt", status=200)
+        assert servers[provider] is server
+
+        assert wsgi_app.removeProvider("/Sub/Share")
+        assert not wsgi_app.removeProvider("/Sub/Share")
+        assert provider not in servers
+        app.get("/sub/share/file2.txt", status=404)
+        app.get("/sub/file2.txt", status=200)
+
+    def testPerShareManagers(self):
+        """Configure lock and property managers per share."""
+        sharedProps = PropertyManager()
+        folder = {}
+        for name in ("a", "b", "c", "d"):
+            folder[name] = os.path.join(self.rootpath, name)
+            os.mkdir(folder[name])
+        wsgi_app = self._makeWsgiDAVApp(False, {
+            "propsmanager": True,
+            "provider_mapping": {
+                "/a": folder["a"],
+                "/b": {"provider": folder["b"], "propsmanager": sharedProps},
+                "/c": {"provider": folder["c"], "propsmanager": sharedProps,
+                       "locksmanager": True},
+                "/d": {"provider": folder["d"], "propsmanager": False, "locksmanager": False},
+                },
+            })
+        providers = dict((share, data["provider"])
+                         for share, data in wsgi_app.providerMap.items())
+
+        assert providers["/a"].propManager is wsgi_app._propsManager
+        assert providers["/b"].propManager is sharedProps
+        assert providers["/c"].propManager is sharedProps
+        assert providers["/d"].propManager is None
+        assert providers["/a"].lockManager is providers["/b"].lockManager
+        assert providers["/c"].lockManager not in (None, providers["/a"].lockManager)
+        assert providers["/d"].lockManager is None
+        assert providers["/d"].propValueCache is None
+
+        app = webtest.TestApp(wsgi_app)
+        app.put("/c/file1.txt", params=b"test", status=201)
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:lockinfo xmlns:D="DAV:"><D:lockscope><D:exclusive/></D:lockscope>
+<D:locktype><D:write/></D:locktype></D:lockinfo>"""
+        app.request("/c/file1.txt", method="LOCK", body=body, status=200)
+        assert providers["/c"].lockManager.isUrlLocked("/c/file1.txt")
+        assert not providers["/a"].lockManager.isUrlLocked("/c/file1.txt")
+
+    def testRecursiveProperties(self):
+        """Recursive COPY copies dead properties with range calls."""
+        calls = []
+
+        class RecordingPropertyManager(SQLitePropertyManager):
+            def removeProperties(self, normurl, environ=None, withChildren=False):
+                calls.append(("remove", normurl, withChildren))
+                return super(RecordingPropertyManager, self).removeProperties(
+                    normurl, environ, withChildren)
+
+            def copyProperties(self, srcurl, desturl, environ=None, withChildren=False):
+                calls.append(("copy", srcurl, desturl, withChildren))
+                return super(RecordingPropertyManager, self).copyProperties(
+                    srcurl, desturl, environ, withChildren)
+
+        propManager = RecordingPropertyManager(
+            os.path.join(gettempdir(), "wsgidav-test-props.sqlite"))
+        propManager.clear()
+        wsgi_app = self._makeWsgiDAVApp(False, {"propsmanager": propManager})
+        app = webtest.TestApp(wsgi_app)
+        app.request("/a/", method="MKCOL", status=201)
+        app.request("/a/b/", method="MKCOL", status=201)
+        app.put("/a/b/file1.txt", params=b"test", status=201)
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="test:"><D:set><D:prop>
+<Z:foo>bar</Z:foo></D:prop></D:set></D:propertyupdate>"""
+        app.request("/a/b/file1.txt", method="PROPPATCH", body=body, status=207)
+
+        del calls[:]
+        app.request("/a/", method="COPY", headers={"Destination": "/c/"}, status=201)
+        assert calls == [("remove", "/c/", True), ("copy", "/a/", "/c/", True)], calls
+        assert propManager.getProperties("/c/b/file1.txt") == ["{test:}foo"]
+
+        del calls[:]
+        app.request("/c/", method="DELETE", status=204)
+        # Members are deleted one by one, so a partial failure is reported
+        # per member and the surviving members keep their properties
+        assert calls == [("remove", "/c/b/file1.txt", True),
+                         ("remove", "/c/b/", True),
+                         ("remove", "/c/", True),
+                         ], calls
+        assert propManager.getProperties("/c/b/file1.txt") == []
+        assert propManager.getProperties("/a/b/file1.txt") == ["{test:}foo"]
+        propManager._close()
+
+    def testLegacyPropertyManager(self):
+        """Property managers without `withChildren` are called per resource."""
+        calls = []
+
+        class LegacyPropertyManager(PropertyManager):
+            supportsWithChildren = False
+
+            def removeProperties(self, normurl, environ=None):
+                calls.append(("remove", normurl))
+                return super(LegacyPropertyManager, self).removeProperties(normurl, environ)
+
+            def copyProperties(self, srcurl, desturl, environ=None):
+                calls.append(("copy", srcurl, desturl))
+                return super(LegacyPropertyManager, self).copyProperties(
+                    srcurl, desturl, environ)
+
+        propManager = LegacyPropertyManager()
+        wsgi_app = self._makeWsgiDAVApp(False, {"propsmanager": propManager})
+        app = webtest.TestApp(wsgi_app)
+        app.request("/a/", method="MKCOL", status=201)
+        app.request("/a/b/", method="MKCOL", status=201)
+        app.put("/a/b/file1.txt", params=b"test", status=201)
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="test:"><D:set><D:prop>
+<Z:foo>bar</Z:foo></D:prop></D:set></D:propertyupdate>"""
+        app.request("/a/b/file1.txt", method="PROPPATCH", body=body, status=207)
+
+        del calls[:]
+        app.request("/a/", method="COPY", headers={"Destination": "/c/"}, status=201)
+        assert sorted(calls) == [("copy", "/a/", "/c/"),
+                                 ("copy", "/a/b/", "/c/b/"),
+                                 ("copy", "/a/b/file1.txt", "/c/b/file1.txt"),
+                                 ], calls
+        assert propManager.getProperties("/c/b/file1.txt") == ["{test:}foo"]
+
+        del calls[:]
+        app.request("/c/", method="DELETE", status=204)
+        assert calls == [("remove", "/c/b/file1.txt"),
+                         ("remove", "/c/b/"),
+                         ("remove", "/c/"),
+                         ], calls
+        assert propManager.getProperties("/c/b/file1.txt") == []
+
+    def testMetrics(self):
+        """Serve request metrics in Prometheus format."""
+        config = {"propsmanager": True,
+                  "middleware_stack": DEFAULT_CONFIG["middleware_stack"] + [WsgiDavMetrics],
+                  }
+        wsgi_app = self._makeWsgiDAVApp(False, config)
+        app = webtest.TestApp(wsgi_app)
+        app.put("/file1.txt", params=b"test", status=201)
+        app.get("/file1.txt", status=200)
+        app.get("/file2.txt", status=404)
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="http://example.com/ns"><D:set><D:prop>
+<Z:foo>bar</Z:foo></D:prop></D:set></D:propertyupdate>"""
+        app.request("/file1.txt", method="PROPPATCH", body=body, status=207)
+
+        res = app.get("/_metrics", status=200)
+        assert res.content_type == "text/plain"
+        text = res.text
+        assert 'wsgidav_requests_total{method="GET",share="/"} 2' in text
+        assert 'wsgidav_requests_total{method="PUT",share="/"} 1' in text
+        assert 'wsgidav_responses_total{status="404"} 1' in text
+        assert 'wsgidav_request_duration_seconds_bucket{method="GET",le="+Inf"} 2' in text
+        assert 'wsgidav_request_duration_seconds_count{method="PUT"} 1' in text
+        assert 'wsgidav_request_bytes_total{{share="/"}} {}'.format(4 + len(body)) in text
+        assert "wsgidav_requests_in_flight 0" in text
+        assert "wsgidav_locks 0" in text
+        assert "wsgidav_property_resources 1" in text
+
+    def testServerTiming(self):
+        """Report request phases in the Server-Timing header."""
+        wsgi_app = self._makeWsgiDAVApp(False, {"server_timing": True})
+        app = webtest.TestApp(wsgi_app)
+        res = app.put("/file1.txt", params=b"test", status=201)
+        timing = res.headers["Server-Timing"]
+        assert "route;dur=" in timing and "auth;dur=" in timing
+        assert "locks;dur=" in timing and "xml;dur" not in timing
+
+        res = app.request("/", method="PROPFIND", headers={"Depth": "1"}, status=207)
+        phases = [part.split(";")[0] for part in res.headers["Server-Timing"].split(", ")]
+        assert phases == ["route", "auth", "resource", "props", "xml", "total"]
+
+        # Disabled by default
+        res = self.app.get("/", status=200)
+        assert "Server-Timing" not in res.headers
+
+    def testProfiler(self):
+        """Profile requests and serve the statistics to authenticated users."""
+        stack = list(DEFAULT_CONFIG["middleware_stack"])
+        stack.insert(1, WsgiDavProfiler)
+        config = {"middleware_stack": stack,
+                  "profiler": {"sample_rate": 1.0, "users": ["tester"]},
+                  }
+        app = webtest.TestApp(self._makeWsgiDAVApp(True, config))
+        app.get("/?profile_dump", status=401)
+        app.authorization = ("Basic", ("tester", "secret"))
+        app.put("/file1.txt", params=b"test", status=201)
+        for _ in range(2):
+            app.request("/", method="PROPFIND", headers={"Depth": "1"}, status=207)
+
+        res = app.get("/?profile_dump", status=200)
+        assert "=== PROPFIND / (2 requests) ===" in res.text
+        assert "=== PUT / (1 requests) ===" in res.text
+        assert "doPROPFIND" in res.text
+
+        res = app.get("/?profile_dump=pstats", status=200)
+        stats = marshal.loads(res.body)
+        assert any(func[2] == "doPUT" for func in stats)
+
+        app.get("/?profile_reset", status=200)
+        assert "No requests profiled yet" in app.get("/?profile_dump").text
+
+        # Only listed users may read the profiles
+        config["profiler"]["users"] = ["admin"]
+        app = webtest.TestApp(self._makeWsgiDAVApp(True, config))
+        app.authorization = ("Basic", ("tester", "secret"))
+        app.get("/?profile_dump", status=403)
+
+    def testCallStats(self):
+        """Count provider and manager calls per request."""
+        config = {"propsmanager": True,
+                  "call_stats": {"enable": True, "max_calls_per_resource": 2, "min_calls": 5},
+                  }
+        wsgi_app = self._makeWsgiDAVApp(False, config)
+        checker = wsgi_app._callStatsChecker
+        reports = []
+        check = checker.check
+
+        def _check(environ, counter):
+            reports.append((environ["REQUEST_METHOD"], dict(counter.counts),
+                            check(environ, counter)))
+
+        checker.check = _check
+        app = webtest.TestApp(wsgi_app)
+        for i in range(5):
+            app.put("/file{}.txt".format(i), params=b"test", status=201)
+        app.request("/", method="PROPFIND", headers={"Depth": "1"}, status=207)
+
+        method, counts, reported = reports[-1]
+        assert method == "PROPFIND" and not reported
+        assert counts["propManager.getPropertyDicts"] == 1
+        # The lock discovery is done per resource
+        assert counts["lockManager.getUrlLockList"] == 6
+        assert "provider.getResourceInst" in counts
+
+        checker.maxCallsPerResource = 1
+        app.request("/", method="PROPFIND", headers={"Depth": "1"}, status=207)
+        assert reports[-1][2] is True
+        assert "wsgidav.call_counter" not in self.app.get("/file0.txt").request.environ
+
+        # PROPPATCH still stages all changes in one transaction
+        propManager = wsgi_app._propsManager
+        commits = []
+        commitTransaction = propManager._commitTransaction
+
+        def _commitTransaction(staged, environ=None):
+            commits.append(len(staged))
+            return commitTransaction(staged, environ)
+
+        propManager._commitTransaction = _commitTransaction
+        body = b"""<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:Z="test:"><D:set><D:prop>
+<Z:foo>1</Z:foo><Z:bar>2</Z:bar></D:prop></D:set></D:propertyupdate>"""
+        app.request("/file0.txt", method="PROPPATCH", body=body, status=207)
+        method, counts, reported = reports[-1]
+        assert method == "PROPPATCH"
+        assert counts["propManager.beginTransaction"] == 1
+        assert commits == [2]
+        assert sorted(propManager.getProperties("/file0.txt")) == ["{test:}bar", "{test:}foo"]
+
+    def testRequestServerConfig(self):
+        """Static options are evaluated by the cached request server."""
+        wsgi_app = self._makeWsgiDAVApp(False, {
+            "response_headers": [("X-Custom", "foo")],
+            "add_header_MS_Author_Via": True,
+            "provider_mapping": {"/": self.rootpath,
+                                 "/ro": FilesystemProvider(self.rootpath, readonly=True)},
+            })
+        app = webtest.TestApp(wsgi_app)
+        app.put("/file1.txt", params=b"test", status=201)
+        for _ in range(2):
+            res = app.get("/file1.txt", status=200)
+            assert res.headers["X-Custom"] == "foo"
+        res = app.request("/file1.txt", method="OPTIONS", status=200)
+        assert res.headers["MS-Author-Via"] == "DAV"
+        # Read-only shares don't dispatch write methods
+        app.request("/ro/file1.txt", method="DELETE", status=405)
+        app.request("/ro/file1.txt", method="FOO", status=405)
+
+    def testPassThrough(self):
+        """Middlewares pass the response iterator through."""
+        data = b"x" * 20000
+
+        def _get(wsgi_app):
+            environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/file1.txt", "SCRIPT_NAME": "",
+                       "wsgi.input": compat.BytesIO(), "CONTENT_LENGTH": "0"}
+            status = []
+            res = wsgi_app(environ, lambda s, headers, exc_info=None: status.append(s))
+            body = b"".join(res)
+            res.close()
+            return status, body, res
+
+        app = self.app
+        app.put("/file1.txt", params=data, status=201)
+        status, body, res = _get(app.app)
+        assert status == ["200 OK"] and body == data
+        assert isinstance(res, util.PassThroughIterator)
+
+        # WsgiDavDebugFilter is only used with verbose >= 3
+        def _middlewares(wsgi_app):
+            res = []
+            mw = wsgi_app._application
+            while hasattr(mw, "_application"):
+                res.append(mw.__class__.__name__)
+                mw = mw._application
+            return res
+
+        assert "WsgiDavDebugFilter" not in _middlewares(app.app)
+        wsgi_app = self._makeWsgiDAVApp(False, {"verbose": 3, "response_pass_through": False})
+        assert "WsgiDavDebugFilter" in _middlewares(wsgi_app)
+        status, body, res = _get(wsgi_app)
+        assert status == ["200 OK"] and body == data
+        assert not isinstance(res, util.PassThroughIterator)
+
+        # Errors are still reported
+        app.get("/not_existing.txt", status=404)
+
+    def testPassThroughClose(self):
+        """ErrorPrinter closes the response iterator, if the first chunk fails."""
+        closed = []
+
+        class FailingIterator(object):
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                raise ValueError("failed")
+
+            next = __next__
+
+            def close(self):
+                closed.append(True)
+
+        def app(environ, start_response):
+            return FailingIterator()
+
+        for catchall in (False, True):
+            del closed[:]
+            errorPrinter = ErrorPrinter(app, {"catchall": catchall})
+            status = []
+            try:
+                res = errorPrinter({}, lambda s, headers, exc_info=None: status.append(s))
+            except ValueError:
+                assert not catchall
+            else:
+                assert catchall and status == ["500 Internal Server Error"]
+                b"".join(res)
+            assert closed == [True]
+
+    def testRejectUnreadBody(self):
+        """Rejected uploads are discarded or the connection is closed."""
+        wsgi_app = self._makeWsgiDAVApp(True, {"discard_input_limit": 1000})
+
+        def _put(size, **headers):
+            environ = {"REQUEST_METHOD": "PUT", "PATH_INFO": "/file1.txt", "SCRIPT_NAME": "",
+                       "wsgi.input": compat.BytesIO(b"x" * size),
+                       "CONTENT_LENGTH": str(size)}
+            environ.update(headers)
+            result = []
+            res = wsgi_app(environ, lambda s, headers, exc_info=None: result.extend([s, headers]))
+            b"".join(res)
+            status, headers = result
+            assert status.startswith("401")
+            return environ["wsgi.input"].tell(), ("Connection", "close") in headers
+
+        # Small bodies are read, so the connection can be re-used
+        assert _put(100) == (100, False)
+        # Big bodies are not read, but the connection is closed
+        assert _put(5000) == (0, True)
+        # The client waits for '100 Continue', i.e. the body was not sent yet
+        assert _put(100, HTTP_EXPECT="100-continue") == (0, True)
+        # Workaround for MiniRedir: always read the body
+        agent = "Microsoft-WebDAV-MiniRedir/6.1.7601"
+        assert _put(5000, HTTP_USER_AGENT=agent) == (5000, False)
+
+        # Unsupported expectations are refused
+        self.app.put("/file1.txt", params=b"test", headers={"Expect": "foo"}, status=417)
+
     def testAuthentication(self):
         """Require login."""
         # Prepare file content (currently without authentication)
@@ -0,0 +1,199 @@
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+Access log of :class:`~wsgidav.wsgidav_app.WsgiDAVApp`.
+
+One entry is logged per request (to the 'wsgidav.access_log' logger), either
+as text line (default) or as JSON object::
+
+    {"elapsed_ms": 3.1, "method": "PROPFIND", "path": "/dav/", "status": 207, ...}
+
+Entries are passed as lazy objects to a background thread, which renders them
+and writes them with the handlers of the 'wsgidav' base logger (using
+``QueueHandler`` and ``QueueListener``). So slow log destinations do not
+delay the responses. On Python 2, entries are written synchronously.
+
+High-volume methods can be sampled: ``access_log_sampling = {"PROPFIND": 0.1}``
+logs about 10% of the PROPFIND requests. Failed requests (status >= 400) are
+always logged.
+
+Entries include the durations of the request phases (auth, resource, props, ...)
+as ``timing`` field (see :class:`~wsgidav.util.PhaseTimer`).
+"""
+import atexit
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+from wsgidav import compat, util
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:  # Python 2
+    QueueHandler = QueueListener = None
+
+__docformat__ = "reStructuredText"
+
+_logger = util.getModuleLogger(__name__)
+
+# Request headers that are logged if present: (environ key, field name, text format)
+_EXTRA_FIELDS = (
+    ("HTTP_DESTINATION", "dest", 'dest="{}"'),
+    ("CONTENT_LENGTH", "length", "length={}"),
+    ("HTTP_DEPTH", "depth", "depth={}"),
+    ("HTTP_RANGE", "range", "range={}"),
+    ("HTTP_OVERWRITE", "overwrite", "overwrite={}"),
+    ("HTTP_EXPECT", "expect", 'expect="{}"'),
+    ("HTTP_CONNECTION", "connection", 'connection="{}"'),
+    ("HTTP_USER_AGENT", "agent", 'agent="{}"'),
+    ("HTTP_TRANSFER_ENCODING", "transfer_enc", "transfer-enc={}"),
+    )
+
+
+# ========================================================================
+# AccessLogEntry
+# ========================================================================
+class AccessLogEntry(object):
+    """Request data that is only rendered to a string when it is written."""
+
+    __slots__ = ("fields", "status", "jsonFormat")
+
+    def __init__(self, fields, status, jsonFormat=False):
+        self.fields = fields
+        self.status = status
+        self.jsonFormat = jsonFormat
+
+    def __str__(self):
+        fields = self.fields
+        if self.jsonFormat:
+            return json.dumps(fields, sort_keys=True)
+        extra = [fmt.format(fields[name]) for _key, name, fmt in _EXTRA_FIELDS if name in fields]
+        extra.append("elap={:.3f}sec".format(fields["elapsed_ms"] / 1000.0))
+        if "timing" in fields:
+            extra.append("timing={}".format(",".join(
+                "{}:{}ms".format(name, ms) for name, ms in sorted(fields["timing"].items()))))
+        # This is similar to the CherryPy format:
+        # 127.0.0.1 - - [08/Jul/2009:17:25:23] "GET /loginPrompt HTTP/1.1" 200 1944 ...
+        return '{} - {} - [{}] "{} {}" {} -> {}'.format(
+            fields["remote_addr"],
+            fields["user"] or "(anonymous)",
+            util.getLogTime(fields["time"]),
+            fields["method"],
+            util.safeReEncode(fields["path"], sys.stdout.encoding),
+            ", ".join(extra),
+            self.status,
+            )
+
+
+# ========================================================================
+# AccessLogger
+# ========================================================================
+class AccessLogger(object):
+    """Log requests, optionally sampled and as JSON.
+
+    :Parameters:
+        config : dict
+            Uses the options `access_log_format` ('text' or 'json'),
+            `access_log_sampling` ({method: rate}), and `access_log_async`.
+    """
+
+    def __init__(self, config):
+        self.jsonFormat = config.get("access_log_format", "text") == "json"
+        sampling = config.get("access_log_sampling") or {}
+        self.sampling = dict((method.upper(), float(rate)) for method, rate in sampling.items())
+        self.asyncWrite = False
+        if config.get("access_log_async", True):
+            self.asyncWrite = startAsyncWriter()
+
+    def __repr__(self):
+        return "AccessLogger(format={}, sampling={}, async={})".format(
+            "json" if self.jsonFormat else "text", self.sampling, self.asyncWrite)
+
+    def log(self, environ, status, startTime):
+        """Log a request, that was answered with `status` (e.g. '200 OK')."""
+        if not _logger.isEnabledFor(logging.INFO):
+            return
+        method = environ.get("REQUEST_METHOD")
+        rate = self.sampling.get(method)
+        if rate is not None and status[0] not in "45" and random.random() >= rate:
+            return
+        fields = {"time": startTime,
+                  "elapsed_ms": round(1000 * (time.time() - startTime), 3),
+                  "remote_addr": environ.get("REMOTE_ADDR", ""),
+                  "user": environ.get("http_authenticator.username"),
+                  "method": method,
+                  "path": environ.get("PATH_INFO", ""),
+                  "status": int(status.split(" ", 1)[0]),
+                  }
+        if rate is not None:
+            fields["sample_rate"] = rate
+        for key, name, _fmt in _EXTRA_FIELDS:
+            value = environ.get(key)
+            if value not in (None, ""):
+                fields[name] = value
+        timer = environ.get("wsgidav.timer")
+        if timer is not None and timer.phases:
+            fields["timing"] = timer.getDurations()
+        _logger.info(AccessLogEntry(fields, status, self.jsonFormat))
+
+
+# ========================================================================
+# Background writer
+# ========================================================================
+_writerLock = threading.Lock()
+_listener = None
+
+
+class _ForwardingHandler(logging.Handler):
+    """Pass dequeued records to the handlers of the 'wsgidav' base logger."""
+
+    def emit(self, record):
+        logging.getLogger(util.BASE_LOGGER_NAME).callHandlers(record)
+
+
+if QueueHandler is not None:
+    class _LazyQueueHandler(QueueHandler):
+        """QueueHandler that doesn't render the message on the request thread."""
+
+        def prepare(self, record):
+            # AccessLogEntry is immutable, so the record can be queued as is
+            return record
+
+
+def startAsyncWriter():
+    """Write access log entries on a background thread.
+
+    Return False, if this is not supported (Python 2).
+    """
+    global _listener
+    if QueueHandler is None:
+        return False
+    with _writerLock:
+        if _listener is None:
+            # SimpleQueue (Python 3.7+) is implemented in C and does not block
+            # on a Python level lock
+            queue = getattr(compat.queue, "SimpleQueue", compat.queue.Queue)()
+            _listener = QueueListener(queue, _ForwardingHandler())
+            _listener.start()
+            _logger.addHandler(_LazyQueueHandler(queue))
+            _logger.propagate = False
+            atexit.register(stopAsyncWriter)
+    return True
+
+
+def stopAsyncWriter():
+    """Write pending access log entries and stop the background thread."""
+    global _listener
+    with _writerLock:
+        if _listener is None:
+            return
+        for handler in _logger.handlers[:]:
+            if isinstance(handler, _LazyQueueHandler):
+                _logger.removeHandler(handler)
+        _logger.propagate = True
+        _listener.stop()
+        _listener = None
@@ -20,6 +20,11 @@ Valid options are (sample shows defaults)::
             "dbName": "wsgidav-props",        # Name of DB to store the properties
             }
 
+Documents are looked up with the permanent ``properties/by_url`` view.
+Descendants of a URL are found with a ``startkey``/``endkey`` range query on
+that view, and copy, move, and delete of multiple documents are sent as one
+``_bulk_docs`` request.
+
 """
 from __future__ import print_function
 
@@ -40,6 +45,9 @@ _logger = util.getModuleLogger(__name__)
 class CouchPropertyManager(object):
     """Implements a property manager based on CouchDB."""
 
+    multiProcessSafe = True
+    supportsWithChildren = True
+
     def __init__(self, options):
         self.options = options
         self._connect()
@@ -57,12 +65,12 @@ class CouchPropertyManager(object):
         dbName = opts.get("dbName", "wsgidav_props")
         if dbName in self.couch:
             self.db = self.couch[dbName]
-            _logger.info("CouchPropertyManager connected to %s v%s" %
-                         (self.db, self.couch.version()))
+            _logger.info("CouchPropertyManager connected to {} v{}"
+                         .format(self.db, self.couch.version()))
         else:
             self.db = self.couch.create(dbName)
-            _logger.info("CouchPropertyManager created new db %s v%s" %
-                         (self.db, self.couch.version()))
+            _logger.info("CouchPropertyManager created new db {} v{}"
+                         .format(self.db, self.couch.version()))
 
         # Ensure that we have a permanent view
         if "_design/properties" not in self.db:
@@ -96,7 +104,7 @@ class CouchPropertyManager(object):
         pass
 
     def __repr__(self):
-        return "CouchPropertyManager(%s)" % self.db
+        return "CouchPropertyManager({})".format(self.db)
 
     def _sync(self):
         pass
@@ -111,8 +119,8 @@ class CouchPropertyManager(object):
         """Return properties document for path."""
         # Query the permanent view to find a url
         vr = self.db.view("properties/by_url", key=url, include_docs=True)
-        _logger.debug("find(%r) returned %s" % (url, len(vr)))
-        assert len(vr) <= 1, "Found multiple matches for %r" % url
+        _logger.debug("find({!r}) returned {}".format(url, len(vr)))
+        assert len(vr) <= 1, "Found multiple matches for {!r}".format(url)
         for row in vr:
             assert row.doc
             return row.doc
@@ -120,20 +128,38 @@ class CouchPropertyManager(object):
 
     def _findDescendents(self, url):
         """Return properties document for url and all children."""
-        # Ad-hoc query for URL starting with a prefix
-        map_fun = """function(doc) {
-                var url = doc.url + "/";
-                if(doc.type === 'properties' && url.indexOf('%s') === 0) {
-                    emit(doc.url, { 'id': doc._id, 'url': doc.url });
+        # Key range query on the permanent view: all keys that start with the
+        # url sort between `base` and `base + u"/\ufff0"`. The range may also
+        # contain siblings like '<base>-x', so we filter the result.
+        base = url.rstrip("/")
+        vr = self.db.view("properties/by_url", startkey=base, endkey=base + u"/\ufff0",
+                          include_docs=True)
+        return [row.doc for row in vr if util.isEqualOrChildUri(base, row.key)]
+
+    def _findDocs(self, url, withChildren):
+        if withChildren:
+            return self._findDescendents(url)
+        doc = self._find(url)
+        return [doc] if doc else []
+
+    def _newDoc(self, url, properties):
+        return {"_id": uuid4().hex,  # Documentation suggests to set the id
+                "url": url,
+                "title": compat.quote(url),
+                "type": "properties",
+                "properties": properties,
                 }
-            }""" % (url + "/")
-        vr = self.db.query(map_fun, include_docs=True)
-        for row in vr:
-            yield row.doc
-        return
+
+    def _bulkUpdate(self, docs):
+        """Save or delete (if '_deleted' is set) documents with one _bulk_docs request."""
+        if not docs:
+            return
+        for ok, docId, err in self.db.update(docs):
+            if not ok:
+                raise RuntimeError("Could not update {}: {}".format(docId, err))
 
     def getProperties(self, normurl, environ=None):
-        _logger.debug("getProperties(%s)" % normurl)
+        _logger.debug("getProperties({})".format(normurl))
         doc = self._find(normurl)
         propNames = []
         if doc:
@@ -142,20 +168,35 @@ class CouchPropertyManager(object):
         return propNames
 
     def getProperty(self, normurl, propname, environ=None):
-        _logger.debug("getProperty(%s, %s)" % (normurl, propname))
+        _logger.debug("getProperty({}, {})".format(normurl, propname))
         doc = self._find(normurl)
         if not doc:
             return None
         prop = doc["properties"].get(propname)
         return prop
 
+    def getPropertyDicts(self, normurlList, environ=None):
+        """Return {normurl: {propname: value}} for all URLs that have properties.
+
+        Uses one view request (POST with a list of keys) for all URLs.
+        """
+        res = {}
+        normurlList = list(normurlList)
+        if not normurlList:
+            return res
+        vr = self.db.view("properties/by_url", keys=normurlList, include_docs=True)
+        for row in vr:
+            if row.doc and row.doc["properties"]:
+                res[row.key] = dict(row.doc["properties"])
+        return res
+
     def writeProperty(self, normurl, propname, propertyvalue, dryRun=False, environ=None):
         assert normurl and normurl.startswith("/")
         assert propname
         assert propertyvalue is not None
 
-        _logger.debug("writeProperty(%s, %s, dryRun=%s):\n\t%s" %
-                      (normurl, propname, dryRun, propertyvalue))
+        _logger.debug("writeProperty({}, {}, dryRun={}):\n\t{}"
+                      .format(normurl, propname, dryRun, propertyvalue))
         if dryRun:
             return  # TODO: can we check anything here?
 
@@ -163,16 +204,11 @@ class CouchPropertyManager(object):
         if doc:
             doc["properties"][propname] = propertyvalue
         else:
-            doc = {"_id": uuid4().hex,  # Documentation suggests to set the id
-                   "url": normurl,
-                   "title": compat.quote(normurl),
-                   "type": "properties",
-                   "properties": {propname: propertyvalue}
-                   }
+            doc = self._newDoc(normurl, {propname: propertyvalue})
         self.db.save(doc)
 
     def removeProperty(self, normurl, propname, dryRun=False, environ=None):
-        _logger.debug("removeProperty(%s, %s, dryRun=%s)" % (normurl, propname, dryRun))
+        _logger.debug("removeProperty({}, {}, dryRun={})".format(normurl, propname, dryRun))
         if dryRun:
             # TODO: can we check anything here?
             return
@@ -183,47 +219,46 @@ class CouchPropertyManager(object):
         del doc["properties"][propname]
         self.db.save(doc)
 
-    def removeProperties(self, normurl, environ=None):
-        _logger.debug("removeProperties(%s)" % normurl)
-        doc = self._find(normurl)
-        if doc:
-            self.db.delete(doc)
-        return
+    def removeProperties(self, normurl, environ=None, withChildren=False):
+        _logger.debug("removeProperties({}, withChildren={})".format(normurl, withChildren))
+        docs = self._findDocs(normurl, withChildren)
+        for doc in docs:
+            doc["_deleted"] = True
+        self._bulkUpdate(docs)
 
-    def copyProperties(self, srcUrl, destUrl, environ=None):
-        doc = self._find(srcUrl)
-        if not doc:
-            _logger.debug("copyProperties(%s, %s): src has no properties" % (srcUrl, destUrl))
-            return
-        _logger.debug("copyProperties(%s, %s)" % (srcUrl, destUrl))
-        assert not self._find(destUrl)
-        doc2 = {"_id": uuid4().hex,
-                "url": destUrl,
-                "title": compat.quote(destUrl),
-                "type": "properties",
-                "properties": doc["properties"],
-                }
-        self.db.save(doc2)
+    def copyProperties(self, srcUrl, destUrl, environ=None, withChildren=False):
+        _logger.debug("copyProperties({}, {}, withChildren={})"
+                      .format(srcUrl, destUrl, withChildren))
+        self._transfer(srcUrl, destUrl, withChildren, False)
 
     def moveProperties(self, srcUrl, destUrl, withChildren, environ=None):
-        _logger.debug("moveProperties(%s, %s, %s)" % (srcUrl, destUrl, withChildren))
-        if withChildren:
-            # Match URLs that are equal to <srcUrl> or begin with '<srcUrl>/'
-            docList = self._findDescendents(srcUrl)
-            for doc in docList:
-                newDest = doc["url"].replace(srcUrl, destUrl)
-                _logger.debug("move property %s -> %s" % (doc["url"], newDest))
-                doc["url"] = newDest
-                self.db.save(doc)
-        else:
-            # Move srcUrl only
-            # TODO: use findAndModify()?
-            doc = self._find(srcUrl)
-            if doc:
-                _logger.debug("move property %s -> %s" % (doc["url"], destUrl))
-                doc["url"] = destUrl
-                self.db.save(doc)
-        return
+        _logger.debug("moveProperties({}, {}, {})".format(srcUrl, destUrl, withChildren))
+        self._transfer(srcUrl, destUrl, withChildren, True)
+
+    def _transfer(self, srcUrl, destUrl, withChildren, isMove):
+        """Copy or move documents, replacing existing destination documents."""
+        srcDocs = self._findDocs(srcUrl, withChildren)
+        if not srcDocs:
+            _logger.debug("{} has no properties".format(srcUrl))
+            return
+        srcBase = srcUrl.rstrip("/") if withChildren else srcUrl
+        destBase = destUrl.rstrip("/") if withChildren else destUrl
+        batch = []
+        for doc in self._findDocs(destUrl, withChildren):
+            doc["_deleted"] = True
+            batch.append(doc)
+        for doc in srcDocs:
+            newUrl = destBase + doc["url"][len(srcBase):]
+            _logger.debug("{} property {} -> {}"
+                          .format("move" if isMove else "copy", doc["url"], newUrl))
+            if isMove:
+                doc["url"] = newUrl
+                doc["title"] = compat.quote(newUrl)
+                batch.append(doc)
+            else:
+                batch.append(self._newDoc(newUrl, doc["properties"]))
+        self._bulkUpdate(batch)
+
 
 # ============================================================================
 #
@@ -15,16 +15,34 @@ Valid options are (sample shows defaults)::
             "port": 27017,             # MongoDB port
             "dbName": "wsgidav-props", # Name of DB to store the properties
             # This options are used with `mongod --auth`
-            # The user must be created with db.addUser()
+            # The user must be created with db.createUser()
             "user": None,              # Authenticate with this user
             "pwd": None,               # ... and password
+            # Use this pymongo.MongoClient (or mongomock.MongoClient) instead
+            # of connecting to host and port
+            "client": None,
             }
 
+The connection is opened on first use, and opened again in a forked child
+process (pymongo clients are not fork-safe), so the property manager may be
+shared by the workers of ``wsgidav.server.prefork``, unless a `client` is
+passed.
+
+Every resource is stored as one document ``{"_url": ..., "_title": ...,
+<propname>: <value>, ...}``, with a unique index on ``_url``.
+Reads and writes are single round trips, recursive moves are sent as one
+``bulk_write()``, and ``getPropertyDicts()`` fetches the properties of many
+resources with one ``$in`` query (used by PROPFIND).
 """
 from __future__ import print_function
 
+import os
+import re
+
 import pymongo
+from pymongo import DeleteMany, DeleteOne, ReplaceOne, UpdateOne
 from wsgidav import compat, util
+from wsgidav.property_manager import PropertyTransaction
 
 __docformat__ = "reStructuredText"
 
@@ -37,6 +55,9 @@ HIDDEN_KEYS = ("_id", "_url", "_title")
 # Use a key that is unlikely to occur in proprty names
 DOT_ESCAPE = "^"
 
+# Max. number of URLs per `$in` query
+IN_QUERY_CHUNK_SIZE = 1000
+
 
 def encodeMongoKey(s):
     """Return an encoded version of `s` that may be used as MongoDB key."""
@@ -49,43 +70,84 @@ def decodeMongoKey(key):
     return key.replace(DOT_ESCAPE, ".")
 
 
+def _matchTree(url):
+    """Return a query that matches `url` and all descendants.
+
+    The anchored regular expression is a prefix query, so the index is used.
+    """
+    base = url.rstrip("/")
+    return {"$or": [{"_url": {"$in": [base, base + "/"]}},
+                    {"_url": {"$regex": "^" + re.escape(base + "/")}},
+                    ]}
+
+
+def _propDict(doc):
+    return dict((decodeMongoKey(k), v) for k, v in doc.items() if k not in HIDDEN_KEYS)
+
+
 # ============================================================================
 # MongoPropertyManager
 # ============================================================================
 class MongoPropertyManager(object):
     """Implements a property manager based on MongoDB."""
 
+    supportsWithChildren = True
+
     def __init__(self, options):
         self.options = options
-        self._connect()
+        self.conn = None
+        self._ownsConnection = False
+        self._pid = None
+        self._collection = None
 
     def __del__(self):
         self._disconnect()
 
+    @property
+    def multiProcessSafe(self):
+        # A passed client may have been created before the workers were forked
+        return not self.options.get("client")
+
+    @property
+    def collection(self):
+        # Connect lazily, and again after a fork
+        if self._pid != os.getpid():
+            self._connect()
+        return self._collection
+
     def _connect(self):
         opts = self.options
-        self.conn = pymongo.Connection(opts.get("host"), opts.get("port"))
+        if self._pid is not None:
+            # Forked: the inherited client belongs to the parent process
+            self.conn = None
+        if opts.get("client"):
+            self.conn = opts["client"]
+            self._ownsConnection = False
+        else:
+            # If credentials are passed, logon to the property storage db
+            credentials = {}
+            if opts.get("user"):
+                credentials = {"username": opts.get("user"),
+                               "password": opts.get("pwd"),
+                               "authSource": opts.get("dbName", "wsgidav-props"),
+                               }
+            self.conn = pymongo.MongoClient(opts.get("host"), opts.get("port"), **credentials)
+            self._ownsConnection = True
+        self._pid = os.getpid()
         _logger.debug(self.conn.server_info())
         self.db = self.conn[opts.get("dbName", "wsgidav-props")]
-        # If credentials are passed, logon to the property storage db
-        if opts.get("user"):
-            if not self.db.authenticate(opts.get("user"), opts.get("pwd")):
-                raise RuntimeError("Failed to logon to db %s as user %s" %
-                                   (self.db.name, opts.get("user")))
-            _logger.info("Logged on to mongo db '%s' as user '%s'" %
-                         (self.db.name, opts.get("user")))
-
-        self.collection = self.db["properties"]
-        _logger.info("MongoPropertyManager connected %r" % self.collection)
-        self.collection.ensure_index("_url")
+
+        self._collection = self.db["properties"]
+        _logger.info("MongoPropertyManager connected {!r}".format(self._collection))
+        self._collection.create_index("_url", unique=True)
 
     def _disconnect(self):
-        if self.conn:
-            self.conn.disconnect()
+        if self.conn and self._ownsConnection and self._pid == os.getpid():
+            self.conn.close()
         self.conn = None
 
     def __repr__(self):
-        return "MongoPropertyManager(%s)" % self.db
+        return "MongoPropertyManager({})".format(self.options.get("dbName", "wsgidav-props"))
 
     def _sync(self):
         pass
@@ -97,92 +159,139 @@ class MongoPropertyManager(object):
         pass
 
     def getProperties(self, normurl, environ=None):
-        _logger.debug("getProperties(%s)" % normurl)
+        _logger.debug("getProperties({})".format(normurl))
         doc = self.collection.find_one({"_url": normurl})
-        propNames = []
-        if doc:
-            for name in doc.keys():
-                if name not in HIDDEN_KEYS:
-                    propNames.append(decodeMongoKey(name))
-        return propNames
+        if not doc:
+            return []
+        return list(_propDict(doc).keys())
 
     def getProperty(self, normurl, propname, environ=None):
-        _logger.debug("getProperty(%s, %s)" % (normurl, propname))
-        doc = self.collection.find_one({"_url": normurl})
+        _logger.debug("getProperty({}, {})".format(normurl, propname))
+        key = encodeMongoKey(propname)
+        doc = self.collection.find_one({"_url": normurl}, projection={"_id": False, key: True})
         if not doc:
             return None
-        prop = doc.get(encodeMongoKey(propname))
-        return prop
+        return doc.get(key)
+
+    def getPropertyDicts(self, normurlList, environ=None):
+        """Return {normurl: {propname: value}} for all URLs that have properties.
+
+        Uses one query per IN_QUERY_CHUNK_SIZE URLs.
+        """
+        res = {}
+        normurlList = list(normurlList)
+        for i in compat.xrange(0, len(normurlList), IN_QUERY_CHUNK_SIZE):
+            chunk = normurlList[i:i + IN_QUERY_CHUNK_SIZE]
+            for doc in self.collection.find({"_url": {"$in": chunk}},
+                                            projection={"_id": False, "_title": False}):
+                props = _propDict(doc)
+                if props:
+                    res[doc["_url"]] = props
+        return res
 
     def writeProperty(self, normurl, propname, propertyvalue, dryRun=False, environ=None):
         assert normurl and normurl.startswith("/")
         assert propname
         assert propertyvalue is not None
-        assert propname not in HIDDEN_KEYS, "MongoDB key is protected: '%s'" % propname
+        assert propname not in HIDDEN_KEYS, "MongoDB key is protected: '{}'".format(propname)
 
-        _logger.debug("writeProperty(%s, %s, dryRun=%s):\n\t%s" %
-                      (normurl, propname, dryRun, propertyvalue))
+        _logger.debug("writeProperty({}, {}, dryRun={}):\n\t{}"
+                      .format(normurl, propname, dryRun, propertyvalue))
         if dryRun:
             return  # TODO: can we check anything here?
 
-        doc = self.collection.find_one({"_url": normurl})
-        if not doc:
-            doc = {"_url": normurl,
-                   "_title": compat.quote(normurl),
-                   }
-        doc[encodeMongoKey(propname)] = propertyvalue
-        self.collection.save(doc)
+        self.collection.update_one(
+            {"_url": normurl},
+            {"$set": {encodeMongoKey(propname): propertyvalue},
+             "$setOnInsert": {"_title": compat.quote(normurl)}},
+            upsert=True)
 
     def removeProperty(self, normurl, propname, dryRun=False, environ=None):
         """
+        Specifying the removal of a property that does not exist is NOT an error.
         """
-        _logger.debug("removeProperty(%s, %s, dryRun=%s)" % (normurl, propname, dryRun))
+        _logger.debug("removeProperty({}, {}, dryRun={})".format(normurl, propname, dryRun))
         if dryRun:
             # TODO: can we check anything here?
             return
-        doc = self.collection.find_one({"_url": normurl})
-        # Specifying the removal of a property that does not exist is NOT an error.
-        if not doc or doc.get(encodeMongoKey(propname)) is None:
-            return
-        del doc[encodeMongoKey(propname)]
-        self.collection.save(doc)
+        self.collection.update_one({"_url": normurl},
+                                   {"$unset": {encodeMongoKey(propname): ""}})
 
-    def removeProperties(self, normurl, environ=None):
-        _logger.debug("removeProperties(%s)" % normurl)
-        doc = self.collection.find_one({"_url": normurl})
-        if doc:
-            self.collection.remove(doc)
-        return
+    def removeProperties(self, normurl, environ=None, withChildren=False):
+        _logger.debug("removeProperties({}, withChildren={})".format(normurl, withChildren))
+        if withChildren:
+            self.collection.delete_many(_matchTree(normurl))
+        else:
+            self.collection.delete_one({"_url": normurl})
 
-    def copyProperties(self, srcUrl, destUrl, environ=None):
-        doc = self.collection.find_one({"_url": srcUrl})
+    def copyProperties(self, srcUrl, destUrl, environ=None, withChildren=False):
+        if withChildren:
+            _logger.debug("copyProperties({}, {}, withChildren=True)".format(srcUrl, destUrl))
+            srcBase = srcUrl.rstrip("/")
+            destBase = destUrl.rstrip("/")
+            requests = []
+            for doc in self.collection.find(_matchTree(srcUrl), projection={"_id": False}):
+                newUrl = destBase + doc["_url"][len(srcBase):]
+                doc["_url"] = newUrl
+                doc["_title"] = compat.quote(newUrl)
+                requests.append(ReplaceOne({"_url": newUrl}, doc, upsert=True))
+            if requests:
+                self.collection.bulk_write(requests, ordered=True)
+            return
+        doc = self.collection.find_one({"_url": srcUrl}, projection={"_id": False})
         if not doc:
-            _logger.debug("copyProperties(%s, %s): src has no properties" % (srcUrl, destUrl))
+            _logger.debug("copyProperties({}, {}): src has no properties".format(srcUrl, destUrl))
             return
-        _logger.debug("copyProperties(%s, %s)" % (srcUrl, destUrl))
-        doc2 = doc.copy()
-        self.collection.insert(doc2)
+        _logger.debug("copyProperties({}, {})".format(srcUrl, destUrl))
+        doc["_url"] = destUrl
+        doc["_title"] = compat.quote(destUrl)
+        self.collection.replace_one({"_url": destUrl}, doc, upsert=True)
 
     def moveProperties(self, srcUrl, destUrl, withChildren, environ=None):
-        _logger.debug("moveProperties(%s, %s, %s)" % (srcUrl, destUrl, withChildren))
+        _logger.debug("moveProperties({}, {}, {})".format(srcUrl, destUrl, withChildren))
         if withChildren:
-            # Match URLs that are equal to <srcUrl> or begin with '<srcUrl>/'
-            matchBegin = "^" + srcUrl.rstrip("/") + "/"
-            query = {"$or": [{"_url": srcUrl},
-                             {"_url": {"$regex": matchBegin}},
-                             ]}
-            docList = self.collection.find(query)
-            for doc in docList:
-                newDest = doc["_url"].replace(srcUrl, destUrl)
-                _logger.debug("move property %s -> %s" % (doc["_url"], newDest))
-                doc["_url"] = newDest
-                self.collection.save(doc)
+            # Rename all matching documents in one batch, replacing existing
+            # destination documents (the unique index would reject duplicates)
+            srcBase = srcUrl.rstrip("/")
+            destBase = destUrl.rstrip("/")
+            requests = [DeleteMany(_matchTree(destUrl))]
+            for doc in self.collection.find(_matchTree(srcUrl), projection={"_url": True}):
+                newUrl = destBase + doc["_url"][len(srcBase):]
+                requests.append(UpdateOne({"_id": doc["_id"]},
+                                          {"$set": {"_url": newUrl,
+                                                    "_title": compat.quote(newUrl)}}))
+            if len(requests) == 1:
+                return
         else:
             # Move srcUrl only
-            # TODO: use findAndModify()?
-            doc = self.collection.find_one({"_url": srcUrl})
-            if doc:
-                _logger.debug("move property %s -> %s" % (doc["_url"], destUrl))
-                doc["_url"] = destUrl
-                self.collection.save(doc)
-        return
+            requests = [DeleteOne({"_url": destUrl}),
+                        UpdateOne({"_url": srcUrl},
+                                  {"$set": {"_url": destUrl,
+                                            "_title": compat.quote(destUrl)}}),
+                        ]
+        self.collection.bulk_write(requests, ordered=True)
+
+    def beginTransaction(self, environ=None):
+        """Return a new PropertyTransaction for this property manager."""
+        return PropertyTransaction(self, environ)
+
+    def _commitTransaction(self, staged, environ=None):
+        """Write staged changes with one update per resource."""
+        updates = {}
+        for normurl, propname, value in staged:
+            assert propname not in HIDDEN_KEYS, "MongoDB key is protected: '{}'".format(propname)
+            update = updates.setdefault(normurl, {"$set": {}, "$unset": {}})
+            key = encodeMongoKey(propname)
+            if value is None:
+                update["$set"].pop(key, None)
+                update["$unset"][key] = ""
+            else:
+                update["$unset"].pop(key, None)
+                update["$set"][key] = value
+        requests = []
+        for normurl, update in updates.items():
+            update["$setOnInsert"] = {"_title": compat.quote(normurl)}
+            upsert = bool(update["$set"])
+            update = dict((op, fields) for op, fields in update.items() if fields)
+            requests.append(UpdateOne({"_url": normurl}, update, upsert=upsert))
+        self.collection.bulk_write(requests, ordered=True)
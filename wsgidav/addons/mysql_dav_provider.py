@@ -64,7 +64,7 @@ import hashlib
 import time
 
 import MySQLdb  # @UnresolvedImport
-from wsgidav import compat, util
+from wsgidav import call_stats, compat, util
 from wsgidav.dav_error import (
     HTTP_FORBIDDEN,
     DAVError,
@@ -315,6 +315,7 @@ class MySQLBrowserProvider(DAVProvider):
 
     def _initConnection(self):
         self._count_initConnection += 1
+        call_stats.countCall("mysql.initConnection")
         return MySQLdb.connect(host=self._host,
                                user=self._user,
                                passwd=self._passwd,
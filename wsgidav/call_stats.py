@@ -0,0 +1,167 @@
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+Per-request accounting of provider, lock manager, and property manager calls.
+
+This helps to find 'N+1' patterns, i.e. providers that make one (expensive)
+call per listed resource, instead of one call per request.
+
+If enabled (``call_stats = {"enable": True}``), :class:`~wsgidav.wsgidav_app.WsgiDAVApp`
+
+  - counts the calls of ``DAVProvider.getResourceInst()``,
+  - counts all public method calls of the lock and property managers,
+
+and logs a warning for requests that exceed the configured thresholds
+relative to the number of returned resources (e.g. the number of PROPFIND
+responses)::
+
+    PROPFIND /dav/ (100 resources): 302 calls: lockManager.getUrlLockList=100, ...
+
+Providers can count their own expensive operations (e.g. database queries)::
+
+    from wsgidav import call_stats
+    ...
+    call_stats.countCall("mysql.initConnection")
+
+This is a no-op, if call accounting is disabled.
+"""
+import threading
+
+from wsgidav import util
+
+__docformat__ = "reStructuredText"
+
+_logger = util.getModuleLogger(__name__)
+
+_current = threading.local()
+
+
+def countCall(name):
+    """Count a call for the current request (if call accounting is enabled)."""
+    counts = getattr(_current, "counts", None)
+    if counts is not None:
+        counts[name] = counts.get(name, 0) + 1
+
+
+# ========================================================================
+# CallCounter
+# ========================================================================
+class CallCounter(object):
+    """Collect the calls that are made while a request is processed.
+
+    The counter is activated for the current thread and passed as
+    ``environ["wsgidav.call_counter"]``.
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def __repr__(self):
+        return "CallCounter({})".format(self.format())
+
+    def start(self):
+        _current.counts = self.counts
+
+    def stop(self):
+        if getattr(_current, "counts", None) is self.counts:
+            _current.counts = None
+
+    def getTotal(self):
+        return sum(self.counts.values())
+
+    def format(self):
+        """Return the call breakdown, e.g. 'lockManager.getUrlLockList=100, ...'."""
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return ", ".join("{}={}".format(name, count) for name, count in items)
+
+
+# ========================================================================
+# Instrumentation
+# ========================================================================
+class CountingProxy(object):
+    """Forward attribute access to `target`, counting public method calls."""
+
+    def __init__(self, target, prefix):
+        self._target = target
+        self._prefix = prefix
+
+    def __repr__(self):
+        return "CountingProxy({!r})".format(self._target)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        label = "{}.{}".format(self._prefix, name)
+
+        def _countingCall(*args, **kwargs):
+            countCall(label)
+            return attr(*args, **kwargs)
+
+        if name == "beginTransaction":
+            def _beginTransaction(*args, **kwargs):
+                tx = _countingCall(*args, **kwargs)
+                # The provider holds this proxy, and only stages changes of
+                # transactions that belong to its own property manager
+                tx.propManager = self
+                return tx
+
+            return _beginTransaction
+        return _countingCall
+
+
+def instrumentProvider(provider):
+    """Count the ``getResourceInst()`` calls of a provider instance."""
+    if getattr(provider, "_callStatsInstrumented", False):
+        return
+    getResourceInst = provider.getResourceInst
+
+    def _getResourceInst(path, environ):
+        countCall("provider.getResourceInst")
+        return getResourceInst(path, environ)
+
+    provider.getResourceInst = _getResourceInst
+    provider._callStatsInstrumented = True
+
+
+# ========================================================================
+# N+1 detection
+# ========================================================================
+class CallStatsChecker(object):
+    """Log requests that make too many calls per returned resource.
+
+    :Parameters:
+        config : dict
+            Uses the `call_stats` option with the keys `max_calls_per_resource`
+            and `min_calls` (requests with fewer calls are never reported).
+    """
+
+    def __init__(self, config):
+        opts = config.get("call_stats") or {}
+        self.maxCallsPerResource = float(opts.get("max_calls_per_resource", 3))
+        self.minCalls = int(opts.get("min_calls", 20))
+        self._proxies = {}  # {id(manager): CountingProxy}
+
+    def getProxy(self, manager, prefix):
+        """Return a (shared) CountingProxy for a lock or property manager."""
+        if not manager:
+            return manager
+        proxy = self._proxies.get(id(manager))
+        if proxy is None:
+            proxy = self._proxies[id(manager)] = CountingProxy(manager, prefix)
+        return proxy
+
+    def check(self, environ, counter):
+        """Log a warning and return True, if the request exceeded the limits."""
+        total = counter.getTotal()
+        if total < self.minCalls:
+            return False
+        resourceCount = max(1, environ.get("wsgidav.result_count", 1))
+        if total <= self.maxCallsPerResource * resourceCount:
+            return False
+        _logger.warn("{} {} ({} resources): {} calls: {}".format(
+            environ.get("REQUEST_METHOD"),
+            environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", ""),
+            resourceCount, total, counter.format()))
+        return True
@@ -513,8 +513,12 @@ class _DAVResource(object):
         # Dead properties
         if self.provider.propManager:
             refUrl = self.getRefUrl()
-            propNameList.extend(
-                self.provider.propManager.getProperties(refUrl, self.environ))
+            prefetch = self.environ.get("wsgidav.prop_prefetch")
+            if prefetch is not None:
+                propNameList.extend(prefetch.get(refUrl, {}).keys())
+            else:
+                propNameList.extend(
+                    self.provider.propManager.getProperties(refUrl, self.environ))
 
         return propNameList
 
@@ -692,8 +696,15 @@ class _DAVResource(object):
         # Dead property
         pm = self.provider.propManager
         if pm:
-            value = pm.getProperty(refUrl, propname, self.environ)
+            prefetch = self.environ.get("wsgidav.prop_prefetch")
+            if prefetch is not None:
+                value = prefetch.get(refUrl, {}).get(propname)
+            else:
+                value = pm.getProperty(refUrl, propname, self.environ)
             if value is not None:
+                cache = self.provider.propValueCache
+                if cache is not None:
+                    return cache.getElement(refUrl, propname, value)
                 return xml_tools.stringToXML(value)
 
         # No persistence available, or property not found
@@ -714,7 +725,8 @@ class _DAVResource(object):
         - raises HTTP_FORBIDDEN, if trying to modify an immutable {DAV:}
           property
         - stores everything else as dead property, if a property manager is
-          present.
+          present. If ``environ["wsgidav.prop_transaction"]`` holds a transaction
+          of this property manager, the change is only staged there.
         - raises HTTP_FORBIDDEN, else
 
         Removing a non-existing prop is NOT an error.
@@ -754,18 +766,36 @@ class _DAVResource(object):
         pm = self.provider.propManager
         if pm and not propname.startswith("{DAV:}"):
             refUrl = self.getRefUrl()
+            if value is not None:
+                value = etree.tostring(value)
+            if not dryRun and self.provider.propValueCache is not None:
+                self.provider.propValueCache.invalidate(refUrl)
+            # Stage the change, if the request has opened a transaction
+            tx = self.environ.get("wsgidav.prop_transaction")
+            if not dryRun and tx is not None and tx.propManager is pm:
+                return tx.stage(refUrl, propname, value)
             if value is None:
                 return pm.removeProperty(refUrl, propname, dryRun, self.environ)
             else:
-                value = etree.tostring(value)
                 return pm.writeProperty(refUrl, propname, value, dryRun, self.environ)
 
         raise DAVError(HTTP_FORBIDDEN)
 
     def removeAllProperties(self, recursive):
-        """Remove all associated dead properties."""
-        if self.provider.propManager:
-            self.provider.propManager.removeProperties(self.getRefUrl(), self.environ)
+        """Remove all associated dead properties.
+
+        The properties of descendants are only removed, if the property
+        manager supports `withChildren`.
+        """
+        propMan = self.provider.propManager
+        if propMan:
+            if recursive and getattr(propMan, "supportsWithChildren", False):
+                propMan.removeProperties(self.getRefUrl(), self.environ, withChildren=True)
+            else:
+                recursive = False
+                propMan.removeProperties(self.getRefUrl(), self.environ)
+            if self.provider.propValueCache is not None:
+                self.provider.propValueCache.invalidate(self.getRefUrl(), recursive)
 
     # --- Locking ------------------------------------------------------------
 
@@ -990,6 +1020,9 @@ class _DAVResource(object):
             reset if the target did not exist before.
             See http://www.webdav.org/specs/rfc4918.html#dav.properties
           - SHOULD copy dead properties.
+            If ``environ["wsgidav.defer_prop_copy"]`` is set, the caller copies
+            the dead properties of the whole tree afterwards, so this may be
+            skipped when copying.
           - raises HTTP_FORBIDDEN for read-only providers
           - raises HTTP_INTERNAL_ERROR on error
 
@@ -1372,6 +1405,7 @@ class DAVProvider(object):
         self.sharePath = None
         self.lockManager = None
         self.propManager = None
+        self.propValueCache = None
         self.verbose = 2
 
         self._count_getResourceInst = 0
@@ -1415,6 +1449,10 @@ class DAVProvider(object):
             "Must be compatible with wsgidav.property_manager.PropertyManager"
         self.propManager = propManager
 
+    def setPropValueCache(self, propValueCache):
+        """Set a xml_tools.XMLValueCache for parsed dead property values (or None)."""
+        self.propValueCache = propValueCache
+
     def refUrlToPath(self, refUrl):
         """Convert a refUrl to a path, by stripping the share prefix.
 
@@ -31,6 +31,9 @@ These configuration settings are evaluated:
      5        Dump headers and bodies of all requests and responses.
     =======  ===================================================================
 
+    The filter is not added to the middleware stack if ``verbose < 3``
+    (so ``?dump_storage`` also requires ``verbose >= 3``).
+
 *debug_methods*
     Boost verbosity to 3 while processing certain request methods. This option
     is ignored, when ``verbose < 2``.
@@ -77,6 +80,12 @@ class WsgiDavDebugFilter(BaseMiddleware):
         self.break_after_litmus = [
             # "locks: 15",
         ]
+        self._passThrough = config.get("response_pass_through", True)
+
+    @staticmethod
+    def isSuitable(config):
+        """This filter is skipped if verbose < 3 (it would only pass the requests on)."""
+        return config.get("verbose", 3) >= 3
 
     def __call__(self, environ, start_response):
         """"""
@@ -143,6 +152,12 @@ class WsgiDavDebugFilter(BaseMiddleware):
                     _logger.info("{:<20}: '{}'".format(k, safeReEncode(v, "utf8")))
             _logger.info("\n")
 
+        if not dumpResponse and self._passThrough:
+            # Nothing to inspect: return the response unchanged
+            return self._application(environ, start_response)
+        return self._iterResponse(environ, start_response, method, dumpResponse)
+
+    def _iterResponse(self, environ, start_response, method, dumpResponse):
         # Intercept start_response
         #
         sub_app_start_response = util.SubAppStartResponse()
@@ -41,10 +41,35 @@ __docformat__ = "reStructuredText"
 _logger = util.getModuleLogger(__name__)
 
 
-class WsgiDAVDomainController(object):
+class HA1CacheMixin(object):
+    """Implement ``getRealmUserHA1()`` for domain controllers that know the
+    passwords.
+
+    Classes must implement ``getRealmUserPassword()`` and initialize
+    ``self._ha1Cache = {}``.
+    """
+
+    def getRealmUserHA1(self, realmname, username, environ):
+        """Return MD5(username:realm:password) for digest authentication.
+
+        The hash is computed once per user (and again if the password changes).
+        """
+        password = self.getRealmUserPassword(realmname, username, environ)
+        if password is None:
+            return None
+        entry = self._ha1Cache.get((realmname, username))
+        if entry is None or entry[0] != password:
+            entry = (password,
+                     util.calc_hexdigest("{}:{}:{}".format(username, realmname, password)))
+            self._ha1Cache[(realmname, username)] = entry
+        return entry[1]
+
+
+class WsgiDAVDomainController(HA1CacheMixin):
 
     def __init__(self, userMap):
         self.userMap = userMap
+        self._ha1Cache = {}
 #        self.allowAnonymous = allowAnonymous
 
     def __repr__(self):
@@ -5,7 +5,13 @@
 """
 WSGI middleware to catch application thrown DAVErrors and return proper
 responses.
+
+If ``response_pass_through`` is enabled (default), only the first chunk of a
+response is fetched under control of this middleware: later chunks are passed
+through unchanged (exceptions raised there can't be turned into an error
+response anyway, because the headers have been sent).
 """
+import itertools
 import traceback
 
 from wsgidav import util
@@ -32,8 +38,44 @@ class ErrorPrinter(BaseMiddleware):
     def __init__(self, application, config):
         self._application = application
         self._catch_all_exceptions = config.get("catchall", False)
+        self._passThrough = config.get("response_pass_through", True)
 
     def __call__(self, environ, start_response):
+        if self._passThrough:
+            return self._callPassThrough(environ, start_response)
+        return self._callIterating(environ, start_response)
+
+    def _callPassThrough(self, environ, start_response):
+        # Intercept start_response
+        sub_app_start_response = util.SubAppStartResponse()
+        app_iter = None
+        started = False
+        try:
+            try:
+                app_iter = self._application(environ, sub_app_start_response)
+                # request_server app may be a generator (for example the GET handler),
+                # so we fetch the first chunk to catch exceptions here
+                it = iter(app_iter)
+                first = list(itertools.islice(it, 1))
+                started = True
+            except DAVError as e:
+                _logger.debug("re-raising {}".format(e))
+                raise
+            except Exception as e:
+                raise self._convertException(e)
+        except DAVError as e:
+            return self._sendError(e, start_response)
+        finally:
+            # Also close the iterator, if a non-DAVError exception is raised
+            if not started and hasattr(app_iter, "close"):
+                app_iter.close()
+
+        start_response(sub_app_start_response.status,
+                       sub_app_start_response.response_headers,
+                       sub_app_start_response.exc_info)
+        return util.PassThroughIterator(first, it, app_iter)
+
+    def _callIterating(self, environ, start_response):
         # Intercept start_response
         sub_app_start_response = util.SubAppStartResponse()
 
@@ -71,43 +113,49 @@ class ErrorPrinter(BaseMiddleware):
                 _logger.debug("re-raising {}".format(e))
                 raise
             except Exception as e:
-                # Caught a non-DAVError
-                if self._catch_all_exceptions:
-                    # Catch all exceptions to return as 500 Internal Error
-                    # traceback.print_exc(10, environ.get("wsgi.errors") or sys.stderr)
-                    _logger.error("{}".format(traceback.format_exc(10)))
-                    raise asDAVError(e)
-                else:
-                    _logger.error("Caught Exception\n{}".format(traceback.format_exc(10)))
-                    # traceback.print_exc(10, sys.stderr)
-                    raise
+                raise self._convertException(e)
         except DAVError as e:
-            _logger.debug("caught {}".format(e))
-
-            status = getHttpStatusString(e)
-            # Dump internal errors to console
-            if e.value == HTTP_INTERNAL_ERROR:
-                tb = traceback.format_exc(10)
-                _logger.error("Caught HTTPRequestException(HTTP_INTERNAL_ERROR)\n{}".format(tb))
-                # traceback.print_exc(10, environ.get("wsgi.errors") or sys.stdout)
-                _logger.error("e.srcexception:\n{}".format(e.srcexception))
-            elif e.value in (HTTP_NOT_MODIFIED, HTTP_NO_CONTENT):
-                # _logger.warn("Forcing empty error response for {}".format(e.value))
-                # See paste.lint: these code don't have content
-                start_response(status, [("Content-Length", "0"),
-                                        ("Date", util.getRfc1123Time()),
-                                        ])
-                yield b""
-                return
+            for v in self._sendError(e, start_response):
+                yield v
+            return
+
+    def _convertException(self, e):
+        """Log a non-DAVError and return the exception that should be raised."""
+        if self._catch_all_exceptions:
+            # Catch all exceptions to return as 500 Internal Error
+            # traceback.print_exc(10, environ.get("wsgi.errors") or sys.stderr)
+            _logger.error("{}".format(traceback.format_exc(10)))
+            return asDAVError(e)
+        _logger.error("Caught Exception\n{}".format(traceback.format_exc(10)))
+        # traceback.print_exc(10, sys.stderr)
+        return e
 
-            # If exception has pre-/post-condition: return as XML response,
-            # else return as HTML
-            content_type, body = e.getResponsePage()
+    def _sendError(self, e, start_response):
+        """Start an error response for a DAVError and return the body chunks."""
+        _logger.debug("caught {}".format(e))
 
-            # TODO: provide exc_info=sys.exc_info()?
-            start_response(status, [("Content-Type", content_type),
-                                    ("Content-Length", str(len(body))),
+        status = getHttpStatusString(e)
+        # Dump internal errors to console
+        if e.value == HTTP_INTERNAL_ERROR:
+            tb = traceback.format_exc(10)
+            _logger.error("Caught HTTPRequestException(HTTP_INTERNAL_ERROR)\n{}".format(tb))
+            # traceback.print_exc(10, environ.get("wsgi.errors") or sys.stdout)
+            _logger.error("e.srcexception:\n{}".format(e.srcexception))
+        elif e.value in (HTTP_NOT_MODIFIED, HTTP_NO_CONTENT):
+            # _logger.warn("Forcing empty error response for {}".format(e.value))
+            # See paste.lint: these code don't have content
+            start_response(status, [("Content-Length", "0"),
                                     ("Date", util.getRfc1123Time()),
                                     ])
-            yield body
-            return
+            return [b""]
+
+        # If exception has pre-/post-condition: return as XML response,
+        # else return as HTML
+        content_type, body = e.getResponsePage()
+
+        # TODO: provide exc_info=sys.exc_info()?
+        start_response(status, [("Content-Type", content_type),
+                                ("Content-Length", str(len(body))),
+                                ("Date", util.getRfc1123Time()),
+                                ])
+        return [body]
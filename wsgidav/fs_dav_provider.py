@@ -10,18 +10,28 @@ provider that publishes a file system.
 
 If ``readonly=True`` is passed, write attempts will raise HTTP_FORBIDDEN.
 
+If ``xattrProperties=True`` is passed, dead properties are stored as extended
+file attributes (see :class:`~wsgidav.fs_dav_provider.XattrPropertyManager`).
+
+If the ``map_win32_props`` option is set, the ``Win32*`` properties of the
+Microsoft WebDAV redirector are mapped to file metadata, instead of storing
+them as dead properties.
+
 This provider creates instances of :class:`~wsgidav.fs_dav_provider.FileResource`
 and :class:`~wsgidav.fs_dav_provider.FolderResource` to represent files and
 directories respectively.
 """
+import errno
 import os
 import shutil
 import stat
+import struct
 import sys
 
 from wsgidav import compat, util
-from wsgidav.dav_error import HTTP_FORBIDDEN, DAVError
+from wsgidav.dav_error import HTTP_BAD_REQUEST, HTTP_FORBIDDEN, DAVError
 from wsgidav.dav_provider import DAVCollection, DAVNonCollection, DAVProvider
+from wsgidav.util import etree
 
 __docformat__ = "reStructuredText"
 
@@ -29,6 +39,153 @@ _logger = util.getModuleLogger(__name__)
 
 BUFFER_SIZE = 8192
 
+#: Dead properties are stored as '<XATTR_PREFIX><Clark name>' attributes
+XATTR_PREFIX = "user.dav."
+#: Marks files that have properties in the fallback property manager
+_FALLBACK_XATTR = "user.wsgidav.fallback"
+
+# os.*xattr() functions are available on Linux with Python 3.3+
+_xattrSupported = hasattr(os, "listxattr")
+
+# Errors that mean 'this file system (or file) cannot store this attribute'
+_xattrUnsupportedErrors = set(
+    getattr(errno, name) for name in ("ENOTSUP", "EOPNOTSUPP", "E2BIG", "ENOSPC", "ERANGE")
+    if hasattr(errno, name))
+
+
+# ========================================================================
+# Win32 properties
+# ========================================================================
+#: Properties that the Microsoft WebDAV redirector sets on every file it writes
+WIN32_NS = "{urn:schemas-microsoft-com:}"
+WIN32_PROPS = frozenset(WIN32_NS + name for name in (
+    "Win32CreationTime", "Win32LastAccessTime", "Win32LastModifiedTime",
+    "Win32FileAttributes"))
+
+FILE_ATTRIBUTE_ARCHIVE = 0x20
+FILE_ATTRIBUTE_DIRECTORY = 0x10
+FILE_ATTRIBUTE_NORMAL = 0x80
+
+# Win32FileAttributes that differ from the default are stored as 32 bit
+# bitfield in this extended attribute (or as dead property, if not supported)
+_WIN32_ATTRIBUTES_XATTR = "user.win32attributes"
+
+
+def _mapWin32Props(res):
+    return res.environ.get("wsgidav.config", {}).get("map_win32_props", False)
+
+
+def _getDeadWin32Attributes(res, propname, getDeadProperty, unsupported=False):
+    """Return Win32FileAttributes bits stored as dead property (or None).
+
+    The property manager is only queried, if extended attributes are not
+    `unsupported` for this file, or could not be written before.
+    """
+    if _xattrSupported and not unsupported and not res.provider._win32DeadAttributes:
+        return None
+    try:
+        return int(getDeadProperty(propname).text, 16)
+    except (DAVError, TypeError, ValueError):
+        return None
+
+
+def _getWin32Property(res, propname, getDeadProperty):
+    """Return a Win32* property value from the file metadata.
+
+    `getDeadProperty` is the getPropertyValue() method of the base class.
+    """
+    if propname == WIN32_NS + "Win32FileAttributes":
+        default = FILE_ATTRIBUTE_DIRECTORY if res.isCollection else FILE_ATTRIBUTE_ARCHIVE
+        bits = None
+        unsupported = False
+        if _xattrSupported:
+            try:
+                bits = struct.unpack("<I", os.getxattr(res._filePath, _WIN32_ATTRIBUTES_XATTR))[0]
+            except OSError as e:
+                unsupported = e.errno in _xattrUnsupportedErrors
+        if bits is None:
+            bits = _getDeadWin32Attributes(res, propname, getDeadProperty, unsupported)
+        if bits is None:
+            bits = default
+        return "{:08X}".format(bits)
+    elif propname == WIN32_NS + "Win32CreationTime":
+        secs = res.filestat[stat.ST_CTIME]
+    elif propname == WIN32_NS + "Win32LastAccessTime":
+        secs = res.filestat[stat.ST_ATIME]
+    else:
+        secs = res.filestat[stat.ST_MTIME]
+    return util.getRfc1123Time(secs)
+
+
+def _setWin32Property(res, propname, value, dryRun, getDeadProperty, setDeadProperty):
+    """Apply a Win32* property to the file metadata (see setPropertyValue).
+
+    `getDeadProperty` and `setDeadProperty` are the getPropertyValue() and
+    setPropertyValue() methods of the base class.
+    """
+    if res.provider.readonly:
+        raise DAVError(HTTP_FORBIDDEN)
+    text = value.text if value is not None else None
+
+    if propname == WIN32_NS + "Win32FileAttributes":
+        bits = 0
+        if text:
+            try:
+                bits = int(text, 16)
+            except ValueError:
+                raise DAVError(HTTP_BAD_REQUEST, "Invalid {}: {!r}".format(propname, text))
+        # DIRECTORY and NORMAL are implied by the resource type, so typically
+        # nothing needs to be stored at all
+        default = FILE_ATTRIBUTE_DIRECTORY if res.isCollection else FILE_ATTRIBUTE_ARCHIVE
+        bits &= ~(FILE_ATTRIBUTE_DIRECTORY | FILE_ATTRIBUTE_NORMAL)
+        if res.isCollection:
+            bits |= FILE_ATTRIBUTE_DIRECTORY
+        deadValue = None
+        if bits not in (0, default):
+            deadValue = etree.Element(propname)
+            deadValue.text = "{:08X}".format(bits)
+        if dryRun:
+            if not _xattrSupported and deadValue is not None:
+                setDeadProperty(propname, deadValue, True)
+            return
+        if _xattrSupported:
+            try:
+                if deadValue is None:
+                    if _WIN32_ATTRIBUTES_XATTR in os.listxattr(res._filePath):
+                        os.removexattr(res._filePath, _WIN32_ATTRIBUTES_XATTR)
+                else:
+                    os.setxattr(res._filePath, _WIN32_ATTRIBUTES_XATTR, struct.pack("<I", bits))
+                # Remove a previous value, that was stored as dead property
+                if _getDeadWin32Attributes(res, propname, getDeadProperty) is not None:
+                    setDeadProperty(propname, None, False)
+                return
+            except OSError as e:
+                if e.errno not in _xattrUnsupportedErrors:
+                    raise
+                res.provider._win32DeadAttributes = True
+        # Store as dead property, so it is persisted, moved, copied, and
+        # removed with the resource (and committed with the PROPPATCH)
+        if (deadValue is not None
+                or _getDeadWin32Attributes(res, propname, getDeadProperty, True) is not None):
+            setDeadProperty(propname, deadValue, False)
+        return
+
+    # Timestamps: removing is a no-op
+    if text is None:
+        return
+    secs = util.parseTimeString(text)
+    if secs is None:
+        raise DAVError(HTTP_BAD_REQUEST, "Invalid {}: {!r}".format(propname, text))
+    if dryRun or propname == WIN32_NS + "Win32CreationTime":
+        # The creation time cannot be set on POSIX systems: ignore it
+        return
+    # Stat again, since the other timestamp may have changed in this request
+    st = os.stat(res._filePath)
+    if propname == WIN32_NS + "Win32LastAccessTime":
+        os.utime(res._filePath, (secs, st[stat.ST_MTIME]))
+    else:
+        os.utime(res._filePath, (st[stat.ST_ATIME], secs))
+
 
 # ========================================================================
 # FileResource
@@ -122,7 +279,7 @@ class FileResource(DAVNonCollection):
             if isMove:
                 propMan.moveProperties(self.getRefUrl(), destRes.getRefUrl(),
                                        withChildren=False, environ=self.environ)
-            else:
+            elif not self.environ.get("wsgidav.defer_prop_copy"):
                 propMan.copyProperties(self.getRefUrl(), destRes.getRefUrl(), self.environ)
 
     def supportRecursiveMove(self, destPath):
@@ -145,6 +302,23 @@ class FileResource(DAVNonCollection):
             self.provider.propManager.moveProperties(self.getRefUrl(), destRes.getRefUrl(),
                                                      withChildren=True, environ=self.environ)
 
+    def getPropertyValue(self, propname):
+        """See DAVResource.getPropertyValue()"""
+        if propname in WIN32_PROPS and _mapWin32Props(self):
+            return _getWin32Property(self, propname, super(FileResource, self).getPropertyValue)
+        return super(FileResource, self).getPropertyValue(propname)
+
+    def setPropertyValue(self, propname, value, dryRun=False):
+        """See DAVResource.setPropertyValue()
+
+        Win32* properties are mapped to the file metadata, if configured.
+        """
+        if propname in WIN32_PROPS and _mapWin32Props(self):
+            base = super(FileResource, self)
+            return _setWin32Property(self, propname, value, dryRun,
+                                     base.getPropertyValue, base.setPropertyValue)
+        return super(FileResource, self).setPropertyValue(propname, value, dryRun)
+
     def setLastModified(self, destPath, timeStamp, dryRun):
         """Set last modified time for destPath to timeStamp on epoch-format"""
         # Translate time from RFC 1123 to seconds since epoch format
@@ -297,7 +471,7 @@ class FolderResource(DAVCollection):
             if isMove:
                 propMan.moveProperties(self.getRefUrl(), destRes.getRefUrl(),
                                        withChildren=False, environ=self.environ)
-            else:
+            elif not self.environ.get("wsgidav.defer_prop_copy"):
                 propMan.copyProperties(self.getRefUrl(), destRes.getRefUrl(), self.environ)
 
     def supportRecursiveMove(self, destPath):
@@ -320,6 +494,23 @@ class FolderResource(DAVCollection):
             self.provider.propManager.moveProperties(self.getRefUrl(), destRes.getRefUrl(),
                                                      withChildren=True, environ=self.environ)
 
+    def getPropertyValue(self, propname):
+        """See DAVResource.getPropertyValue()"""
+        if propname in WIN32_PROPS and _mapWin32Props(self):
+            return _getWin32Property(self, propname, super(FolderResource, self).getPropertyValue)
+        return super(FolderResource, self).getPropertyValue(propname)
+
+    def setPropertyValue(self, propname, value, dryRun=False):
+        """See DAVResource.setPropertyValue()
+
+        Win32* properties are mapped to the file metadata, if configured.
+        """
+        if propname in WIN32_PROPS and _mapWin32Props(self):
+            base = super(FolderResource, self)
+            return _setWin32Property(self, propname, value, dryRun,
+                                     base.getPropertyValue, base.setPropertyValue)
+        return super(FolderResource, self).setPropertyValue(propname, value, dryRun)
+
     def setLastModified(self, destPath, timeStamp, dryRun):
         """Set last modified time for destPath to timeStamp on epoch-format"""
         # Translate time from RFC 1123 to seconds since epoch format
@@ -329,12 +520,201 @@ class FolderResource(DAVCollection):
         return True
 
 
+# ========================================================================
+# XattrPropertyManager
+# ========================================================================
+
+class XattrPropertyManager(object):
+    """
+    Store dead properties as extended attributes of the files themselves.
+
+    Properties travel with the file, so MOVE (i.e. ``os.rename``) needs no
+    bookkeeping at all, and COPY is handled by ``shutil.copy2`` / ``copystat``,
+    which copy extended attributes as well. Out-of-band renames don't orphan
+    properties either.
+
+    If a property cannot be stored as attribute (unsupported platform or file
+    system, or value too large), the `fallback` property manager is used
+    (typically the globally configured one). Such files are marked with an
+    additional attribute, so the fallback is only queried for files that use
+    it (or if the file system does not support attributes).
+    Used by FilesystemProvider(..., xattrProperties=True).
+    """
+
+    def __init__(self, provider, fallback=None):
+        self.provider = provider
+        self.fallback = fallback
+        self._verbose = 2
+        if not _xattrSupported:
+            _logger.warning("Extended attributes are not supported on this platform: "
+                            "using fallback property manager {}".format(fallback))
+
+    def __repr__(self):
+        return "XattrPropertyManager({})".format(self.fallback)
+
+    @property
+    def supportsWithChildren(self):
+        # Only the fallback stores properties by URL
+        return self.fallback is None or getattr(self.fallback, "supportsWithChildren", False)
+
+    def _filePath(self, normurl, environ=None):
+        return self.provider._locToFilePath(self.provider.refUrlToPath(normurl), environ)
+
+    def _usesFallback(self, filePath):
+        """Return True, if the fallback may hold properties of this file."""
+        if not self.fallback:
+            return False
+        elif not _xattrSupported:
+            return True
+        try:
+            os.getxattr(filePath, _FALLBACK_XATTR)
+        except OSError as e:
+            return e.errno in _xattrUnsupportedErrors
+        return True
+
+    def _close(self):
+        if self.fallback:
+            self.fallback._close()
+
+    def _check(self, msg=""):
+        return not self.fallback or self.fallback._check(msg)
+
+    def _dump(self, msg=""):
+        _logger.info("{}: {}".format(self.__repr__(), msg))
+        if self.fallback:
+            self.fallback._dump(msg)
+
+    def _listNames(self, filePath):
+        if not _xattrSupported:
+            return []
+        try:
+            names = os.listxattr(filePath)
+        except OSError as e:
+            if e.errno in _xattrUnsupportedErrors or e.errno == errno.ENOENT:
+                return []
+            raise
+        return [name[len(XATTR_PREFIX):] for name in names if name.startswith(XATTR_PREFIX)]
+
+    def getProperties(self, normurl, environ=None):
+        filePath = self._filePath(normurl, environ)
+        names = self._listNames(filePath)
+        if self._usesFallback(filePath):
+            names.extend(name for name in self.fallback.getProperties(normurl, environ)
+                         if name not in names)
+        return names
+
+    def getProperty(self, normurl, propname, environ=None):
+        filePath = self._filePath(normurl, environ)
+        if _xattrSupported:
+            try:
+                return os.getxattr(filePath, XATTR_PREFIX + propname)
+            except OSError:
+                pass
+        if self._usesFallback(filePath):
+            return self.fallback.getProperty(normurl, propname, environ)
+        return None
+
+    def getPropertyDicts(self, normurlList, environ=None):
+        """Return {normurl: {propname: value}} for all URLs that have properties.
+
+        Reads one ``listxattr()`` and one ``getxattr()`` per property for every
+        file, and the fallback properties of all files with one call.
+        """
+        fallbackDicts = {}
+        if self.fallback and hasattr(self.fallback, "getPropertyDicts"):
+            fallbackDicts = self.fallback.getPropertyDicts(normurlList, environ)
+        elif self.fallback:
+            for normurl in normurlList:
+                fallbackDicts[normurl] = dict(
+                    (name, self.fallback.getProperty(normurl, name, environ))
+                    for name in self.fallback.getProperties(normurl, environ))
+        res = {}
+        for normurl in normurlList:
+            filePath = self._filePath(normurl, environ)
+            props = fallbackDicts.get(normurl, {}).copy()
+            # Attributes take precedence
+            for name in self._listNames(filePath):
+                try:
+                    props[name] = os.getxattr(filePath, XATTR_PREFIX + name)
+                except OSError:
+                    pass
+            if props:
+                res[normurl] = props
+        return res
+
+    def writeProperty(self, normurl, propname, propertyvalue, dryRun=False, environ=None):
+        assert normurl and normurl.startswith("/")
+        assert propname
+        assert propertyvalue is not None
+        _logger.debug("writeProperty({}, {}, dryRun={})".format(normurl, propname, dryRun))
+        if dryRun:
+            return
+        filePath = self._filePath(normurl, environ)
+        if _xattrSupported:
+            try:
+                os.setxattr(filePath, XATTR_PREFIX + propname, compat.to_bytes(propertyvalue))
+                if (self._usesFallback(filePath)
+                        and self.fallback.getProperty(normurl, propname, environ) is not None):
+                    # Remove a previous value, that did not fit as attribute
+                    self.fallback.removeProperty(normurl, propname, False, environ)
+                return
+            except OSError as e:
+                if e.errno not in _xattrUnsupportedErrors or not self.fallback:
+                    raise
+                _logger.info("Could not store {} as attribute of {} ({}): using fallback"
+                             .format(propname, normurl, e))
+                try:
+                    os.setxattr(filePath, _FALLBACK_XATTR, b"1")
+                except OSError as e:
+                    # E.g. the file system does not support attributes at all
+                    if e.errno not in _xattrUnsupportedErrors:
+                        raise
+        elif not self.fallback:
+            raise DAVError(HTTP_FORBIDDEN)
+        self.fallback.writeProperty(normurl, propname, propertyvalue, dryRun, environ)
+
+    def removeProperty(self, normurl, propname, dryRun=False, environ=None):
+        """
+        Specifying the removal of a property that does not exist is NOT an error.
+        """
+        _logger.debug("removeProperty({}, {}, dryRun={})".format(normurl, propname, dryRun))
+        if dryRun:
+            return
+        filePath = self._filePath(normurl, environ)
+        if _xattrSupported:
+            try:
+                os.removexattr(filePath, XATTR_PREFIX + propname)
+            except OSError:
+                pass
+        if self._usesFallback(filePath):
+            self.fallback.removeProperty(normurl, propname, dryRun, environ)
+
+    def removeProperties(self, normurl, environ=None, withChildren=False):
+        # Attributes are removed together with the file
+        if self.fallback and withChildren:
+            self.fallback.removeProperties(normurl, environ, withChildren=True)
+        elif self.fallback:
+            self.fallback.removeProperties(normurl, environ)
+
+    def copyProperties(self, srcurl, desturl, environ=None, withChildren=False):
+        # Attributes were already copied by shutil.copy2() or shutil.copystat()
+        if self.fallback and withChildren:
+            self.fallback.copyProperties(srcurl, desturl, environ, withChildren=True)
+        elif self.fallback:
+            self.fallback.copyProperties(srcurl, desturl, environ)
+
+    def moveProperties(self, srcurl, desturl, withChildren, environ=None):
+        # Attributes were already moved together with the file
+        if self.fallback:
+            self.fallback.moveProperties(srcurl, desturl, withChildren, environ)
+
+
 # ========================================================================
 # FilesystemProvider
 # ========================================================================
 class FilesystemProvider(DAVProvider):
 
-    def __init__(self, rootFolderPath, readonly=False):
+    def __init__(self, rootFolderPath, readonly=False, xattrProperties=False):
         # Expand leading '~' as user home dir; expand %VAR%, $Var, ..
         rootFolderPath = os.path.expandvars(os.path.expanduser(rootFolderPath))
         rootFolderPath = os.path.abspath(rootFolderPath)
@@ -345,6 +725,9 @@ class FilesystemProvider(DAVProvider):
 
         self.rootFolderPath = rootFolderPath
         self.readonly = readonly
+        self.xattrProperties = xattrProperties
+        # True, after Win32FileAttributes could not be stored as extended attribute
+        self._win32DeadAttributes = False
 
     def __repr__(self):
         rw = "Read-Write"
@@ -375,6 +758,16 @@ class FilesystemProvider(DAVProvider):
     def isReadOnly(self):
         return self.readonly
 
+    def setPropManager(self, propManager):
+        """Set the property manager.
+
+        If `xattrProperties` is enabled, `propManager` is only used as fallback
+        for properties that cannot be stored as extended attributes.
+        """
+        if self.xattrProperties:
+            propManager = XattrPropertyManager(self, propManager)
+        super(FilesystemProvider, self).setPropManager(propManager)
+
     def getResourceInst(self, path, environ):
         """Return info dictionary for path.
 
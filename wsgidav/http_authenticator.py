@@ -29,6 +29,22 @@ Usage::
      request will be sent a basic authentication required response
      (default = True)
 
+Results of basic authentication are remembered by a ``CredentialCache``, so
+expensive domain controllers (NT domain, LDAP, PAM, hashed passwords, ...) are
+not queried for every single request of a client (see ``auth_cache_ttl``).
+The cache is disabled by default, because a changed or revoked password is
+accepted until the cached entry expires.
+
+Digest nonces are HMAC-signed and carry their creation time, so they can be
+validated without server state (by all processes that share ``auth_secret``).
+Nonces older than ``auth_nonce_ttl`` seconds (or re-used nonce counts) are
+answered with a new challenge that has ``stale=true``, so clients retry with
+a fresh nonce, without asking the user again.
+
+If ``auth_session_ttl`` is set, a successful login is answered with a signed
+session cookie. Clients that send it back are accepted without a new
+authentication challenge, until the cookie expires.
+
 The HTTPAuthenticator will put the following authenticated information in the
 environ dictionary::
 
@@ -74,15 +90,19 @@ The environ variable here is the WSGI 'environ' dictionary. It is passed to
 all methods of the domain controller as a means for developers to pass information
 from previous middleware or server config (if required).
 """
-import random
+import base64
+import hashlib
+import hmac
+import os
 import re
+import threading
 import time
+from collections import OrderedDict
 from hashlib import md5
 
 from wsgidav import compat, util
-from wsgidav.domain_controller import WsgiDAVDomainController
+from wsgidav.domain_controller import HA1CacheMixin, WsgiDAVDomainController
 from wsgidav.middleware import BaseMiddleware
-from wsgidav.util import calc_base64, calc_hexdigest
 
 __docformat__ = "reStructuredText"
 
@@ -100,7 +120,7 @@ HOTFIX_WINXP_AcceptRootShareLogin = True
 HOTFIX_WIN_AcceptAnonymousOptions = False
 
 
-class SimpleDomainController(object):
+class SimpleDomainController(HA1CacheMixin):
     """SimpleDomainController : Simple domain controller for HTTPAuthenticator."""
 
     def __init__(self, dictusers=None, realmname="SimpleDomain"):
@@ -109,6 +129,7 @@ class SimpleDomainController(object):
         else:
             self._users = dictusers
         self._realmname = realmname
+        self._ha1Cache = {}
 
     def getDomainRealm(self, inputRelativeURL, environ):
         return self._realmname
@@ -130,6 +151,88 @@ class SimpleDomainController(object):
         return False
 
 
+# ========================================================================
+# CredentialCache
+# ========================================================================
+class CredentialCache(object):
+    """Bounded cache of credential verification results.
+
+    Successful verifications are remembered for `ttl` seconds.
+    Failed verifications are remembered as well, starting with `failBackoff`
+    seconds and doubling for every repeated failure (up to `maxFailBackoff`).
+    Within that period the same credentials are rejected without asking the
+    domain controller again.
+
+    Passwords are not stored: entries are keyed by (realm, username,
+    HMAC-SHA256 of the password with a random per-process salt).
+    """
+
+    def __init__(self, ttl=300, maxSize=1000, failBackoff=1.0, maxFailBackoff=60.0):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.failBackoff = failBackoff
+        self.maxFailBackoff = maxFailBackoff
+        self.hits = 0
+        self.misses = 0
+        self.negativeHits = 0
+        self._salt = os.urandom(16)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {key: (valid, expires, failCount)}
+
+    def __repr__(self):
+        return "CredentialCache({}/{} entries, {} hits, {} negative hits, {} misses)".format(
+            len(self._entries), self.maxSize, self.hits, self.negativeHits, self.misses)
+
+    def _makeKey(self, realmname, username, password):
+        digest = hmac.new(self._salt, compat.to_bytes(password), hashlib.sha256).hexdigest()
+        return (realmname, username, digest)
+
+    def lookup(self, realmname, username, password):
+        """Return True or False for a cached result, or None if not cached."""
+        key = self._makeKey(realmname, username, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                # Expired failures are kept, so the next backoff can grow
+                self.misses += 1
+                return None
+            # Pop and re-insert, so the entry becomes most recently used
+            self._entries[key] = self._entries.pop(key)
+            if entry[0]:
+                self.hits += 1
+            else:
+                self.negativeHits += 1
+            return entry[0]
+
+    def store(self, realmname, username, password, valid):
+        """Remember the result of a verification."""
+        key = self._makeKey(realmname, username, password)
+        now = time.time()
+        with self._lock:
+            prev = self._entries.pop(key, None)
+            if valid:
+                self._entries[key] = (True, now + self.ttl, 0)
+            else:
+                failCount = prev[2] + 1 if prev and not prev[0] else 1
+                backoff = min(self.failBackoff * 2 ** (failCount - 1), self.maxFailBackoff)
+                self._entries[key] = (False, now + backoff, failCount)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def getStats(self):
+        """Return a dict with hit/miss counters (e.g. for monitoring)."""
+        with self._lock:
+            return {"size": len(self._entries),
+                    "hits": self.hits,
+                    "negativeHits": self.negativeHits,
+                    "misses": self.misses,
+                    }
+
+
 # ========================================================================
 # HTTPAuthenticator
 # ========================================================================
@@ -146,7 +249,21 @@ class HTTPAuthenticator(BaseMiddleware):
         self._acceptdigest = config.get("acceptdigest", True)
         self._defaultdigest = config.get("defaultdigest", True)
         self._trusted_auth_header = config.get("trusted_auth_header", None)
-        self._noncedict = dict([])
+        # Secret for signing nonces and session cookies; random, unless configured
+        self._secret = compat.to_bytes(config.get("auth_secret") or os.urandom(32))
+        self._nonceTtl = config.get("auth_nonce_ttl", 300)
+        # Nonce counts that were used, per nonce (only guards this process)
+        self._nonceCounts = OrderedDict()
+        self._nonceCountsMaxSize = 1000
+        self._nonceLock = threading.Lock()
+        self._sessionTtl = config.get("auth_session_ttl", 0)
+        self._sessionCookieName = config.get("auth_session_cookie", "wsgidav_session")
+        self._credentialCache = None
+        if config.get("auth_cache_ttl", 0) > 0:
+            self._credentialCache = CredentialCache(
+                ttl=config["auth_cache_ttl"],
+                maxSize=config.get("auth_cache_size", 1000),
+                failBackoff=config.get("auth_fail_backoff", 1.0))
 
         self._headerparser = re.compile(r"([\w]+)=([^,]*),")
         # Note: extra parser to handle digest auth requests from certain
@@ -164,12 +281,33 @@ class HTTPAuthenticator(BaseMiddleware):
     def getDomainController(self):
         return self._domaincontroller
 
+    def getCredentialCache(self):
+        """Return the CredentialCache instance (None, if disabled)."""
+        return self._credentialCache
+
     def allowAnonymousAccess(self, share):
         return (isinstance(self._domaincontroller, WsgiDAVDomainController)
                 and not self._user_mapping.get(share))
 
+    def _getRealm(self, environ):
+        """Return the realm of this request (only resolved once per request)."""
+        realmname = environ.get("http_authenticator.realm")
+        if realmname is None:
+            realmname = self._domaincontroller.getDomainRealm(environ["PATH_INFO"], environ)
+            environ["http_authenticator.realm"] = realmname
+        return realmname
+
+    def _stopAuthTimer(self, environ):
+        """Add the time spent on authentication to the request's PhaseTimer."""
+        start = environ.pop("http_authenticator.start", None)
+        if start is not None:
+            environ["wsgidav.timer"].add("auth", time.time() - start)
+
     def __call__(self, environ, start_response):
-        realmname = self._domaincontroller.getDomainRealm(environ["PATH_INFO"], environ)
+        environ.pop("http_authenticator.realm", None)
+        if "wsgidav.timer" in environ:
+            environ["http_authenticator.start"] = time.time()
+        realmname = self._getRealm(environ)
 
         _logger.debug("realm '{}'".format(realmname))
         # _logger.debug("{}".format(environ))
@@ -182,17 +320,21 @@ class HTTPAuthenticator(BaseMiddleware):
         if force_allow or not self._domaincontroller.requireAuthentication(realmname, environ):
             # no authentication needed
             _logger.debug("No authorization required for realm '{}'".format(realmname))
-            environ["http_authenticator.realm"] = realmname
-            environ["http_authenticator.username"] = ""
-            return self._application(environ, start_response)
+            return self._grantAccess(environ, start_response, realmname, "")
 
         if self._trusted_auth_header and environ.get(self._trusted_auth_header):
             # accept a username that was injected by a trusted upstream server
             _logger.debug("Accept trusted username {}='{}'for realm '{}'".format(
                     self._trusted_auth_header, environ.get(self._trusted_auth_header), realmname))
-            environ["http_authenticator.realm"] = realmname
-            environ["http_authenticator.username"] = environ.get(self._trusted_auth_header)
-            return self._application(environ, start_response)
+            return self._grantAccess(environ, start_response, realmname,
+                                     environ.get(self._trusted_auth_header))
+
+        if self._sessionTtl:
+            username, renew = self._getSessionUser(environ, realmname)
+            if username is not None:
+                _logger.debug("Accept session cookie of user '{}' for realm '{}'"
+                              .format(username, realmname))
+                return self._grantAccess(environ, start_response, realmname, username, renew)
 
         if "HTTP_AUTHORIZATION" in environ:
             authheader = environ["HTTP_AUTHORIZATION"]
@@ -226,10 +368,78 @@ class HTTPAuthenticator(BaseMiddleware):
             return self.sendDigestAuthResponse(environ, start_response)
         return self.sendBasicAuthResponse(environ, start_response)
 
+    def _grantAccess(self, environ, start_response, realmname, username, newSession=False):
+        """Call the protected application for an authenticated user.
+
+        If `newSession` is true (after a login, or when the current session is
+        about to expire), the response sets a session cookie, if enabled.
+        """
+        self._stopAuthTimer(environ)
+        environ["http_authenticator.realm"] = realmname
+        environ["http_authenticator.username"] = username
+        if not (self._sessionTtl and newSession):
+            return self._application(environ, start_response)
+
+        # SameSite: browsers don't send the cookie with cross-site requests
+        # (e.g. forged PUT or DELETE requests)
+        cookie = "{}={}; Path={}; Max-Age={}; HttpOnly; SameSite=Strict".format(
+            self._sessionCookieName, self.makeSessionToken(realmname, username),
+            environ.get("SCRIPT_NAME") or "/", int(self._sessionTtl))
+        if environ.get("wsgi.url_scheme") == "https":
+            cookie += "; Secure"
+
+        def _start_response(status, response_headers, exc_info=None):
+            response_headers.append(("Set-Cookie", cookie))
+            return start_response(status, response_headers, exc_info)
+
+        return self._application(environ, _start_response)
+
+    def _sign(self, msg):
+        return hmac.new(self._secret, compat.to_bytes(msg), hashlib.sha256).hexdigest()
+
+    def _signSession(self, expires, realmname, username):
+        return self._sign("{}\n{}\n{}".format(expires, realmname, username))
+
+    def makeSessionToken(self, realmname, username):
+        """Return a signed session token '<expires>.<username>.<signature>'.
+
+        The token is stateless, so it is accepted by all server processes that
+        share the same `auth_secret`.
+        """
+        expires = int(time.time() + self._sessionTtl)
+        b64user = compat.to_native(base64.urlsafe_b64encode(compat.to_bytes(username)))
+        return "{}.{}.{}".format(expires, b64user, self._signSession(expires, realmname, username))
+
+    def _getSessionUser(self, environ, realmname):
+        """Return (username, renew) for a valid session cookie, or (None, False)."""
+        token = None
+        for cookie in environ.get("HTTP_COOKIE", "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == self._sessionCookieName:
+                token = value.strip('"')
+                break
+        if not token:
+            return None, False
+        try:
+            expires, b64user, signature = token.split(".")
+            expires = int(expires)
+            username = compat.to_native(base64.urlsafe_b64decode(compat.to_bytes(b64user)))
+        except (ValueError, TypeError):
+            _logger.warning("Invalid session cookie: {!r}".format(token))
+            return None, False
+        now = time.time()
+        if expires < now:
+            return None, False
+        if not hmac.compare_digest(signature, self._signSession(expires, realmname, username)):
+            _logger.warning("Session cookie signature mismatch for user '{}'".format(username))
+            return None, False
+        # Renew sessions that passed half of their lifetime
+        return username, expires - now < self._sessionTtl / 2.0
+
     def sendBasicAuthResponse(self, environ, start_response):
-        realmname = self._domaincontroller.getDomainRealm(
-            environ["PATH_INFO"], environ)
+        realmname = self._getRealm(environ)
         _logger.debug("401 Not Authorized for realm '{}' (basic)".format(realmname))
+        self._stopAuthTimer(environ)
         wwwauthheaders = "Basic realm=\"" + realmname + "\""
 
         body = compat.to_bytes(self.getErrorMessage())
@@ -241,8 +451,7 @@ class HTTPAuthenticator(BaseMiddleware):
         return [body]
 
     def authBasicAuthRequest(self, environ, start_response):
-        realmname = self._domaincontroller.getDomainRealm(
-            environ["PATH_INFO"], environ)
+        realmname = self._getRealm(environ)
         authheader = environ["HTTP_AUTHORIZATION"]
         authvalue = ""
         try:
@@ -254,27 +463,74 @@ class HTTPAuthenticator(BaseMiddleware):
         authvalue = compat.to_native(authvalue)
         username, password = authvalue.split(":", 1)
 
-        if self._domaincontroller.authDomainUser(realmname, username, password, environ):
-            environ["http_authenticator.realm"] = realmname
-            environ["http_authenticator.username"] = username
-            return self._application(environ, start_response)
+        if self._verifyBasicCredentials(realmname, username, password, environ):
+            return self._grantAccess(environ, start_response, realmname, username, True)
         return self.sendBasicAuthResponse(environ, start_response)
 
-    def sendDigestAuthResponse(self, environ, start_response):
-        realmname = self._domaincontroller.getDomainRealm(
-            environ["PATH_INFO"], environ)
-        random.seed()
-        serverkey = hex(random.getrandbits(32))[2:]
-        etagkey = calc_hexdigest(environ["PATH_INFO"])
-        timekey = str(time.time())
-        nonce_source = timekey + \
-            calc_hexdigest(timekey + ":" + etagkey + ":" + serverkey)
-        nonce = calc_base64(nonce_source)
+    def _verifyBasicCredentials(self, realmname, username, password, environ):
+        cache = self._credentialCache
+        if cache is None:
+            return self._domaincontroller.authDomainUser(realmname, username, password, environ)
+        valid = cache.lookup(realmname, username, password)
+        if valid is None:
+            valid = bool(self._domaincontroller.authDomainUser(
+                realmname, username, password, environ))
+            cache.store(realmname, username, password, valid)
+        elif not valid:
+            _logger.debug("Rejecting cached failed login for user '{}', realm '{}'"
+                          .format(username, realmname))
+        return valid
+
+    def makeDigestNonce(self, timestamp=None):
+        """Return a new digest nonce '<timestamp>.<signature>'."""
+        if timestamp is None:
+            timestamp = int(time.time())
+        return "{}.{}".format(timestamp, self._sign("nonce:{}".format(timestamp)))
+
+    def _checkDigestNonce(self, nonce, nc):
+        """Return True if `nonce` is authentic, not expired, and `nc` was not used before."""
+        try:
+            timestamp, signature = nonce.split(".")
+            timestamp = int(timestamp)
+        except ValueError:
+            return False
+        if not hmac.compare_digest(signature, self._sign("nonce:{}".format(timestamp))):
+            return False
+        if time.time() - timestamp > self._nonceTtl:
+            return False
+        if nc is None:
+            return True
+        with self._nonceLock:
+            # Pop and re-insert, so the nonce becomes most recently used
+            usedCounts = self._nonceCounts.pop(nonce, None) or set()
+            self._nonceCounts[nonce] = usedCounts
+            if nc in usedCounts:
+                return False
+            usedCounts.add(nc)
+            while len(self._nonceCounts) > self._nonceCountsMaxSize:
+                self._nonceCounts.popitem(last=False)
+        return True
+
+    def _getDigestHA1(self, realmname, username, environ):
+        """Return MD5(username:realm:password), preferably precomputed by the domain controller."""
+        getRealmUserHA1 = getattr(self._domaincontroller, "getRealmUserHA1", None)
+        if getRealmUserHA1 is not None:
+            return getRealmUserHA1(realmname, username, environ)
+        password = self._domaincontroller.getRealmUserPassword(realmname, username, environ)
+        if password is None:
+            return None
+        return self.md5h(username + ":" + realmname + ":" + password)
+
+    def sendDigestAuthResponse(self, environ, start_response, stale=False):
+        realmname = self._getRealm(environ)
         wwwauthheaders = ('Digest realm="{}", nonce="{}", algorithm=MD5, qop="auth"'
-                          .format(realmname, nonce))
+                          .format(realmname, self.makeDigestNonce()))
+        if stale:
+            wwwauthheaders += ", stale=true"
 
         _logger.debug("401 Not Authorized for realm '{}' (digest): {}"
                       .format(realmname, wwwauthheaders))
+        self._stopAuthTimer(environ)
 
         body = compat.to_bytes(self.getErrorMessage())
         start_response("401 Not Authorized", [("WWW-Authenticate", wwwauthheaders),
@@ -286,10 +542,10 @@ class HTTPAuthenticator(BaseMiddleware):
 
     def authDigestAuthRequest(self, environ, start_response):
 
-        realmname = self._domaincontroller.getDomainRealm(
-            environ["PATH_INFO"], environ)
+        realmname = self._getRealm(environ)
 
         isinvalidreq = False
+        req_username = None
 
         authheaderdict = dict([])
         authheaders = environ["HTTP_AUTHORIZATION"] + ","
@@ -350,6 +606,8 @@ class HTTPAuthenticator(BaseMiddleware):
 
         if "uri" in authheaderdict:
             req_uri = authheaderdict["uri"]
+        else:
+            isinvalidreq = True
 
         if "nonce" in authheaderdict:
             req_nonce = authheaderdict["nonce"]
@@ -372,8 +630,13 @@ class HTTPAuthenticator(BaseMiddleware):
             if req_hasqop:
                 isinvalidreq = True
 
-        if "nc" in authheaderdict:    # is read but nonce-count checking not implemented
+        if "nc" in authheaderdict:
             req_nc = authheaderdict["nc"]
+            try:
+                if int(req_nc, 16) < 1:
+                    isinvalidreq = True
+            except ValueError:
+                isinvalidreq = True
         else:
             req_nc = None
             if req_hasqop:
@@ -385,19 +648,22 @@ class HTTPAuthenticator(BaseMiddleware):
             isinvalidreq = True
 
         if not isinvalidreq:
-            req_password = self._domaincontroller.getRealmUserPassword(
-                realmname, req_username, environ)
+            req_ha1 = self._getDigestHA1(realmname, req_username, environ)
+            if req_ha1 is None:
+                isinvalidreq = True
 
+        if not isinvalidreq:
             req_method = environ["REQUEST_METHOD"]
 
-            required_digest = self.computeDigestResponse(
-                req_username, realmname, req_password, req_method, req_uri, req_nonce, req_cnonce,
-                req_qop, req_nc)
+            required_digest = self.computeDigestResponseFromHA1(
+                req_ha1, req_method, req_uri, req_nonce, req_cnonce, req_qop, req_nc)
 
             if required_digest != req_response:
                 _logger.warning("computeDigestResponse('{}', '{}', ...): {} != {}".format(
                     realmname, req_username, required_digest, req_response))
-                if HOTFIX_WINXP_AcceptRootShareLogin:
+                req_password = self._domaincontroller.getRealmUserPassword(
+                    realmname, req_username, environ)
+                if HOTFIX_WINXP_AcceptRootShareLogin and req_password is not None:
                     # Hotfix: also accept '/' digest
                     root_digest = self.computeDigestResponse(
                         req_username, "/", req_password, req_method, req_uri, req_nonce,
@@ -420,19 +686,28 @@ class HTTPAuthenticator(BaseMiddleware):
                          .format(req_username, realmname))
             return self.sendDigestAuthResponse(environ, start_response)
 
-        environ["http_authenticator.realm"] = realmname
-        environ["http_authenticator.username"] = req_username
-        return self._application(environ, start_response)
+        # The digest is valid. If the nonce is expired, forged, or replayed,
+        # request a retry with a new nonce (no password prompt with stale=true)
+        if not self._checkDigestNonce(req_nonce, req_nc):
+            _logger.info("Stale digest nonce for user '{}', realm '{}'"
+                         .format(req_username, realmname))
+            return self.sendDigestAuthResponse(environ, start_response, stale=True)
+
+        return self._grantAccess(environ, start_response, realmname, req_username, True)
 
     def computeDigestResponse(
             self, username, realm, password, method, uri, nonce, cnonce, qop, nc):
         A1 = username + ":" + realm + ":" + password
+        return self.computeDigestResponseFromHA1(
+            self.md5h(A1), method, uri, nonce, cnonce, qop, nc)
+
+    def computeDigestResponseFromHA1(self, HA1, method, uri, nonce, cnonce, qop, nc):
         A2 = method + ":" + uri
         if qop:
-            digestresp = self.md5kd(self.md5h(
-                A1), nonce + ":" + nc + ":" + cnonce + ":" + qop + ":" + self.md5h(A2))
+            digestresp = self.md5kd(
+                HA1, nonce + ":" + nc + ":" + cnonce + ":" + qop + ":" + self.md5h(A2))
         else:
-            digestresp = self.md5kd(self.md5h(A1), nonce + ":" + self.md5h(A2))
+            digestresp = self.md5kd(HA1, nonce + ":" + self.md5h(A2))
         return digestresp
 
     def md5h(self, data):
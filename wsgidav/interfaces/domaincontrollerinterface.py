@@ -13,6 +13,10 @@ class IDomainController(object):
 
     All methods must be implemented.
 
+    Optionally, ``getRealmUserHA1(realmname, username, environ)`` may return
+    the precomputed digest hash MD5(username:realm:password). The
+    HTTPAuthenticator then uses it instead of ``getRealmUserPassword()``.
+
     The environ variable here is the WSGI 'environ' dictionary. It is passed to
     all methods of the domain controller as a means for developers to pass information
     from previous middleware or server config (if required).
@@ -11,9 +11,31 @@ class PropertyManagerInterface(object):
 
         <wsgidav.property_manager.PropertyManager>_
         wsgidav.property_manager.ShelvePropertyManager
+        wsgidav.property_manager.SQLitePropertyManager
+        wsgidav.property_manager.StripedPropertyManager
 
     All methods must be implemented.
 
+    Optionally, a property manager may implement ``beginTransaction(environ)``,
+    returning a ``wsgidav.property_manager.PropertyTransaction``. PROPPATCH then
+    stages all dead property changes and commits them in one atomic step.
+
+    Optionally, ``getPropertyDicts(normurlList, environ)`` may return the
+    properties of many resources as ``{normurl: {propname: value}}``.
+    PROPFIND then reads all dead properties with one call.
+
+    Optionally, ``removeProperties(normurl, environ, withChildren=False)`` and
+    ``copyProperties(srcurl, desturl, environ, withChildren=False)`` may
+    accept `withChildren` (like ``moveProperties(srcurl, desturl,
+    withChildren, environ)``) to process `normurl` and all its descendants.
+    Such a property manager defines ``supportsWithChildren = True``, and
+    recursive DELETE and COPY of collections then update all properties with
+    one call. Otherwise these methods are called once per resource, with
+    ``(normurl, environ)`` and ``(srcurl, desturl, environ)``.
+
+    Optionally, ``getResourceCount()`` may return the number of resources that
+    have dead properties (reported by ``wsgidav.metrics.WsgiDavMetrics``).
+
     The url variable in methods refers to the relative URL of a resource. e.g. the
     resource http://server/share1/dir1/dir2/file3.txt would have a url of
     '/share1/dir1/dir2/file3.txt'
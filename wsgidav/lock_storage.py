@@ -85,6 +85,8 @@ class LockStorageDict(object):
     """  # noqa
     LOCK_TIME_OUT_DEFAULT = 604800  # 1 week, in seconds
     LOCK_TIME_OUT_MAX = 4 * 604800  # 1 month, in seconds
+    #: True, if several processes may use the same storage (see wsgidav.server.prefork)
+    multiProcessSafe = False
 
     def __init__(self):
         self._dict = None
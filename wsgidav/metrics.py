@@ -0,0 +1,222 @@
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+WSGI middleware that collects request metrics and serves them in the
+Prometheus text exposition format.
+
+Usage: add it to the end of ``middleware_stack`` (so it is the outermost
+middleware and also sees rejected requests)::
+
+    from wsgidav.metrics import WsgiDavMetrics
+    middleware_stack = [WsgiDavDirBrowser, HTTPAuthenticator, ErrorPrinter,
+                        WsgiDavDebugFilter, WsgiDavMetrics]
+
+Metrics are then available at ``http://server:port/_metrics`` (see the
+``metrics`` configuration option).
+Note that this URL does not require authentication.
+
+Collected metrics:
+
+    wsgidav_requests_total{method, share}
+    wsgidav_responses_total{status}
+    wsgidav_request_duration_seconds{method}     (histogram)
+    wsgidav_request_bytes_total{share}           (request Content-Length)
+    wsgidav_response_bytes_total{share}
+    wsgidav_requests_in_flight
+    wsgidav_locks                                (active locks)
+    wsgidav_property_resources                   (resources with dead properties)
+
+Only counters are updated per request; the lock and property manager sizes
+are computed when the metrics are requested.
+"""
+import bisect
+import threading
+import time
+
+from wsgidav import compat, util
+from wsgidav.middleware import BaseMiddleware
+
+__docformat__ = "reStructuredText"
+
+_logger = util.getModuleLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapeLabel(value):
+    return compat.to_native(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatSample(name, labels, value):
+    if labels:
+        labels = ",".join('{}="{}"'.format(k, _escapeLabel(v)) for k, v in labels)
+        return "{}{{{}}} {}".format(name, labels, value)
+    return "{} {}".format(name, value)
+
+
+# ========================================================================
+# WsgiDavMetrics
+# ========================================================================
+class WsgiDavMetrics(BaseMiddleware):
+    """WSGI middleware that counts requests and serves Prometheus metrics."""
+
+    def __init__(self, application, config):
+        self._application = application
+        opts = config.get("metrics") or {}
+        self._path = opts.get("path", "/_metrics")
+        self._perShare = opts.get("per_share", True)
+        self._buckets = tuple(opts.get("buckets", DEFAULT_BUCKETS))
+        self._lock = threading.Lock()
+        self._inFlight = 0
+        self._requests = {}  # {(method, share): count}
+        self._responses = {}  # {status: count}
+        self._durations = {}  # {method: [bucketCounts, sum, count]}
+        self._bytesIn = {}  # {share: bytes}
+        self._bytesOut = {}  # {share: bytes}
+        self._providers = set()
+
+    def __call__(self, environ, start_response):
+        if self._path and environ.get("SCRIPT_NAME", "") + environ["PATH_INFO"] == self._path:
+            return self._sendMetrics(environ, start_response)
+        return self._countRequest(environ, start_response)
+
+    def _countRequest(self, environ, start_response):
+        startTime = time.time()
+        provider = environ.get("wsgidav.provider")
+        if provider is not None:
+            share = provider.sharePath or "/"
+            self._providers.add(provider)
+        else:
+            share = ""
+        if not self._perShare:
+            share = ""
+        responseStatus = []
+
+        def _start_response(status, response_headers, exc_info=None):
+            responseStatus.append(status)
+            return start_response(status, response_headers, exc_info)
+
+        with self._lock:
+            self._inFlight += 1
+        bytesOut = 0
+        try:
+            app_iter = self._application(environ, _start_response)
+            try:
+                for v in app_iter:
+                    bytesOut += len(v)
+                    yield v
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+        finally:
+            self._record(environ, share, responseStatus[-1] if responseStatus else "500",
+                         time.time() - startTime, bytesOut)
+
+    def _record(self, environ, share, status, duration, bytesOut):
+        method = environ.get("REQUEST_METHOD", "")
+        status = status.split(" ", 1)[0]
+        try:
+            bytesIn = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            bytesIn = 0
+        bucket = bisect.bisect_left(self._buckets, duration)
+        with self._lock:
+            self._inFlight -= 1
+            key = (method, share)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._responses[status] = self._responses.get(status, 0) + 1
+            hist = self._durations.get(method)
+            if hist is None:
+                hist = self._durations[method] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+            hist[0][bucket] += 1
+            hist[1] += duration
+            hist[2] += 1
+            self._bytesIn[share] = self._bytesIn.get(share, 0) + bytesIn
+            self._bytesOut[share] = self._bytesOut.get(share, 0) + bytesOut
+
+    def _getManagerSizes(self):
+        """Return (lockCount, propertyResourceCount) of all known providers."""
+        lockManagers = {}
+        propManagers = {}
+        for provider in list(self._providers):
+            if provider.lockManager is not None:
+                lockManagers[id(provider.lockManager)] = provider.lockManager
+            if provider.propManager is not None:
+                propManagers[id(provider.propManager)] = provider.propManager
+        lockCount = None
+        for lm in lockManagers.values():
+            locks = lm.storage.getLockList("/", includeRoot=True, includeChildren=True,
+                                           tokenOnly=True)
+            lockCount = (lockCount or 0) + len(locks)
+        propCount = None
+        for pm in propManagers.values():
+            if hasattr(pm, "getResourceCount"):
+                propCount = (propCount or 0) + pm.getResourceCount()
+        return lockCount, propCount
+
+    def getMetricsText(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            inFlight = self._inFlight
+            requests = dict(self._requests)
+            responses = dict(self._responses)
+            durations = dict((m, (list(h[0]), h[1], h[2])) for m, h in self._durations.items())
+            bytesIn = dict(self._bytesIn)
+            bytesOut = dict(self._bytesOut)
+
+        lines = []
+
+        def _add(name, mtype, helpText, samples):
+            lines.append("# HELP {} {}".format(name, helpText))
+            lines.append("# TYPE {} {}".format(name, mtype))
+            for sampleName, labels, value in samples:
+                lines.append(_formatSample(sampleName, labels, value))
+
+        _add("wsgidav_requests_total", "counter", "Number of requests.",
+             [("wsgidav_requests_total", (("method", m), ("share", s)), v)
+              for (m, s), v in sorted(requests.items())])
+        _add("wsgidav_responses_total", "counter", "Number of responses by status code.",
+             [("wsgidav_responses_total", (("status", s),), v)
+              for s, v in sorted(responses.items())])
+
+        samples = []
+        for method, (counts, total, count) in sorted(durations.items()):
+            cumulated = 0
+            for le, n in zip(self._buckets + ("+Inf",), counts):
+                cumulated += n
+                samples.append(("wsgidav_request_duration_seconds_bucket",
+                                (("method", method), ("le", str(le))), cumulated))
+            samples.append(("wsgidav_request_duration_seconds_sum",
+                            (("method", method),), repr(total)))
+            samples.append(("wsgidav_request_duration_seconds_count",
+                            (("method", method),), count))
+        _add("wsgidav_request_duration_seconds", "histogram",
+             "Request duration in seconds (until the response was sent).", samples)
+
+        _add("wsgidav_request_bytes_total", "counter", "Request body bytes (Content-Length).",
+             [("wsgidav_request_bytes_total", (("share", s),), v)
+              for s, v in sorted(bytesIn.items())])
+        _add("wsgidav_response_bytes_total", "counter", "Response body bytes.",
+             [("wsgidav_response_bytes_total", (("share", s),), v)
+              for s, v in sorted(bytesOut.items())])
+        _add("wsgidav_requests_in_flight", "gauge", "Number of requests in progress.",
+             [("wsgidav_requests_in_flight", (), inFlight)])
+
+        lockCount, propCount = self._getManagerSizes()
+        if lockCount is not None:
+            _add("wsgidav_locks", "gauge", "Number of active locks.",
+                 [("wsgidav_locks", (), lockCount)])
+        if propCount is not None:
+            _add("wsgidav_property_resources", "gauge",
+                 "Number of resources with dead properties.",
+                 [("wsgidav_property_resources", (), propCount)])
+        return "\n".join(lines) + "\n"
+
+    def _sendMetrics(self, environ, start_response):
+        body = compat.to_bytes(self.getMetricsText())
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                                  ("Content-Length", str(len(body))),
+                                  ("Date", util.getRfc1123Time()),
+                                  ])
+        return [body]
@@ -14,6 +14,8 @@ class BaseMiddleware(object):
         wsgidav.error_printer.ErrorPrinter
         wsgidav.debug_filter.WsgiDavDebugFilter
         wsgidav.http_authenticator.HTTPAuthenticator
+        wsgidav.metrics.WsgiDavMetrics
+        wsgidav.profiler.WsgiDavProfiler
     """
 
     def __init__(self, application, config):
@@ -0,0 +1,187 @@
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+WSGI middleware that profiles a sample of the requests with cProfile (optional).
+
+The profiles are aggregated per request method and share, so hot paths can
+be found on live traffic.
+
+Usage: add it to ``middleware_stack`` before the authenticator (so the
+authenticator protects the profile URL) and after the directory browser (so
+it sees GET requests on collections)::
+
+    from wsgidav.profiler import WsgiDavProfiler
+    middleware_stack = [WsgiDavDirBrowser, WsgiDavProfiler, HTTPAuthenticator,
+                        ErrorPrinter, WsgiDavDebugFilter]
+
+These URL commands are evaluated (similar to ``?dump_storage`` of
+:class:`~wsgidav.debug_filter.WsgiDavDebugFilter`):
+
+``?profile_dump``
+    Return the aggregated statistics as text (one section per method and share).
+``?profile_dump=pstats``
+    Return the statistics of all sections merged in the binary pstats format,
+    which can be loaded with ``pstats.Stats(filename)`` or tools like SnakeViz.
+``?profile_reset``
+    Discard the collected statistics.
+
+Commands are only accepted from authenticated users (or the users listed in
+the ``profiler.users`` option) and are never profiled themselves.
+
+These configuration settings are evaluated (``profiler`` option):
+
+*sample_rate*
+    Fraction of the requests that are profiled (default: 0.01).
+*users*
+    List of user names that may use the URL commands. If None (default), all
+    authenticated users are accepted.
+*sort*, *limit*
+    Sort order and number of lines of the text output (default: 'cumulative', 30).
+"""
+import cProfile
+import marshal
+import pstats
+import random
+import threading
+
+from wsgidav import compat, util
+from wsgidav.middleware import BaseMiddleware
+
+__docformat__ = "reStructuredText"
+
+_logger = util.getModuleLogger(__name__)
+
+
+# ========================================================================
+# WsgiDavProfiler
+# ========================================================================
+class WsgiDavProfiler(BaseMiddleware):
+    """WSGI middleware that profiles a sample of the requests."""
+
+    def __init__(self, application, config):
+        self._application = application
+        opts = config.get("profiler") or {}
+        self._sampleRate = float(opts.get("sample_rate", 0.01))
+        self._users = opts.get("users")
+        self._sort = opts.get("sort", "cumulative")
+        self._limit = opts.get("limit", 30)
+        self._lock = threading.Lock()
+        self._stats = {}  # {(method, share): [pstats.Stats, requestCount]}
+
+    def __call__(self, environ, start_response):
+        query = environ.get("QUERY_STRING", "")
+        if "profile_dump" in query or "profile_reset" in query:
+            return self._handleCommand(environ, start_response, query)
+        if self._sampleRate <= 0 or random.random() >= self._sampleRate:
+            return self._application(environ, start_response)
+        return self._profileRequest(environ, start_response)
+
+    def _profileRequest(self, environ, start_response):
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ only allows one at a time)
+            _logger.debug("Skip profiling: another profiler is active")
+            for v in self._application(environ, start_response):
+                yield v
+            return
+
+        # Only profile while the application is running, not while the server
+        # writes the response
+        try:
+            app_iter = self._application(environ, start_response)
+        finally:
+            prof.disable()
+        try:
+            it = iter(app_iter)
+            while True:
+                prof.enable()
+                try:
+                    v = next(it)
+                except StopIteration:
+                    break
+                finally:
+                    prof.disable()
+                yield v
+        finally:
+            if hasattr(app_iter, "close"):
+                prof.enable()
+                try:
+                    app_iter.close()
+                finally:
+                    prof.disable()
+            self._addProfile(environ, prof)
+
+    def _addProfile(self, environ, prof):
+        provider = environ.get("wsgidav.provider")
+        share = (provider.sharePath or "/") if provider is not None else ""
+        key = (environ.get("REQUEST_METHOD", ""), share)
+        try:
+            stats = pstats.Stats(prof)
+        except TypeError:
+            return  # Nothing was recorded
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                self._stats[key] = [stats, 1]
+            else:
+                entry[0].add(stats)
+                entry[1] += 1
+
+    def getStats(self):
+        """Return {(method, share): (pstats.Stats, requestCount)}."""
+        with self._lock:
+            return dict((key, (stats, count)) for key, (stats, count) in self._stats.items())
+
+    def reset(self):
+        """Discard all collected statistics."""
+        with self._lock:
+            self._stats = {}
+
+    def getStatsText(self):
+        """Return the aggregated statistics as text."""
+        out = compat.StringIO()
+        with self._lock:
+            for (method, share), (stats, count) in sorted(self._stats.items()):
+                out.write("=== {} {} ({} requests) ===\n".format(method, share, count))
+                stats.stream = out
+                stats.sort_stats(self._sort).print_stats(self._limit)
+        return out.getvalue()
+
+    def getStatsData(self):
+        """Return the merged statistics in the binary pstats (marshal) format."""
+        with self._lock:
+            merged = pstats.Stats()
+            for stats, _count in self._stats.values():
+                merged.add(stats)
+            return marshal.dumps(merged.stats)
+
+    def _handleCommand(self, environ, start_response, query):
+        username = environ.get("http_authenticator.username")
+        if not username or (self._users is not None and username not in self._users):
+            _logger.warn("Refused profiler command for user {!r}".format(username))
+            body = b"Forbidden"
+            start_response("403 Forbidden", [("Content-Type", "text/plain"),
+                                             ("Content-Length", str(len(body))),
+                                             ("Date", util.getRfc1123Time()),
+                                             ])
+            return [body]
+
+        contentType = "text/plain; charset=utf-8"
+        if "profile_reset" in query:
+            self.reset()
+            _logger.info("Profiler statistics reset by {}".format(username))
+            body = b"Profiler statistics discarded.\n"
+        elif "profile_dump=pstats" in query:
+            contentType = "application/octet-stream"
+            body = self.getStatsData()
+        else:
+            body = compat.to_bytes(self.getStatsText() or "No requests profiled yet.\n")
+        start_response("200 OK", [("Content-Type", contentType),
+                                  ("Content-Length", str(len(body))),
+                                  ("Cache-Control", "no-cache"),
+                                  ("Date", util.getRfc1123Time()),
+                                  ])
+        return [body]
@@ -3,8 +3,11 @@
 # Licensed under the MIT license:
 # http://www.opensource.org/licenses/mit-license.php
 """
-Implements two property managers: one in-memory (dict-based), and one
-persistent low performance variant using shelve.
+Implements three property managers: one in-memory (dict-based), one
+persistent low performance variant using shelve, and one persistent variant
+using SQLite.
+StripedPropertyManager distributes properties over multiple instances of
+these, to reduce lock contention.
 
 The properties dictionaray is built like::
 
@@ -18,9 +21,13 @@ The properties dictionaray is built like::
 
 """
 import os
+import pickle
 import shelve
+import sqlite3
+import threading
+import weakref
 
-from wsgidav import util
+from wsgidav import compat, util
 from wsgidav.rw_lock import ReadWriteLock
 
 # TODO: comment's from Ian Bicking (2005)
@@ -51,6 +58,11 @@ class PropertyManager(object):
     For a persistent implementation, see property_manager.ShelvePropertyManager().
     """
 
+    #: True, if several processes may use the same storage (see wsgidav.server.prefork)
+    multiProcessSafe = False
+    #: True, if removeProperties() and copyProperties() accept `withChildren`
+    supportsWithChildren = True
+
     def __init__(self):
         self._dict = None
         self._loaded = False
@@ -149,6 +161,32 @@ class PropertyManager(object):
         finally:
             self._lock.release()
 
+    def getPropertyDicts(self, normurlList, environ=None):
+        """Return {normurl: {propname: value}} for all URLs that have properties."""
+        self._lock.acquireRead()
+        try:
+            if not self._loaded:
+                self._lazyOpen()
+            res = {}
+            for normurl in normurlList:
+                if normurl in self._dict:
+                    props = self._dict[normurl]
+                    if props:
+                        res[normurl] = dict(props)
+            return res
+        finally:
+            self._lock.release()
+
+    def getResourceCount(self):
+        """Return the number of resources that have dead properties."""
+        self._lock.acquireRead()
+        try:
+            if not self._loaded:
+                self._lazyOpen()
+            return len(self._dict)
+        finally:
+            self._lock.release()
+
     def writeProperty(self, normurl, propname, propertyvalue, dryRun=False, environ=None):
         assert normurl and normurl.startswith("/")
         assert propname  # and propname.startswith("{")
@@ -201,27 +239,41 @@ class PropertyManager(object):
         finally:
             self._lock.release()
 
-    def removeProperties(self, normurl, environ=None):
-        _logger.debug("removeProperties({})".format(normurl))
+    def removeProperties(self, normurl, environ=None, withChildren=False):
+        _logger.debug("removeProperties({}, withChildren={})".format(normurl, withChildren))
         self._lock.acquireWrite()
         try:
             if not self._loaded:
                 self._lazyOpen()
-            if normurl in self._dict:
+            if withChildren:
+                # Remove normurl\* (iterate over a copy, since we modify the keys)
+                for url in list(self._dict.keys()):
+                    if util.isEqualOrChildUri(normurl, url):
+                        del self._dict[url]
+                self._sync()
+            elif normurl in self._dict:
                 del self._dict[normurl]
                 self._sync()
         finally:
             self._lock.release()
 
-    def copyProperties(self, srcurl, desturl, environ=None):
-        _logger.debug("copyProperties({}, {})".format(srcurl, desturl))
+    def copyProperties(self, srcurl, desturl, environ=None, withChildren=False):
+        _logger.debug("copyProperties({}, {}, withChildren={})"
+                      .format(srcurl, desturl, withChildren))
         self._lock.acquireWrite()
         try:
             if __debug__ and self._verbose >= 2:
                 self._check()
             if not self._loaded:
                 self._lazyOpen()
-            if srcurl in self._dict:
+            if withChildren:
+                # Copy srcurl\*
+                for url in list(self._dict.keys()):
+                    if util.isEqualOrChildUri(srcurl, url):
+                        d = desturl.rstrip("/") + url[len(srcurl.rstrip("/")):]
+                        self._dict[d] = self._dict[url].copy()
+                self._sync()
+            elif srcurl in self._dict:
                 self._dict[desturl] = self._dict[srcurl].copy()
                 self._sync()
             if __debug__ and self._verbose >= 2:
@@ -238,10 +290,10 @@ class PropertyManager(object):
             if not self._loaded:
                 self._lazyOpen()
             if withChildren:
-                # Move srcurl\*
-                for url in self._dict.keys():
+                # Move srcurl\* (iterate over a copy, since we modify the keys)
+                for url in list(self._dict.keys()):
                     if util.isEqualOrChildUri(srcurl, url):
-                        d = url.replace(srcurl, desturl)
+                        d = desturl.rstrip("/") + url[len(srcurl.rstrip("/")):]
                         self._dict[d] = self._dict[url]
                         del self._dict[url]
             elif srcurl in self._dict:
@@ -254,6 +306,76 @@ class PropertyManager(object):
         finally:
             self._lock.release()
 
+    def beginTransaction(self, environ=None):
+        """Return a new PropertyTransaction for this property manager."""
+        return PropertyTransaction(self, environ)
+
+    def _commitTransaction(self, staged, environ=None):
+        """Apply a list of (normurl, propname, value) changes atomically."""
+        _logger.debug("_commitTransaction({} changes)".format(len(staged)))
+        self._lock.acquireWrite()
+        try:
+            if not self._loaded:
+                self._lazyOpen()
+            # Build all modified dicts first, so nothing is written if this fails
+            changed = {}
+            for normurl, propname, value in staged:
+                if normurl not in changed:
+                    changed[normurl] = dict(self._dict.get(normurl) or {})
+                if value is None:
+                    changed[normurl].pop(propname, None)
+                else:
+                    changed[normurl][propname] = value
+            for normurl, locatordict in changed.items():
+                self._dict[normurl] = locatordict
+            self._sync()
+            if __debug__ and self._verbose >= 2:
+                self._check("after transaction")
+        finally:
+            self._lock.release()
+
+
+# ========================================================================
+# PropertyTransaction
+# ========================================================================
+class PropertyTransaction(object):
+    """
+    A batch of dead property changes, that is written in one atomic step.
+
+    Changes are collected by `stage()` and passed to the property manager
+    on `commit()`, or discarded on `rollback()`.
+    """
+
+    def __init__(self, propManager, environ=None):
+        self.propManager = propManager
+        self.environ = environ
+        self.staged = []
+        self.closed = False
+
+    def __repr__(self):
+        return "PropertyTransaction({}, {} staged)".format(self.propManager, len(self.staged))
+
+    def stage(self, normurl, propname, propertyvalue):
+        """Add a change; propertyvalue None means 'remove property'."""
+        assert not self.closed
+        assert normurl and normurl.startswith("/")
+        assert propname
+        self.staged.append((normurl, propname, propertyvalue))
+
+    def getStagedNames(self):
+        """Return the set of property names that are staged."""
+        return set(propname for _normurl, propname, _value in self.staged)
+
+    def commit(self):
+        assert not self.closed
+        self.closed = True
+        if self.staged:
+            self.propManager._commitTransaction(self.staged, self.environ)
+
+    def rollback(self):
+        self.closed = True
+        self.staged = []
+
 
 # ========================================================================
 # ShelvePropertyManager
@@ -261,11 +383,26 @@ class PropertyManager(object):
 
 class ShelvePropertyManager(PropertyManager):
     """
-    A low performance property manager implementation using shelve
+    A low performance property manager implementation using shelve.
+
+    By default every modification is synced to disk immediately.
+    Pass `writeBehind=True` to buffer modifications in memory instead and
+    commit them in batches, either every `commitInterval` seconds or as soon
+    as `commitSize` resources were modified.
+    Buffered modifications are visible to readers immediately and are also
+    appended to a journal file (`<storagePath>.journal`), that is replayed on
+    the next open if the process terminates before the batch was committed.
+    The journal is fsynced once per batch, so after a crash of the machine
+    (rather than the process) the modifications of the last uncommitted
+    batch may be lost.
     """
 
-    def __init__(self, storagePath):
+    def __init__(self, storagePath, writeBehind=False, commitInterval=1.0, commitSize=100):
         self._storagePath = os.path.abspath(storagePath)
+        self._writeBehind = bool(writeBehind)
+        self._commitInterval = commitInterval
+        self._commitSize = commitSize
+        self._stopEvent = None
         super(ShelvePropertyManager, self).__init__()
 
     def __repr__(self):
@@ -282,6 +419,16 @@ class ShelvePropertyManager(PropertyManager):
             # careful to re-assign values to _dict after modifying them
             self._dict = shelve.open(self._storagePath,
                                      writeback=False)
+            if self._writeBehind:
+                self._dict = _WriteBehindShelf(self._dict, self._storagePath)
+                if self._commitInterval:
+                    self._stopEvent = threading.Event()
+                    t = threading.Thread(target=_writeBehindLoop,
+                                         name="ShelvePropertyManager.commit",
+                                         args=(weakref.ref(self), self._stopEvent,
+                                               self._commitInterval))
+                    t.daemon = True
+                    t.start()
             self._loaded = True
             if __debug__ and self._verbose >= 2:
                 self._check("After shelve.open()")
@@ -294,7 +441,13 @@ class ShelvePropertyManager(PropertyManager):
         _logger.debug("_sync()")
         self._lock.acquireWrite()  # TODO: read access is enough?
         try:
-            if self._loaded:
+            if not self._loaded:
+                pass
+            elif self._writeBehind:
+                # Modifications are already journaled: commit only full batches
+                if len(self._dict.pending) >= self._commitSize:
+                    self._dict.commit()
+            else:
                 self._dict.sync()
         finally:
             self._lock.release()
@@ -303,6 +456,9 @@ class ShelvePropertyManager(PropertyManager):
         _logger.debug("_close()")
         self._lock.acquireWrite()
         try:
+            if self._stopEvent is not None:
+                self._stopEvent.set()
+                self._stopEvent = None
             if self._loaded:
                 self._dict.close()
                 self._dict = None
@@ -310,17 +466,623 @@ class ShelvePropertyManager(PropertyManager):
         finally:
             self._lock.release()
 
+    def _check(self, msg=""):
+        if not (self._writeBehind and self._loaded):
+            return super(ShelvePropertyManager, self)._check(msg)
+        # Only validate the pending batch, since scanning the whole shelve
+        # on every write would defeat the purpose of write-behind mode
+        try:
+            for k, v in self._dict.pending.items():
+                _dummy = "{}, {}".format(k, v)  # noqa
+            return True
+        except Exception:
+            _logger.exception("{} _check: ERROR {}".format(self.__class__.__name__, msg))
+            return False
+
+    def commit(self):
+        """Write buffered modifications to disc (only used in write-behind mode)."""
+        self._lock.acquireWrite()
+        try:
+            if self._loaded and self._writeBehind:
+                self._dict.commit()
+        finally:
+            self._lock.release()
+
     def clear(self):
         """Delete all entries."""
         self._lock.acquireWrite()
         try:
             was_closed = self._dict is None
             if was_closed:
-                self.open()
+                self._lazyOpen()
             if len(self._dict):
                 self._dict.clear()
                 self._dict.sync()
             if was_closed:
-                self.close()
+                self._close()
         finally:
             self._lock.release()
+
+
+def _writeBehindLoop(managerRef, stopEvent, interval):
+    """Thread target that periodically commits a write-behind shelve."""
+    while not stopEvent.wait(interval):
+        pm = managerRef()
+        if pm is None:
+            return
+        try:
+            pm.commit()
+        except Exception:
+            _logger.exception("Write-behind commit failed")
+        del pm
+
+
+def _fsyncPath(path):
+    """Flush a file's data to the disk, if it exists."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return True
+
+
+class _WriteBehindShelf(object):
+    """
+    Dict-like overlay that buffers modifications of a shelve.
+
+    `pending` maps URLs to their new property dict, or to None if the URL was
+    removed. Every modification is appended to a journal file, so pending
+    entries that were not committed yet are replayed on the next open.
+    Callers are expected to hold the property manager's write lock for
+    modifications.
+
+    Appended records are only flushed to the OS, so they survive a crash of
+    the process, but not of the machine. ``commit()`` is the group commit:
+    it fsyncs the journal before the shelve is modified, and the shelve files
+    before the journal is reset.
+    """
+
+    def __init__(self, shelf, storagePath):
+        self._shelf = shelf
+        self._storagePath = storagePath
+        self._journalPath = storagePath + ".journal"
+        self.pending = {}
+        self._replay()
+        self._journal = open(self._journalPath, "ab")
+        self.commit()
+        self._journal.truncate(0)
+
+    def _replay(self):
+        if not os.path.exists(self._journalPath):
+            return
+        count = 0
+        with open(self._journalPath, "rb") as f:
+            while True:
+                try:
+                    url, value = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    # Incomplete record, written while the process died
+                    _logger.warning("Ignoring truncated journal record in {}"
+                                    .format(self._journalPath))
+                    break
+                self.pending[url] = value
+                count += 1
+        if count:
+            _logger.info("Replaying {} journal records from {}".format(count, self._journalPath))
+
+    def _append(self, url, value):
+        # Records contain the complete new state, so replaying is idempotent
+        pickle.dump((url, value), self._journal, 2)
+        self._journal.flush()
+        self.pending[url] = value
+
+    def commit(self):
+        """Apply pending modifications to the shelve and reset the journal."""
+        if not self.pending:
+            return 0
+        # The journal must be on disk, before the shelve is modified
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        for url, value in self.pending.items():
+            if value is not None:
+                self._shelf[url] = value
+            elif url in self._shelf:
+                del self._shelf[url]
+        self._shelf.sync()
+        self._fsyncShelf()
+        self._journal.truncate(0)
+        count = len(self.pending)
+        self.pending.clear()
+        _logger.debug("Committed {} modified resources".format(count))
+        return count
+
+    sync = commit
+
+    def _fsyncShelf(self):
+        # Depending on the dbm module, the shelve is stored in one or more
+        # files, named after the storage path
+        for ext in ("", ".db", ".dat", ".dir", ".pag"):
+            _fsyncPath(self._storagePath + ext)
+
+    def close(self):
+        self.commit()
+        self._journal.close()
+        self._shelf.close()
+
+    def clear(self):
+        self.pending.clear()
+        self._journal.truncate(0)
+        self._shelf.clear()
+
+    def __contains__(self, url):
+        if url in self.pending:
+            return self.pending[url] is not None
+        return url in self._shelf
+
+    def __getitem__(self, url):
+        if url in self.pending:
+            value = self.pending[url]
+            if value is None:
+                raise KeyError(url)
+            # Return a copy, like shelve does
+            return value.copy()
+        return self._shelf[url]
+
+    def get(self, url, default=None):
+        try:
+            return self[url]
+        except KeyError:
+            return default
+
+    def __setitem__(self, url, value):
+        self._append(url, dict(value))
+
+    def __delitem__(self, url):
+        if url not in self:
+            raise KeyError(url)
+        self._append(url, None)
+
+    def keys(self):
+        res = set(self._shelf.keys())
+        for url, value in self.pending.items():
+            if value is None:
+                res.discard(url)
+            else:
+                res.add(url)
+        return list(res)
+
+    def items(self):
+        return [(url, self[url]) for url in self.keys()]
+
+    def __len__(self):
+        return len(self.keys())
+
+
+# ========================================================================
+# SQLitePropertyManager
+# ========================================================================
+
+class _ConnectionHolder(object):
+    """Close a SQLite connection when the last reference is dropped."""
+
+    def __init__(self, con):
+        self.con = con
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SQLitePropertyManager(PropertyManager):
+    """
+    A persistent property manager implementation using SQLite.
+
+    Properties are stored as (url, name, value) rows. The primary key index on
+    (url, name) allows to handle a resource and all its descendants as one
+    key range, so recursive copy, move and remove are single SQL statements,
+    no matter how many other properties are stored.
+
+    The database file may be shared by multiple processes: every thread opens
+    its own connection and writes are done in ``BEGIN IMMEDIATE`` transactions.
+    The database is switched to write-ahead logging (WAL), so readers don't
+    block writers.
+    """
+
+    multiProcessSafe = True
+
+    def __init__(self, storagePath, timeout=10.0):
+        self._storagePath = os.path.abspath(storagePath)
+        self._timeout = timeout
+        self._local = threading.local()
+        super(SQLitePropertyManager, self).__init__()
+
+    def __repr__(self):
+        return "SQLitePropertyManager({})".format(self._storagePath)
+
+    def _lazyOpen(self):
+        _logger.debug("_lazyOpen({})".format(self._storagePath))
+        self._lock.acquireWrite()
+        try:
+            # Test again within the critical section
+            if self._loaded:
+                return True
+            con = self._getConnection()
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE IF NOT EXISTS properties ("
+                        "url TEXT NOT NULL, "
+                        "name TEXT NOT NULL, "
+                        "value BLOB NOT NULL, "
+                        "PRIMARY KEY (url, name))")
+            self._loaded = True
+        finally:
+            self._lock.release()
+
+    def _getConnection(self):
+        """Return the SQLite connection of the current thread.
+
+        The connection is only referenced by the thread-local storage, so it is
+        closed as soon as the thread ends (or the manager is closed).
+        """
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            # isolation_level=None: we issue BEGIN/COMMIT ourselves
+            # check_same_thread=False: the connection may be closed by the
+            # garbage collector in another thread
+            con = sqlite3.connect(self._storagePath, timeout=self._timeout,
+                                  isolation_level=None, check_same_thread=False)
+            holder = self._local.holder = _ConnectionHolder(con)
+        return holder.con
+
+    def _execute(self, *statements):
+        """Run a list of (sql, args) tuples in one write transaction."""
+        if not self._loaded:
+            self._lazyOpen()
+        con = self._getConnection()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, args in statements:
+                con.execute(sql, args)
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def _query(self, sql, args):
+        if not self._loaded:
+            self._lazyOpen()
+        return self._getConnection().execute(sql, args).fetchall()
+
+    def _close(self):
+        _logger.debug("_close()")
+        self._lock.acquireWrite()
+        try:
+            holder = getattr(self._local, "holder", None)
+            if holder is not None:
+                holder.close()
+            # Connections of other threads are closed when the old thread-local
+            # storage is released
+            self._local = threading.local()
+            self._loaded = False
+        finally:
+            self._lock.release()
+
+    def _check(self, msg=""):
+        return True
+
+    def _dump(self, msg=""):
+        _logger.info("{}({}): {}".format(self.__class__.__name__, self.__repr__(), msg))
+        try:
+            lastUrl = None
+            for url, name, value in self._query(
+                    "SELECT url, name, value FROM properties ORDER BY url, name", ()):
+                if url != lastUrl:
+                    _logger.info("    {}".format(url))
+                    lastUrl = url
+                _logger.info("        {}: '{}'".format(name, value))
+        except Exception as e:
+            _logger.error("SQLitePropertyManager._dump()  ERROR: {}".format(e))
+
+    def getProperties(self, normurl, environ=None):
+        _logger.debug("getProperties({})".format(normurl))
+        rows = self._query("SELECT name FROM properties WHERE url = ?", (normurl, ))
+        return [compat.to_native(name) for (name, ) in rows]
+
+    def getProperty(self, normurl, propname, environ=None):
+        _logger.debug("getProperty({}, {})".format(normurl, propname))
+        rows = self._query("SELECT value FROM properties WHERE url = ? AND name = ?",
+                           (normurl, propname))
+        if not rows:
+            return None
+        return rows[0][0]
+
+    def getPropertyDicts(self, normurlList, environ=None):
+        """Return a dictionary {normurl: {propname: value, ...}, ...}.
+
+        All properties of the given URLs are fetched with one query per
+        block of URLs. URLs without properties are not contained in the result.
+        """
+        _logger.debug("getPropertyDicts({} urls)".format(len(normurlList)))
+        res = {}
+        # SQLite limits the number of host parameters per statement
+        chunkSize = 500
+        for i in compat.xrange(0, len(normurlList), chunkSize):
+            chunk = normurlList[i:i + chunkSize]
+            sql = ("SELECT url, name, value FROM properties WHERE url IN ({})"
+                   .format(", ".join(["?"] * len(chunk))))
+            for url, name, value in self._query(sql, tuple(chunk)):
+                res.setdefault(compat.to_native(url), {})[compat.to_native(name)] = value
+        return res
+
+    def getResourceCount(self):
+        return self._query("SELECT COUNT(DISTINCT url) FROM properties", ())[0][0]
+
+    def writeProperty(self, normurl, propname, propertyvalue, dryRun=False, environ=None):
+        assert normurl and normurl.startswith("/")
+        assert propname  # and propname.startswith("{")
+        assert propertyvalue is not None
+
+        _logger.debug("writeProperty({}, {}, dryRun={}):\n\t{}"
+                      .format(normurl, propname, dryRun, propertyvalue))
+        if dryRun:
+            return  # TODO: can we check anything here?
+
+        self._execute(("INSERT OR REPLACE INTO properties (url, name, value) VALUES (?, ?, ?)",
+                       (normurl, propname, propertyvalue)))
+
+    def removeProperty(self, normurl, propname, dryRun=False, environ=None):
+        """
+        Specifying the removal of a property that does not exist is NOT an error.
+        """
+        _logger.debug("removeProperty({}, {}, dryRun={})".format(normurl, propname, dryRun))
+        if dryRun:
+            # TODO: can we check anything here?
+            return
+        self._execute(("DELETE FROM properties WHERE url = ? AND name = ?",
+                       (normurl, propname)))
+
+    def _commitTransaction(self, staged, environ=None):
+        _logger.debug("_commitTransaction({} changes)".format(len(staged)))
+        statements = []
+        for normurl, propname, value in staged:
+            if value is None:
+                statements.append(("DELETE FROM properties WHERE url = ? AND name = ?",
+                                   (normurl, propname)))
+            else:
+                statements.append(("INSERT OR REPLACE INTO properties (url, name, value) "
+                                   "VALUES (?, ?, ?)", (normurl, propname, value)))
+        self._execute(*statements)
+
+    def removeProperties(self, normurl, environ=None, withChildren=False):
+        _logger.debug("removeProperties({}, withChildren={})".format(normurl, withChildren))
+        if withChildren:
+            where, args = _sqlMatchTree(normurl)
+            self._execute(("DELETE FROM properties WHERE " + where, args))
+        else:
+            self._execute(("DELETE FROM properties WHERE url = ?", (normurl, )))
+
+    def copyProperties(self, srcurl, desturl, environ=None, withChildren=False):
+        _logger.debug("copyProperties({}, {}, withChildren={})"
+                      .format(srcurl, desturl, withChildren))
+        if withChildren:
+            where, args = _sqlMatchTree(srcurl)
+            self._execute(
+                ("INSERT OR REPLACE INTO properties (url, name, value) "
+                 "SELECT ? || substr(url, ?), name, value FROM properties WHERE " + where,
+                 (desturl.rstrip("/"), len(srcurl.rstrip("/")) + 1) + args))
+        else:
+            # Like PropertyManager, replace all existing destination properties
+            self._execute(
+                ("DELETE FROM properties WHERE url = ?", (desturl, )),
+                ("INSERT INTO properties (url, name, value) "
+                 "SELECT ?, name, value FROM properties WHERE url = ?",
+                 (desturl, srcurl)))
+
+    def moveProperties(self, srcurl, desturl, withChildren, environ=None):
+        _logger.debug("moveProperties({}, {}, {})".format(srcurl, desturl, withChildren))
+        if withChildren:
+            # Move srcurl\*
+            where, args = _sqlMatchTree(srcurl)
+            self._execute(
+                ("UPDATE OR REPLACE properties SET url = ? || substr(url, ?) WHERE " + where,
+                 (desturl.rstrip("/"), len(srcurl.rstrip("/")) + 1) + args))
+        else:
+            # Move srcurl only
+            self._execute(
+                ("DELETE FROM properties WHERE url = ?", (desturl, )),
+                ("UPDATE properties SET url = ? WHERE url = ?", (desturl, srcurl)))
+
+    def clear(self):
+        """Delete all entries."""
+        self._execute(("DELETE FROM properties", ()))
+
+
+def _sqlMatchTree(url):
+    """Return a (where-clause, args) tuple that matches `url` and all descendants.
+
+    Like util.isEqualOrChildUri(), '/a/b' and '/a/b/' are considered equal.
+    Descendants of '/a/b' are selected as key range ['/a/b/', '/a/b0'), since
+    '0' is the character that follows '/', so the index is used.
+    """
+    base = url.rstrip("/")
+    return ("(url = ? OR (url >= ? AND url < ?))", (base, base + "/", base + "0"))
+
+
+# ========================================================================
+# StripedPropertyManager
+# ========================================================================
+
+class StripedPropertyManager(object):
+    """
+    Distribute properties over independent partitions, one per top-level
+    URL segment (e.g. one per share, or per top-level folder of a root share).
+    Note that shares with more than one path segment, that start with the same
+    segment (e.g. '/dav/a' and '/dav/b'), use the same partition.
+
+    Every partition is a complete property manager with its own lock, so
+    requests only contend if they access the same partition. Recursive copy
+    and move lock only the source and destination partitions.
+
+    `factory` is called with the partition prefix (e.g. '/dav') and returns a
+    new dict based property manager, i.e. a PropertyManager or
+    ShelvePropertyManager (copy and move between partitions access their
+    dictionaries directly). By default in-memory PropertyManagers are used::
+
+        StripedPropertyManager(lambda prefix: ShelvePropertyManager(
+            "props{}.shelve".format(prefix.replace("/", "_"))))
+    """
+
+    multiProcessSafe = False
+
+    def __init__(self, factory=None):
+        self._factory = factory or (lambda prefix: PropertyManager())
+        self._partitions = {}
+        self._partitionsLock = threading.Lock()
+        self._verbose = 2
+
+    def __repr__(self):
+        return "StripedPropertyManager({} partitions)".format(len(self._partitions))
+
+    @property
+    def _loaded(self):
+        return any(pm._loaded for pm in list(self._partitions.values()))
+
+    def _partitionPrefix(self, normurl):
+        return "/" + normurl.strip("/").split("/", 1)[0]
+
+    def _getPartition(self, normurl):
+        prefix = self._partitionPrefix(normurl)
+        # Partitions are never removed, so only creating one requires the lock
+        pm = self._partitions.get(prefix)
+        if pm is not None:
+            return pm
+        with self._partitionsLock:
+            pm = self._partitions.get(prefix)
+            if pm is None:
+                _logger.debug("Creating property partition for {}".format(prefix))
+                pm = self._factory(prefix)
+                assert (isinstance(pm, PropertyManager)
+                        and not isinstance(pm, SQLitePropertyManager)), \
+                    "Partitions must be dict based property managers: {!r}".format(pm)
+                pm._verbose = self._verbose
+                self._partitions[prefix] = pm
+        return pm
+
+    def _close(self):
+        with self._partitionsLock:
+            for pm in self._partitions.values():
+                pm._close()
+
+    def _check(self, msg=""):
+        return all(pm._check(msg) for pm in list(self._partitions.values()))
+
+    def _dump(self, msg=""):
+        _logger.info("{}: {}".format(self.__repr__(), msg))
+        for prefix, pm in sorted(self._partitions.items()):
+            pm._dump("partition {}".format(prefix))
+
+    def getProperties(self, normurl, environ=None):
+        return self._getPartition(normurl).getProperties(normurl, environ)
+
+    def getProperty(self, normurl, propname, environ=None):
+        return self._getPartition(normurl).getProperty(normurl, propname, environ)
+
+    def getPropertyDicts(self, normurlList, environ=None):
+        byPartition = {}
+        for normurl in normurlList:
+            byPartition.setdefault(self._partitionPrefix(normurl), []).append(normurl)
+        res = {}
+        for prefix, urls in byPartition.items():
+            res.update(self._getPartition(prefix).getPropertyDicts(urls, environ))
+        return res
+
+    def getResourceCount(self):
+        return sum(pm.getResourceCount() for pm in list(self._partitions.values()))
+
+    def writeProperty(self, normurl, propname, propertyvalue, dryRun=False, environ=None):
+        assert normurl and normurl.startswith("/")
+        return self._getPartition(normurl).writeProperty(
+            normurl, propname, propertyvalue, dryRun, environ)
+
+    def removeProperty(self, normurl, propname, dryRun=False, environ=None):
+        return self._getPartition(normurl).removeProperty(normurl, propname, dryRun, environ)
+
+    def removeProperties(self, normurl, environ=None, withChildren=False):
+        if withChildren and normurl.strip("/") == "":
+            # The root collection spans all partitions
+            with self._partitionsLock:
+                partitions = list(self._partitions.items())
+            for prefix, pm in partitions:
+                pm.removeProperties(prefix, environ, withChildren=True)
+            return
+        return self._getPartition(normurl).removeProperties(
+            normurl, environ, withChildren=withChildren)
+
+    def copyProperties(self, srcurl, desturl, environ=None, withChildren=False):
+        srcPm = self._getPartition(srcurl)
+        destPm = self._getPartition(desturl)
+        if srcPm is destPm:
+            return srcPm.copyProperties(srcurl, desturl, environ, withChildren=withChildren)
+        self._transfer(srcPm, destPm, srcurl, desturl, withChildren, False)
+
+    def moveProperties(self, srcurl, desturl, withChildren, environ=None):
+        srcPm = self._getPartition(srcurl)
+        destPm = self._getPartition(desturl)
+        if srcPm is destPm:
+            return srcPm.moveProperties(srcurl, desturl, withChildren, environ)
+        self._transfer(srcPm, destPm, srcurl, desturl, withChildren, True)
+
+    def _transfer(self, srcPm, destPm, srcurl, desturl, withChildren, isMove):
+        """Copy or move properties between two (dict based) partitions."""
+        _logger.debug("_transfer({}, {}, withChildren={}, isMove={})"
+                      .format(srcurl, desturl, withChildren, isMove))
+        # Always lock partitions in the same order, to prevent dead locks
+        locks = sorted([srcPm, destPm], key=id)
+        for pm in locks:
+            pm._lock.acquireWrite()
+        try:
+            for pm in locks:
+                if not pm._loaded:
+                    pm._lazyOpen()
+            if withChildren:
+                srcBase = srcurl.rstrip("/")
+                urls = [url for url in list(srcPm._dict.keys())
+                        if util.isEqualOrChildUri(srcurl, url)]
+            else:
+                srcBase = srcurl
+                urls = [srcurl] if srcurl in srcPm._dict else []
+            for url in urls:
+                d = (desturl.rstrip("/") + url[len(srcBase):]) if withChildren else desturl
+                destPm._dict[d] = srcPm._dict[url].copy()
+                if isMove:
+                    del srcPm._dict[url]
+            destPm._sync()
+            if isMove:
+                srcPm._sync()
+        finally:
+            for pm in reversed(locks):
+                pm._lock.release()
+
+    def beginTransaction(self, environ=None):
+        """Return a new PropertyTransaction for this property manager."""
+        return PropertyTransaction(self, environ)
+
+    def _commitTransaction(self, staged, environ=None):
+        """Commit staged changes, one atomic step per partition."""
+        byPartition = {}
+        for change in staged:
+            byPartition.setdefault(self._partitionPrefix(change[0]), []).append(change)
+        for prefix, changes in sorted(byPartition.items()):
+            self._getPartition(prefix)._commitTransaction(changes, environ)
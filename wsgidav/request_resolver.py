@@ -148,7 +148,12 @@ __docformat__ = "reStructuredText"
 class RequestResolver(BaseMiddleware):
 
     def __init__(self):
-        pass
+        # One RequestServer per provider: {provider: RequestServer}
+        self._servers = {}
+
+    def forgetProvider(self, provider):
+        """Discard the cached RequestServer (e.g. if the provider was removed)."""
+        self._servers.pop(provider, None)
 
     def __call__(self, environ, start_response):
         path = environ["PATH_INFO"]
@@ -185,19 +190,15 @@ class RequestResolver(BaseMiddleware):
                 headers.append(("MS-Author-Via", "DAV"))
 
             start_response("200 OK", headers)
-            yield b""
-            return
+            return [b""]
 
         if provider is None:
             raise DAVError(HTTP_NOT_FOUND,
                            "Could not find resource provider for '{}'".format(path))
 
         # Let the appropriate resource provider for the realm handle the
-        # request
-        app = RequestServer(provider)
-        app_iter = app(environ, start_response)
-        for v in app_iter:
-            yield v
-        if hasattr(app_iter, "close"):
-            app_iter.close()
-        return
+        # request (we return its iterator, instead of re-yielding every chunk)
+        app = self._servers.get(provider)
+        if app is None:
+            app = self._servers[provider] = RequestServer(provider)
+        return app(environ, start_response)
@@ -11,6 +11,7 @@ from wsgidav.dav_error import (
     HTTP_BAD_REQUEST,
     HTTP_CONFLICT,
     HTTP_CREATED,
+    HTTP_EXPECTATION_FAILED,
     HTTP_FAILED_DEPENDENCY,
     HTTP_FORBIDDEN,
     HTTP_INTERNAL_ERROR,
@@ -43,12 +44,22 @@ DEFAULT_BLOCK_SIZE = 8192
 # RequestServer
 # ========================================================================
 class RequestServer(object):
+    """Handle the requests for one DAV provider.
+
+    One instance is created per provider and re-used by all requests (see
+    :class:`~wsgidav.request_resolver.RequestResolver`), so it must not store
+    request state. The allowed methods are evaluated once, so lock and
+    property managers must be assigned to the provider before.
+    """
 
     def __init__(self, davProvider):
         self._davProvider = davProvider
         self.allowPropfindInfinite = True
         self._verbose = 2
         self.block_size = DEFAULT_BLOCK_SIZE
+        self._customHeaders = []
+        self._addMSAuthorVia = False
+        self._configured = False
         _logger.debug("RequestServer: __init__", module="sc")
 
         self._possible_methods = ["OPTIONS", "HEAD", "GET", "PROPFIND"]
@@ -69,11 +80,28 @@ class RequestServer(object):
             if self._davProvider.lockManager is not None:
                 self._possible_methods.extend(["LOCK", "UNLOCK"])
 
+        # Dispatch HTTP request methods to 'doMETHOD()' handlers
+        self._handlers = {}
+        for requestmethod in self._possible_methods:
+            handler = getattr(self, "do{}".format(requestmethod), None)
+            if handler:
+                self._handlers[requestmethod] = handler
+
+    def _setConfig(self, config):
+        """Evaluate the static options (once, on the first request)."""
+        self.block_size = config.get("block_size", DEFAULT_BLOCK_SIZE)
+        self._customHeaders = list(config.get("response_headers") or ())
+        self._addMSAuthorVia = config.get("add_header_MS_Author_Via", False)
+        self._configured = True
+
     def __del__(self):
         _logger.debug("RequestServer: __del__", module="sc")
 
     def __call__(self, environ, start_response):
         assert "wsgidav.verbose" in environ
+        method = self._handlers.get(environ["REQUEST_METHOD"])
+        if not self._configured:
+            self._setConfig(environ["wsgidav.config"])
         provider = self._davProvider
         # TODO: allow anonymous somehow: this should run, even if http_authenticator middleware
         # is not installed
@@ -83,10 +111,6 @@ class RequestServer(object):
                 "*** missing 'http_authenticator.username' in environ")
 
         environ["wsgidav.username"] = environ.get("http_authenticator.username", "anonymous")
-        requestmethod = environ["REQUEST_METHOD"]
-
-        self.block_size = environ["wsgidav.config"].get(
-            "block_size", DEFAULT_BLOCK_SIZE)
 
         # Convert 'infinity' and 'T'/'F' to a common case
         if environ.get("HTTP_DEPTH") is not None:
@@ -94,41 +118,36 @@ class RequestServer(object):
         if environ.get("HTTP_OVERWRITE") is not None:
             environ["HTTP_OVERWRITE"] = environ["HTTP_OVERWRITE"].upper()
 
-        if "HTTP_EXPECT" in environ:
-            pass
+        # The server sends '100 Continue' when the body is read, i.e. after
+        # the authentication, lock, and permission checks passed
+        expect = environ.get("HTTP_EXPECT")
+        if expect is not None and expect.lower() != "100-continue":
+            self._fail(HTTP_EXPECTATION_FAILED, "Unsupported expectation: {!r}".format(expect))
 
-        # Dispatch HTTP request methods to 'doMETHOD()' handlers
-        method = None
-        if requestmethod in self._possible_methods:
-            method_name = "do{}".format(requestmethod)
-            method = getattr(self, method_name, None)
         if not method:
-            _logger.error("Invalid HTTP method {!r}".format(requestmethod))
+            _logger.error("Invalid HTTP method {!r}".format(environ["REQUEST_METHOD"]))
             self._fail(HTTP_METHOD_NOT_ALLOWED)
 
         if environ.get("wsgidav.debug_break"):
             pass  # Set a break point here
 
         if environ.get("wsgidav.debug_profile"):
-            from cProfile import Profile
-            profile = Profile()
-            res = profile.runcall(provider.customRequestHandler, environ, start_response, method)
-            # sort: 0:"calls",1:"time", 2: "cumulative"
-            profile.print_stats(sort=2)
-            for v in res:
-                yield v
-            if hasattr(res, "close"):
-                res.close()
-            return
+            return self._profileRequest(environ, start_response, method)
 
         # Run requesthandler (provider may override, #55)
-        app_iter = provider.customRequestHandler(environ, start_response, method)
-
-        for v in app_iter:
+        return provider.customRequestHandler(environ, start_response, method)
+
+    def _profileRequest(self, environ, start_response, method):
+        from cProfile import Profile
+        profile = Profile()
+        res = profile.runcall(self._davProvider.customRequestHandler,
+                              environ, start_response, method)
+        # sort: 0:"calls",1:"time", 2: "cumulative"
+        profile.print_stats(sort=2)
+        for v in res:
             yield v
-        if hasattr(app_iter, "close"):
-            app_iter.close()
-        return
+        if hasattr(res, "close"):
+            res.close()
 
     def _fail(self, value, contextinfo=None, srcexception=None, errcondition=None):
         """Wrapper to raise (and log) DAVError."""
@@ -165,6 +184,11 @@ class RequestServer(object):
 
         return util.sendMultiStatusResponse(environ, start_response, multistatusEL)
 
+    def _getResourceInst(self, path, environ):
+        """Return the provider's resource for `path` (timed as 'resource' phase)."""
+        with util.timePhase(environ, "resource"):
+            return self._davProvider.getResourceInst(path, environ)
+
     def _checkWritePermission(self, res, depth, environ):
         """Raise DAVError(HTTP_LOCKED), if res is locked.
 
@@ -180,9 +204,10 @@ class RequestServer(object):
             util.parseIfHeaderDict(environ)
 
         # raise HTTP_LOCKED if conflict exists
-        lockMan.checkWritePermission(refUrl, depth,
-                                     environ["wsgidav.ifLockTokenList"],
-                                     environ["wsgidav.username"])
+        with util.timePhase(environ, "locks"):
+            lockMan.checkWritePermission(refUrl, depth,
+                                         environ["wsgidav.ifLockTokenList"],
+                                         environ["wsgidav.username"])
 
     def _evaluateIfHeaders(self, res, environ):
         """Apply HTTP headers on <path>, raising DAVError if conditions fail.
@@ -252,7 +277,7 @@ class RequestServer(object):
         @see http://www.webdav.org/specs/rfc4918.html#METHOD_PROPFIND
         """
         path = environ["PATH_INFO"]
-        res = self._davProvider.getResourceInst(path, environ)
+        res = self._getResourceInst(path, environ)
 
         # RFC: By default, the PROPFIND method without a Depth header MUST act
         # as if a "Depth: infinity" header was included.
@@ -314,24 +339,40 @@ class RequestServer(object):
 
         # --- Build list of resource URIs
 
-        reslist = res.getDescendants(depth=environ["HTTP_DEPTH"], addSelf=True)
+        with util.timePhase(environ, "resource"):
+            reslist = res.getDescendants(depth=environ["HTTP_DEPTH"], addSelf=True)
+        environ["wsgidav.result_count"] = len(reslist)
 #        if environ["wsgidav.verbose"] >= 3:
 #            pprint(reslist, indent=4)
 
+        # Fetch the dead properties of all resources with one call, if the
+        # property manager supports it (used by _DAVResource.getPropertyNames()
+        # and getPropertyValue())
         multistatusEL = xml_tools.makeMultistatusEL()
         responsedescription = []
 
-        for child in reslist:
-
-            if propFindMode == "allprop":
-                propList = child.getProperties("allprop")
-            elif propFindMode == "propname":
-                propList = child.getProperties("propname")
-            else:
-                propList = child.getProperties("named", nameList=propNameList)
+        pm = self._davProvider.propManager
+        try:
+            with util.timePhase(environ, "props"):
+                if (pm and hasattr(pm, "getPropertyDicts")
+                        and (propFindMode != "named"
+                             or any(not name.startswith("{DAV:}") for name in propNameList))):
+                    environ["wsgidav.prop_prefetch"] = pm.getPropertyDicts(
+                        [child.getRefUrl() for child in reslist], environ)
+
+                for child in reslist:
+
+                    if propFindMode == "allprop":
+                        propList = child.getProperties("allprop")
+                    elif propFindMode == "propname":
+                        propList = child.getProperties("propname")
+                    else:
+                        propList = child.getProperties("named", nameList=propNameList)
 
-            href = child.getHref()
-            util.addPropertyResponse(multistatusEL, href, propList)
+                    href = child.getHref()
+                    util.addPropertyResponse(multistatusEL, href, propList)
+        finally:
+            environ.pop("wsgidav.prop_prefetch", None)
 
         if responsedescription:
             etree.SubElement(multistatusEL, "{DAV:}responsedescription").text = "\n".join(
@@ -345,7 +386,7 @@ class RequestServer(object):
         @see http://www.webdav.org/specs/rfc4918.html#METHOD_PROPPATCH
         """
         path = environ["PATH_INFO"]
-        res = self._davProvider.getResourceInst(path, environ)
+        res = self._getResourceInst(path, environ)
 
         # Only accept Depth: 0 (but assume this, if omitted)
         environ.setdefault("HTTP_DEPTH", "0")
@@ -428,16 +469,45 @@ class RequestServer(object):
             # Dry-run succeeded: set properties again, this time in 'real' mode
             # In theory, there should be no exceptions thrown here, but this is
             # real live...
-            for (propname, propvalue) in propupdatelist:
-                try:
-                    res.setPropertyValue(propname, propvalue, dryRun=False)
-                    # Set value to None, so the response xml contains empty
-                    # tags
-                    propResponseList.append((propname, None))
-                except Exception as e:
-                    e = asDAVError(e)
-                    propResponseList.append((propname, e))
-                    responsedescription.append(e.getUserInfo())
+            # Dead properties are staged in a transaction (if the property
+            # manager supports it) and written in one atomic step.
+            tx = None
+            pm = self._davProvider.propManager
+            if pm and hasattr(pm, "beginTransaction"):
+                tx = pm.beginTransaction(environ)
+                environ["wsgidav.prop_transaction"] = tx
+            try:
+                for (propname, propvalue) in propupdatelist:
+                    try:
+                        res.setPropertyValue(propname, propvalue, dryRun=False)
+                        # Set value to None, so the response xml contains empty
+                        # tags
+                        propResponseList.append((propname, None))
+                    except Exception as e:
+                        e = asDAVError(e)
+                        propResponseList.append((propname, e))
+                        responsedescription.append(e.getUserInfo())
+            finally:
+                environ.pop("wsgidav.prop_transaction", None)
+
+            if tx is not None:
+                txError = None
+                if responsedescription:
+                    tx.rollback()
+                    txError = DAVError(HTTP_FAILED_DEPENDENCY)
+                else:
+                    try:
+                        tx.commit()
+                    except Exception as e:
+                        txError = asDAVError(e)
+                        responsedescription.append(txError.getUserInfo())
+                if txError:
+                    # Staged properties were not written
+                    stagedNames = tx.getStagedNames()
+                    propResponseList = [
+                        (propname, txError if result is None and propname in stagedNames
+                         else result)
+                        for (propname, result) in propResponseList]
 
         # Generate response XML
         multistatusEL = xml_tools.makeMultistatusEL()
@@ -458,7 +528,7 @@ class RequestServer(object):
         """
         path = environ["PATH_INFO"]
         provider = self._davProvider
-#        res = provider.getResourceInst(path, environ)
+#        res = self._getResourceInst(path, environ)
 
         # Do not understand ANY request body entities
         if util.getContentLength(environ) != 0:
@@ -472,7 +542,7 @@ class RequestServer(object):
         if provider.exists(path, environ):
             self._fail(HTTP_METHOD_NOT_ALLOWED, "MKCOL can only be executed on an unmapped URL.")
 
-        parentRes = provider.getResourceInst(util.getUriParent(path), environ)
+        parentRes = self._getResourceInst(util.getUriParent(path), environ)
         if not parentRes or not parentRes.isCollection:
             self._fail(HTTP_CONFLICT, "Parent must be an existing collection.")
 
@@ -498,7 +568,7 @@ class RequestServer(object):
         """
         path = environ["PATH_INFO"]
         provider = self._davProvider
-        res = provider.getResourceInst(path, environ)
+        res = self._getResourceInst(path, environ)
 
         # --- Check request preconditions -------------------------------------
 
@@ -524,7 +594,7 @@ class RequestServer(object):
         self._evaluateIfHeaders(res, environ)
         # We need write access on the parent collection. Also we check for
         # locked children
-        parentRes = provider.getResourceInst(util.getUriParent(path), environ)
+        parentRes = self._getResourceInst(util.getUriParent(path), environ)
         if parentRes:
             #            self._checkWritePermission(parentRes, environ["HTTP_DEPTH"], environ)
             self._checkWritePermission(parentRes, "0", environ)
@@ -693,9 +763,8 @@ class RequestServer(object):
         @see: http://www.webdav.org/specs/rfc4918.html#METHOD_PUT
         """
         path = environ["PATH_INFO"]
-        provider = self._davProvider
-        res = provider.getResourceInst(path, environ)
-        parentRes = provider.getResourceInst(util.getUriParent(path), environ)
+        res = self._getResourceInst(path, environ)
+        parentRes = self._getResourceInst(util.getUriParent(path), environ)
 
         isnewfile = res is None
 
@@ -710,20 +779,7 @@ class RequestServer(object):
         if "HTTP_CONTENT_RANGE" in environ:
             util.fail(HTTP_BAD_REQUEST, "Content-range header is not allowed on PUT requests.")
 
-        if res and res.isCollection:
-            self._fail(HTTP_METHOD_NOT_ALLOWED, "Cannot PUT to a collection")
-        elif parentRes is None or not parentRes.isCollection:  # TODO: allow parentRes==None?
-            self._fail(HTTP_CONFLICT, "PUT parent must be a collection")
-
-        self._evaluateIfHeaders(res, environ)
-
-        if isnewfile:
-            self._checkWritePermission(parentRes, "0", environ)
-            res = parentRes.createEmptyResource(util.getUriName(path))
-        else:
-            self._checkWritePermission(res, "0", environ)
-
-        # Start Content Processing
+        # Validate the length before creating the resource or reading the body
         # Content-Length may be 0 or greater. (Set to -1 if missing or invalid.)
 #        WORKAROUND_BAD_LENGTH = True
         try:
@@ -747,6 +803,19 @@ class RequestServer(object):
                           "PUT request with invalid Content-Length: ({})"
                           .format(environ.get("CONTENT_LENGTH")))
 
+        if res and res.isCollection:
+            self._fail(HTTP_METHOD_NOT_ALLOWED, "Cannot PUT to a collection")
+        elif parentRes is None or not parentRes.isCollection:  # TODO: allow parentRes==None?
+            self._fail(HTTP_CONFLICT, "PUT parent must be a collection")
+
+        self._evaluateIfHeaders(res, environ)
+
+        if isnewfile:
+            self._checkWritePermission(parentRes, "0", environ)
+            res = parentRes.createEmptyResource(util.getUriName(path))
+        else:
+            self._checkWritePermission(res, "0", environ)
+
         hasErrors = False
         try:
             if environ.get("HTTP_TRANSFER_ENCODING", "").lower() == "chunked":
@@ -802,8 +871,8 @@ class RequestServer(object):
         """
         srcPath = environ["PATH_INFO"]
         provider = self._davProvider
-        srcRes = provider.getResourceInst(srcPath, environ)
-        srcParentRes = provider.getResourceInst(util.getUriParent(srcPath), environ)
+        srcRes = self._getResourceInst(srcPath, environ)
+        srcParentRes = self._getResourceInst(util.getUriParent(srcPath), environ)
 
         # --- Check source ----------------------------------------------------
 
@@ -875,10 +944,10 @@ class RequestServer(object):
 
         # destPath is now relative to current mount/share starting with '/'
 
-        destRes = provider.getResourceInst(destPath, environ)
+        destRes = self._getResourceInst(destPath, environ)
         destExists = destRes is not None
 
-        destParentRes = provider.getResourceInst(
+        destParentRes = self._getResourceInst(
             util.getUriParent(destPath), environ)
 
         if not destParentRes or not destParentRes.isCollection:
@@ -990,6 +1059,8 @@ class RequestServer(object):
                     errorList = srcRes.moveRecursive(destPath)
                 except Exception as e:
                     errorList = [(srcRes.getHref(), asDAVError(e))]
+                if self._davProvider.propValueCache is not None:
+                    self._davProvider.propValueCache.invalidate(srcRes.getRefUrl(), True)
                 return self._sendResponse(environ, start_response, srcRes, successCode, errorList)
 
         # --- Copy/move file-by-file using copy/delete ------------------------
@@ -1005,6 +1076,17 @@ class RequestServer(object):
         # Hidden paths (paths of failed copy/moves) {<src_path>: True, ...}
         ignoreDict = {}
 
+        # COPY of a collection tree: let the property manager copy all dead
+        # properties with one call after the loop (see copyMoveSingle())
+        propMan = self._davProvider.propManager
+        deferPropCopy = (not isMove and srcRes.isCollection
+                         and environ["HTTP_DEPTH"] == "infinity"
+                         and getattr(propMan, "supportsWithChildren", False))
+        # Successfully copied resources [ (<src resource>, <dest path>), ... ]
+        copiedList = []
+        if deferPropCopy:
+            environ["wsgidav.defer_prop_copy"] = True
+
         for sRes in srcList:
             # Skip this resource, if there was a failure copying a parent
             parentError = False
@@ -1026,6 +1108,8 @@ class RequestServer(object):
                 # Collections are simply created (without members), for
                 # non-collections bytes are copied (overwriting target)
                 sRes.copyMoveSingle(dPath, isMove)
+                if deferPropCopy:
+                    copiedList.append((sRes, dPath))
 
                 # If copy succeeded, and it was a non-collection delete it now.
                 # So the source tree shrinks while the destination grows and we
@@ -1043,6 +1127,14 @@ class RequestServer(object):
                 # http://www.webdav.org/specs/rfc4918.html#rfc.section.9.8.5
                 errorList.append((sRes.getHref(), asDAVError(e)))
 
+        if deferPropCopy:
+            del environ["wsgidav.defer_prop_copy"]
+            try:
+                self._copyTreeProperties(srcRes, destPath, copiedList, bool(ignoreDict),
+                                         environ)
+            except Exception as e:
+                errorList.append((srcRes.getHref(), asDAVError(e)))
+
         # MOVE: Remove source tree (bottom-up)
         if isMove:
             reverseSrcList = srcList[:]
@@ -1074,13 +1166,33 @@ class RequestServer(object):
 
         return self._sendResponse(environ, start_response, srcRes, successCode, errorList)
 
+    def _copyTreeProperties(self, srcRes, destPath, copiedList, hasErrors, environ):
+        """Copy the dead properties of a collection tree after a COPY request.
+
+        If all resources were copied, the destination tree properties are
+        replaced with two calls. Otherwise only the properties of the copied
+        resources in `copiedList` are copied, one by one.
+        """
+        provider = self._davProvider
+        propMan = provider.propManager
+        destRefUrl = self._getResourceInst(destPath, environ).getRefUrl()
+        if hasErrors:
+            for sRes, dPath in copiedList:
+                dRefUrl = self._getResourceInst(dPath, environ).getRefUrl()
+                propMan.copyProperties(sRes.getRefUrl(), dRefUrl, environ)
+        else:
+            propMan.removeProperties(destRefUrl, environ, withChildren=True)
+            propMan.copyProperties(srcRes.getRefUrl(), destRefUrl, environ, withChildren=True)
+        if provider.propValueCache is not None:
+            provider.propValueCache.invalidate(destRefUrl, True)
+
     def doLOCK(self, environ, start_response):
         """
         @see: http://www.webdav.org/specs/rfc4918.html#METHOD_LOCK
         """
         path = environ["PATH_INFO"]
         provider = self._davProvider
-        res = provider.getResourceInst(path, environ)
+        res = self._getResourceInst(path, environ)
         lockMan = provider.lockManager
 
         if lockMan is None:
@@ -1127,7 +1239,7 @@ class RequestServer(object):
 
             # The lock root may be <path>, or a parent of <path>.
             lockPath = provider.refUrlToPath(lock["root"])
-            lockRes = provider.getResourceInst(lockPath, environ)
+            lockRes = self._getResourceInst(lockPath, environ)
 
             propEL = xml_tools.makePropEL()
             # TODO: handle exceptions in getPropertyValue
@@ -1187,7 +1299,7 @@ class RequestServer(object):
         # Locking unmapped URLs: must create an empty resource
         createdNewResource = False
         if res is None:
-            parentRes = provider.getResourceInst(
+            parentRes = self._getResourceInst(
                 util.getUriParent(path), environ)
             if not parentRes or not parentRes.isCollection:
                 self._fail(HTTP_CONFLICT, "LOCK-0 parent must be a collection")
@@ -1264,7 +1376,7 @@ class RequestServer(object):
         """
         path = environ["PATH_INFO"]
         provider = self._davProvider
-        res = self._davProvider.getResourceInst(path, environ)
+        res = self._getResourceInst(path, environ)
 
         lockMan = provider.lockManager
         if lockMan is None:
@@ -1303,7 +1415,7 @@ class RequestServer(object):
         """
         path = environ["PATH_INFO"]
         provider = self._davProvider
-        res = provider.getResourceInst(path, environ)
+        res = self._getResourceInst(path, environ)
 
         dav_compliance_level = "1,2"
         if provider is None or provider.isReadOnly() or provider.lockManager is None:
@@ -1368,7 +1480,7 @@ class RequestServer(object):
 
         headers.append(("Allow", " ".join(allow)))
 
-        if environ["wsgidav.config"].get("add_header_MS_Author_Via", False):
+        if self._addMSAuthorVia:
             headers.append(("MS-Author-Via", "DAV"))
 
         start_response("200 OK", headers)
@@ -1390,7 +1502,7 @@ class RequestServer(object):
         @see: http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.27
         """
         path = environ["PATH_INFO"]
-        res = self._davProvider.getResourceInst(path, environ)
+        res = self._getResourceInst(path, environ)
 
         if util.getContentLength(environ) != 0:
             self._fail(HTTP_MEDIATYPE_NOT_SUPPORTED,
@@ -1467,10 +1579,7 @@ class RequestServer(object):
         if res.supportEtag():
             responseHeaders.append(("ETag", '"{}"'.format(entitytag)))
 
-        if "response_headers" in environ["wsgidav.config"]:
-            customHeaders = environ["wsgidav.config"]["response_headers"]
-            for header, value in customHeaders:
-                responseHeaders.append((header, value))
+        responseHeaders.extend(self._customHeaders)
 
         res.finalizeHeaders(environ, responseHeaders)
 
@@ -0,0 +1,537 @@
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+"""
+HTTP/1.1 server that multiplexes connections on an asyncio event loop
+(Python 3.4+).
+
+Connections are handled by coroutines, so thousands of idle keep-alive
+connections don't need a thread each. The WSGI application runs in a bounded
+pool of worker threads, but only while a request is active:
+
+    - The request headers are read on the event loop.
+    - The request is then passed to a worker thread, which calls the
+      application and iterates the response.
+    - ``wsgi.input`` reads and response writes are performed on the event loop
+      (the worker waits for them), so request and response bodies are
+      transferred with backpressure: data is only read from the socket when
+      the application asks for it, and a worker blocks while the client
+      doesn't accept more response data.
+
+Select it with ``wsgidav --server=asyncio``. These ``server_args`` are
+evaluated:
+
+*workers*
+    Number of worker threads, i.e. max. number of concurrently processed
+    requests (default: 10). Further requests wait on the event loop.
+*keepalive_timeout*
+    Close connections that are idle for this number of seconds (default: 60).
+*max_header_size*
+    Max. size of the request line and headers in bytes (default: 65536).
+*backlog*
+    Listen backlog of the server socket (default: 100).
+*shutdown_timeout*
+    On stop, wait this number of seconds for active requests (default: 5).
+*reuse_port*
+    Bind with ``SO_REUSEPORT``, so several processes can listen on the same
+    port (default: False, see :mod:`wsgidav.server.prefork`).
+
+Responses without ``Content-Length`` are sent with ``Connection: close``.
+Connections are also closed after requests with a chunked body (WsgiDAV
+decodes it from the raw ``wsgi.input`` stream), and after requests that left
+more than 64 kB of the body unread.
+
+Coroutines are generator based (``yield from``), so this module runs on
+Python 3.4 too. It is not installed on Python 2.
+"""
+import asyncio
+import concurrent.futures
+import socket
+import ssl
+import sys
+import traceback
+import types
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from wsgidav import __version__, util
+
+__docformat__ = "reStructuredText"
+
+_logger = util.getModuleLogger(__name__)
+
+#: Unread request body data up to this size is discarded, before the next
+#: request on the same connection is read (otherwise the connection is closed)
+DRAIN_LIMIT = 64 * 1024
+
+_NO_BODY_STATUS = ("1", "204", "304")
+
+#: Decorator for generator based coroutines (types.coroutine was added in
+#: Python 3.5, asyncio.coroutine is deprecated since 3.8 and removed in 3.11)
+_coroutine = getattr(types, "coroutine", None) or asyncio.coroutine
+
+#: asyncio.ensure_future was added in Python 3.4.4
+_ensureFuture = getattr(asyncio, "ensure_future", None) or getattr(asyncio, "async")
+
+
+class _BadRequest(Exception):
+    """The request head could not be parsed."""
+
+
+class _HeadTooLarge(Exception):
+    """The request head exceeds max_header_size."""
+
+
+def _runThreadsafe(coro, loop):
+    """Run a coroutine on `loop` and wait for the result (from another thread).
+
+    Like asyncio.run_coroutine_threadsafe() (Python 3.5.1+), but also accepts
+    generator based coroutines on Python 3.12+.
+    """
+    future = concurrent.futures.Future()
+
+    def _done(task):
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def _start():
+        try:
+            _ensureFuture(coro, loop=loop).add_done_callback(_done)
+        except Exception as e:
+            future.set_exception(e)
+
+    loop.call_soon_threadsafe(_start)
+    return future.result()
+
+
+# ========================================================================
+# _InputStream
+# ========================================================================
+class _InputStream(object):
+    """File-like ``wsgi.input``, reading from the connection on demand.
+
+    Must be used from the worker thread, while the event loop is running.
+    """
+
+    def __init__(self, request, length):
+        self._request = request
+        self._reader = request.reader
+        # Number of unread bytes, or None for a chunked body (read raw until
+        # the connection is closed)
+        self.remaining = length
+
+    def _read(self, coro):
+        return self._request.server.runCoroutine(coro)
+
+    @_coroutine
+    def _readExactly(self, size):
+        try:
+            return (yield from self._reader.readexactly(size))
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    @_coroutine
+    def _readLine(self, size):
+        # Bounded bodies are read byte by byte, so we never read past the end
+        res = []
+        while size > 0:
+            c = yield from self._reader.read(1)
+            if not c:
+                break
+            res.append(c)
+            size -= 1
+            if c == b"\n":
+                break
+        return b"".join(res)
+
+    def read(self, size=-1):
+        if self.remaining == 0:
+            return b""
+        self._request.sendContinue()
+        if self.remaining is None:
+            return self._read(self._reader.read(-1 if size is None else size))
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._read(self._readExactly(size))
+        self.remaining -= len(data)
+        if len(data) < size:
+            self.remaining = 0  # Connection closed by client
+        return data
+
+    def readline(self, size=-1):
+        if self.remaining == 0:
+            return b""
+        self._request.sendContinue()
+        if self.remaining is None:
+            return self._read(self._reader.readline())
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._read(self._readLine(size))
+        self.remaining -= len(data)
+        if not data:
+            self.remaining = 0
+        return data
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+# ========================================================================
+# _Request
+# ========================================================================
+class _Request(object):
+    """A single request, that is processed by a worker thread."""
+
+    def __init__(self, server, reader, writer, environ, keepAlive):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.environ = environ
+        self.keepAlive = keepAlive
+        self.status = None
+        self.responseHeaders = None
+        self.headersSent = False
+        self.continueSent = False
+        self.expectContinue = environ.get("HTTP_EXPECT", "").lower() == "100-continue"
+
+        if "chunked" in environ.get("HTTP_TRANSFER_ENCODING", "").lower():
+            length = None
+        else:
+            try:
+                length = max(0, int(environ.get("CONTENT_LENGTH") or 0))
+            except ValueError:
+                raise _BadRequest("Invalid Content-Length")
+        self.input = environ["wsgi.input"] = _InputStream(self, length)
+
+    @_coroutine
+    def _send(self, data):
+        self.writer.write(data)
+        yield from self.writer.drain()
+
+    def send(self, data):
+        self.server.runCoroutine(self._send(data))
+
+    def sendContinue(self):
+        if self.expectContinue and not self.continueSent and not self.headersSent:
+            self.continueSent = True
+            self.send(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+    def startResponse(self, status, response_headers, exc_info=None):
+        if exc_info:
+            try:
+                if self.headersSent:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("start_response() was already called")
+        self.status = status
+        self.responseHeaders = response_headers
+        return self.write
+
+    def _formatHead(self):
+        environ = self.environ
+        headerNames = set(name.lower() for name, _value in self.responseHeaders)
+        hasBody = (environ["REQUEST_METHOD"] != "HEAD"
+                   and not self.status.startswith(_NO_BODY_STATUS))
+        if hasBody and "content-length" not in headerNames:
+            self.keepAlive = False
+        for name, value in self.responseHeaders:
+            if name.lower() == "connection" and value.lower() == "close":
+                self.keepAlive = False
+
+        lines = ["HTTP/1.1 {}".format(self.status)]
+        lines.extend("{}: {}".format(name, value) for name, value in self.responseHeaders)
+        if "date" not in headerNames:
+            lines.append("Date: {}".format(util.getRfc1123Time()))
+        if "server" not in headerNames:
+            lines.append("Server: {}".format(self.server.serverName))
+        if "connection" not in headerNames:
+            if not self.keepAlive:
+                lines.append("Connection: close")
+            elif environ["SERVER_PROTOCOL"] == "HTTP/1.0":
+                lines.append("Connection: keep-alive")
+        lines.append("\r\n")
+        return "\r\n".join(lines).encode("latin-1")
+
+    def write(self, data):
+        if self.status is None:
+            raise AssertionError("write() before start_response()")
+        if not self.headersSent:
+            # Send headers together with the first chunk
+            data = self._formatHead() + data
+            self.headersSent = True
+        if data:
+            self.send(data)
+
+    def run(self):
+        """Call the application and send the response (in a worker thread).
+
+        Return True, if the connection can be used for the next request.
+        """
+        try:
+            result = self.server.app(self.environ, self.startResponse)
+            try:
+                for data in result:
+                    if data:
+                        self.write(data)
+                if not self.headersSent:
+                    self.write(b"")
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        except (ConnectionError, asyncio.CancelledError, concurrent.futures.CancelledError):
+            return False
+        except Exception:
+            _logger.error("Error processing {} {}:\n{}".format(
+                self.environ.get("REQUEST_METHOD"), self.environ.get("PATH_INFO"),
+                traceback.format_exc()))
+            if not self.headersSent:
+                self.status = "500 Internal Server Error"
+                self.responseHeaders = [("Content-Type", "text/plain"),
+                                        ("Content-Length", "0")]
+                self.keepAlive = False
+                try:
+                    self.write(b"")
+                except Exception:
+                    pass
+            return False
+
+        # Make sure the next request starts at the right position
+        if self.input.remaining is None:
+            return False
+        if self.keepAlive and self.input.remaining:
+            if self.input.remaining > DRAIN_LIMIT or self.expectContinue:
+                return False
+            self.input.read()
+        return self.keepAlive
+
+
+# ========================================================================
+# AsyncioServer
+# ========================================================================
+class AsyncioServer(object):
+    """HTTP server, that runs a WSGI application in a bounded thread pool.
+
+    Example::
+
+        server = AsyncioServer(app, "localhost", 8080, workers=20)
+        server.serve()  # blocking; call server.stop() from another thread
+    """
+
+    def __init__(self, app, host, port, workers=10, keepalive_timeout=60,
+                 max_header_size=65536, backlog=100, ssl_context=None,
+                 shutdown_timeout=5, reuse_port=False, multiprocess=False):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.keepaliveTimeout = keepalive_timeout
+        self.maxHeaderSize = max_header_size
+        self.backlog = backlog
+        self.sslContext = ssl_context
+        self.shutdownTimeout = shutdown_timeout
+        self.reusePort = reuse_port
+        # True, if other processes serve the same application (prefork workers)
+        self.multiprocess = multiprocess
+        self.serverName = "WsgiDAV/{} asyncio Python/{}".format(
+            __version__, util.PYTHON_VERSION)
+        self.urlScheme = "https" if ssl_context else "http"
+        self._loop = None
+        self._server = None
+        self._executor = None
+        self._activeRequests = 0
+        self._stopRequested = False
+
+    def __repr__(self):
+        return "AsyncioServer({}:{}, workers={})".format(self.host, self.port, self.workers)
+
+    def runCoroutine(self, coro):
+        """Run a coroutine on the event loop and wait for the result (from a worker)."""
+        return _runThreadsafe(coro, self._loop)
+
+    def serve(self, startup_event=None):
+        """Run the server until stop() is called."""
+        self._loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        kwargs = {"limit": self.maxHeaderSize, "backlog": self.backlog, "ssl": self.sslContext}
+        if self.reusePort:
+            kwargs["reuse_port"] = True  # Python 3.4.4+
+        self._server = loop.run_until_complete(asyncio.start_server(
+            self._acceptConnection, self.host, self.port, **kwargs))
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+        _logger.info("Serving on {}://{}:{} ({} workers)...".format(
+            self.urlScheme, self.host, self.port, self.workers))
+        if startup_event:
+            startup_event.set()
+        try:
+            if not self._stopRequested:
+                loop.run_forever()
+        finally:
+            self._server.close()
+            # Let active requests complete, then close open connections
+            loop.run_until_complete(self._waitIdle(self.shutdownTimeout))
+            allTasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+            tasks = allTasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(self._server.wait_closed())
+            self._executor.shutdown(wait=False)
+            loop.close()
+
+    def stop(self):
+        """Stop serve() (may be called from any thread or a signal handler)."""
+        self._stopRequested = True
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    @_coroutine
+    def _waitIdle(self, timeout):
+        end = self._loop.time() + timeout
+        while self._activeRequests and self._loop.time() < end:
+            yield from asyncio.sleep(0.05)
+        if self._activeRequests:
+            _logger.warn("Shutdown: aborting {} active requests".format(self._activeRequests))
+
+    def _acceptConnection(self, reader, writer):
+        # Python 3.12+ only starts native coroutines returned by the callback
+        _ensureFuture(self._handleConnection(reader, writer), loop=self._loop)
+
+    @_coroutine
+    def _readHead(self, reader):
+        """Return the request line and headers (None, if the connection was closed)."""
+        lines = []
+        size = 0
+        while True:
+            try:
+                line = yield from reader.readline()
+            except ValueError:
+                raise _HeadTooLarge  # Line exceeds the StreamReader limit
+            if not line.endswith(b"\n"):
+                return None
+            size += len(line)
+            if size > self.maxHeaderSize:
+                raise _HeadTooLarge
+            if line in (b"\r\n", b"\n"):
+                if lines:
+                    return b"".join(lines) + b"\r\n"
+                continue  # Ignore empty lines before the request line
+            lines.append(line)
+
+    @_coroutine
+    def _handleConnection(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                try:
+                    head = yield from asyncio.wait_for(self._readHead(reader),
+                                                       self.keepaliveTimeout)
+                except (asyncio.TimeoutError, ConnectionError):
+                    break  # Idle or closed by client
+                except _HeadTooLarge:
+                    writer.write(b"HTTP/1.1 431 Request Header Fields Too Large\r\n"
+                                 b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                if head is None:
+                    break  # Closed by client
+                try:
+                    environ, keepAlive = self._makeEnviron(head, writer)
+                    request = _Request(self, reader, writer, environ, keepAlive)
+                except _BadRequest as e:
+                    _logger.warn("Bad request: {}".format(e))
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\n"
+                                 b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                self._activeRequests += 1
+                try:
+                    keepAlive = yield from self._loop.run_in_executor(self._executor, request.run)
+                finally:
+                    self._activeRequests -= 1
+                if not keepAlive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            try:
+                yield from writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    def _makeEnviron(self, head, writer):
+        """Return (environ, keepAlive) for a request head."""
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, protocol = lines[0].split(" ")
+        except ValueError:
+            raise _BadRequest("Invalid request line {!r}".format(lines[0]))
+        if protocol not in ("HTTP/1.0", "HTTP/1.1"):
+            raise _BadRequest("Unsupported protocol {!r}".format(protocol))
+
+        path, _, query = target.partition("?")
+        if "://" in path:
+            # Absolute URI, e.g. 'http://host/path'
+            path = "/" + path.split("://", 1)[1].partition("/")[2]
+        sockname = writer.get_extra_info("sockname") or (self.host, self.port)
+        peername = writer.get_extra_info("peername") or ("", 0)
+        environ = {"REQUEST_METHOD": method,
+                   "SCRIPT_NAME": "",
+                   "PATH_INFO": unquote(path, "latin-1"),
+                   "QUERY_STRING": query,
+                   "SERVER_NAME": str(sockname[0]),
+                   "SERVER_PORT": str(sockname[1]),
+                   "SERVER_PROTOCOL": protocol,
+                   "SERVER_SOFTWARE": self.serverName,
+                   "REMOTE_ADDR": str(peername[0]),
+                   "REMOTE_PORT": str(peername[1]),
+                   "wsgi.version": (1, 0),
+                   "wsgi.url_scheme": self.urlScheme,
+                   "wsgi.errors": sys.stderr,
+                   "wsgi.multithread": True,
+                   "wsgi.multiprocess": self.multiprocess,
+                   "wsgi.run_once": False,
+                   }
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise _BadRequest("Invalid header line {!r}".format(line))
+            key = name.strip().upper().replace("-", "_")
+            if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                key = "HTTP_" + key
+            value = value.strip()
+            if key in environ:
+                value = environ[key] + "," + value
+            environ[key] = value
+
+        connection = environ.get("HTTP_CONNECTION", "").lower()
+        if protocol == "HTTP/1.1":
+            keepAlive = "close" not in connection
+        else:
+            keepAlive = "keep-alive" in connection
+        return environ, keepAlive
+
+
+def makeSSLContext(certificate, privateKey, certificateChain=None):
+    """Return a server side SSLContext."""
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    if certificateChain:
+        context.load_verify_locations(certificateChain)
+    context.load_cert_chain(certificate, privateKey)
+    return context
@@ -51,6 +51,17 @@ Note: if you are using the paster development server (from Paste <http://pythonp
 can copy ``ext_wsgi_server.py`` to ``<Paste-installation>/paste/servers`` and use this server to
 run the application by specifying ``server='ext_wsgiutils'`` in the ``server.conf`` or appropriate
 paste configuration.
+
+
+Threading
+---------
+
+Connections are handled by a fixed pool of worker threads (``numthreads``,
+default: 10). Accepted connections wait in a queue for a free worker; if more
+than ``max_queued`` (default: 100) connections are waiting, new connections are
+refused with '503 Service Unavailable'. Idle keep-alive connections are closed
+after ``keepalive_timeout`` seconds (default: 30), so they don't block a worker.
+These options are read from ``server_args``.
 """
 import logging
 import socket
@@ -74,16 +85,14 @@ try:
 except ImportError:
     import BaseHTTPServer
 
-try:
-    import socketserver  # py3
-except ImportError:
-    import SocketServer as socketserver
-
 
 _logger = util.getModuleLogger(__name__)
 
 _version = 1.0
 
+SERVICE_UNAVAILABLE = (b"HTTP/1.1 503 Service Unavailable\r\n"
+                       b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+
 SERVER_ERROR = """\
 <html>
   <head>
@@ -98,6 +107,41 @@ SERVER_ERROR = """\
 """
 
 
+class _ContinueInput(object):
+    """Wrap rfile, to send '100 Continue' when the application starts reading.
+
+    So a request can be rejected (e.g. '401 Unauthorized') before the client
+    sends the body.
+    """
+
+    def __init__(self, handler):
+        self._handler = handler
+        self._rfile = handler.rfile
+
+    def _sendContinue(self):
+        handler = self._handler
+        if handler.wsgiContinuePending:
+            handler.wsgiContinuePending = False
+            if not handler.wsgiSentHeaders:
+                handler.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+    def read(self, *args):
+        self._sendContinue()
+        return self._rfile.read(*args)
+
+    def readline(self, *args):
+        self._sendContinue()
+        return self._rfile.readline(*args)
+
+    def readlines(self, *args):
+        self._sendContinue()
+        return self._rfile.readlines(*args)
+
+    def __iter__(self):
+        self._sendContinue()
+        return iter(self._rfile)
+
+
 class ExtHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     _SUPPORTED_METHODS = ["HEAD", "GET", "PUT", "POST", "OPTIONS", "TRACE",
@@ -121,6 +165,21 @@ class ExtHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         pass
 #        BaseHTTPServer.BaseHTTPRequestHandler.log_request(self, *args)
 
+    def parse_request(self):
+        self.wsgiContinuePending = False
+        return BaseHTTPServer.BaseHTTPRequestHandler.parse_request(self)
+
+    def handle_expect_100(self):
+        # Python 3 would send '100 Continue' right away: defer it until the
+        # application reads the body
+        self.wsgiContinuePending = True
+        return True
+
+    def setup(self):
+        # Release the worker, if the client doesn't send the next request in time
+        self.timeout = self.server.keepaliveTimeout
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
     def getApp(self):
         # We want fragments to be returned as part of <path>
         _protocol, _host, path, _parameters, query, _fragment = compat.urlparse(
@@ -169,9 +228,13 @@ class ExtHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         if self.command == "PUT":
             pass  # breakpoint
 
+        wsgiInput = self.rfile
+        if self.wsgiContinuePending:
+            wsgiInput = _ContinueInput(self)
+
         env = {"wsgi.version": (1, 0),
                "wsgi.url_scheme": "http",
-               "wsgi.input": self.rfile,
+               "wsgi.input": wsgiInput,
                "wsgi.errors": sys.stderr,
                "wsgi.multithread": 1,
                "wsgi.multiprocess": 0,
@@ -197,16 +260,12 @@ class ExtHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         try:
             # We have there environment, now invoke the application
-            _logger.debug("runWSGIApp application()...")
             result = application(env, self.wsgiStartResponse)
             try:
                 for data in result:
                     if data:
                         self.wsgiWriteData(data)
-                    else:
-                        _logger.debug("runWSGIApp empty data")
             finally:
-                _logger.debug("runWSGIApp finally.")
                 if hasattr(result, "close"):
                     result.close()
         except Exception:
@@ -226,48 +285,82 @@ class ExtHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         return
 
     def wsgiStartResponse(self, response_status, response_headers, exc_info=None):
-        _logger.debug("wsgiStartResponse({}, {}, {})"
-                      .format(response_status, response_headers, exc_info))
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("wsgiStartResponse({}, {}, {})"
+                          .format(response_status, response_headers, exc_info))
         if (self.wsgiSentHeaders):
             raise Exception("Headers already sent and start_response called again!")
         # Should really take a copy to avoid changes in the application....
         self.wsgiHeaders = (response_status, response_headers)
         return self.wsgiWriteData
 
+    def _formatHead(self, status, headers):
+        """Return the status line and headers as one block of bytes."""
+        lines = ["{} {}".format(self.protocol_version, status),
+                 "Server: {}".format(self.version_string()),
+                 "Date: {}".format(self.date_time_string()),
+                 ]
+        for header, value in headers:
+            lines.append("{}: {}".format(header, value))
+            if header.lower() == "connection":
+                if value.lower() == "close":
+                    self.close_connection = 1
+                elif value.lower() == "keep-alive":
+                    self.close_connection = 0
+        lines.append("\r\n")
+        return compat.to_bytes("\r\n".join(lines), "iso-8859-1")
+
+    def _sendBuffers(self, buffers):
+        """Send a list of byte strings with as few system calls as possible."""
+        sock = self.connection
+        if not hasattr(sock, "sendmsg"):
+            # Python 2, Windows
+            sock.sendall(b"".join(buffers))
+            return
+        buffers = [memoryview(b) for b in buffers if b]
+        while buffers:
+            sent = sock.sendmsg(buffers)
+            while sent:
+                if sent >= len(buffers[0]):
+                    sent -= len(buffers.pop(0))
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+
     def wsgiWriteData(self, data):
-        if not self.wsgiSentHeaders:
-            status, headers = self.wsgiHeaders
-            # Need to send header prior to data
-            statusCode = status[:status.find(" ")]
-            statusMsg = status[status.find(" ") + 1:]
-            _logger.debug("wsgiWriteData: send headers '{!r}', {!r}".format(status, headers))
-            self.send_response(int(statusCode), statusMsg)
-            for header, value in headers:
-                self.send_header(header, value)
-            self.end_headers()
-            self.wsgiSentHeaders = 1
-        # Send the data
-        # assert type(data) is str # If not, Content-Length is propably wrong!
-        _logger.debug("wsgiWriteData: write {} bytes: '{!r}'..."
-                      .format(len(data), compat.to_native(data[:50])))
+        if not self.wsgiSentHeaders and self.wsgiContinuePending:
+            # The body was not requested, and will not be read: the client may
+            # still send it, so the connection cannot be re-used
+            self.wsgiContinuePending = False
+            self.close_connection = 1
         if compat.is_unicode(data):  # If not, Content-Length is propably wrong!
             _logger.info("ext_wsgiutils_server: Got unicode data: {!r}".format(data))
             # data = compat.wsgi_to_bytes(data)
             data = compat.to_bytes(data)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("wsgiWriteData: write {} bytes: '{!r}'..."
+                          .format(len(data), compat.to_native(data[:50])))
 
         try:
-            self.wfile.write(data)
+            if not self.wsgiSentHeaders:
+                # Send headers and the first chunk of data together
+                status, headers = self.wsgiHeaders
+                self.wsgiSentHeaders = 1
+                self._sendBuffers([self._formatHead(status, headers), data])
+            elif data:
+                self.wfile.write(data)
         except socket.error as e:
             # Suppress stack trace when client aborts connection disgracefully:
             # 10053: Software caused connection abort
             # 10054: Connection reset by peer
             if e.args[0] in (10053, 10054):
-                _logger.info("*** Caught socket.error: ", e, file=sys.stderr)
+                _logger.info("*** Caught socket.error: {}".format(e))
             else:
                 raise
 
 
-class ExtServer (socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+class ExtServer (BaseHTTPServer.HTTPServer):
+    """HTTP server that handles connections in a bounded pool of worker threads."""
 
     def handle_error(self, request, client_address):
         """Handle an error gracefully.  May be overridden.
@@ -343,7 +436,8 @@ class ExtServer (socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
 #        _logger.info "serve_forever_stoppable() stopped."
         self.stopped = True
 
-    def __init__(self, serverAddress, wsgiApplications, serveFiles=1):
+    def __init__(self, serverAddress, wsgiApplications, serveFiles=1,
+                 numThreads=10, maxQueued=100, keepaliveTimeout=30):
         BaseHTTPServer.HTTPServer.__init__(self, serverAddress, ExtHandler)
         appList = []
         for urlPath, wsgiApp in wsgiApplications.items():
@@ -351,12 +445,58 @@ class ExtServer (socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
         self.wsgiApplications = appList
         self.serveFiles = serveFiles
         self.serverShuttingDown = 0
+        self.keepaliveTimeout = keepaliveTimeout
+
+        self._requestQueue = compat.queue.Queue(maxQueued)
+        self._workers = []
+        for i in range(numThreads):
+            t = threading.Thread(target=self._processRequests,
+                                 name="ExtServer-{}".format(i))
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker thread (or refuse it, if the queue is full)."""
+        try:
+            self._requestQueue.put_nowait((request, client_address))
+        except compat.queue.Full:
+            _logger.warn("Request queue full: refusing connection from {}".format(client_address))
+            try:
+                request.sendall(SERVICE_UNAVAILABLE)
+            except socket.error:
+                pass
+            self.shutdown_request(request)
+
+    def _processRequests(self):
+        """Worker thread: handle queued connections until server_close()."""
+        while True:
+            item = self._requestQueue.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        for _t in self._workers:
+            self._requestQueue.put(None)
+        self._workers = []
 
 
 def serve(conf, app):
     host = conf.get("host", "localhost")
     port = int(conf.get("port", 8080))
-    server = ExtServer((host, port), {"": app})
+    server_args = conf.get("server_args", {})
+    server = ExtServer((host, port), {"": app},
+                       numThreads=server_args.get("numthreads", 10),
+                       maxQueued=server_args.get("max_queued", 100),
+                       keepaliveTimeout=server_args.get("keepalive_timeout", 30))
     server_version = ExtHandler.server_version
     if conf.get("verbose") >= 1:
         _logger.info("Running {}".format(server_version))
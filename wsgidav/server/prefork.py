@@ -0,0 +1,288 @@
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+"""
+Pre-forking multi-process server (POSIX, Python 3.5+).
+
+WsgiDAV processes requests in threads, so CPU bound work like XML building or
+authentication hashing is limited to one core per process by the GIL.
+:class:`PreforkServer` forks a number of worker processes that run one
+:class:`~wsgidav.server.asyncio_server.AsyncioServer` each. All workers bind
+the same port with ``SO_REUSEPORT``, so the kernel distributes the incoming
+connections among them.
+
+The supervisor (parent) process
+
+    - checks at startup, that the lock and property managers may be shared by
+      multiple processes,
+    - restarts workers that terminated unexpectedly (with an increasing delay,
+      if a worker crashes repeatedly right after start),
+    - on SIGTERM or SIGINT (Ctrl-C) asks all workers to finish their active
+      requests and exit, and kills workers that don't exit in time.
+
+Select it with ``wsgidav --server=prefork``. ``server_args`` are passed to the
+AsyncioServer of every worker. These ``prefork`` options are evaluated by the
+supervisor:
+
+*workers*
+    Number of worker processes (default: number of CPUs).
+*shutdown_timeout*
+    Seconds to wait for workers to exit, before they are killed (default: 10).
+*min_uptime*
+    Workers that exit within this number of seconds after start are restarted
+    with an exponentially increasing delay (default: 5).
+
+Every worker creates its own WsgiDAVApp, so state kept in memory is not shared:
+
+    - Locks and dead properties must be stored by managers that declare
+      ``multiProcessSafe = True`` (e.g. ``SQLitePropertyManager``), or be
+      disabled. In-memory and shelve based managers are refused.
+      None of the lock storages shipped with WsgiDAV is multi-process safe, so
+      locking must be disabled with ``locksmanager = False`` (the default
+      ``True`` is refused).
+    - Caches (e.g. authentication and property value caches) are per worker.
+    - If ``auth_secret`` is not configured, the supervisor generates one, so
+      digest nonces and session cookies are accepted by all workers.
+"""
+import binascii
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import time
+import traceback
+
+from wsgidav import util
+
+__docformat__ = "reStructuredText"
+
+_logger = util.getModuleLogger(__name__)
+
+#: Max. delay (seconds) before a crashing worker is restarted
+MAX_RESTART_DELAY = 60
+
+
+def checkMultiProcessSafe(config):
+    """Return a list of the lock and property managers that may not be shared.
+
+    Managers are considered safe, if they (or the lock manager's storage)
+    define ``multiProcessSafe = True``.
+    """
+    managers = [("locksmanager", config.get("locksmanager")),
+                ("propsmanager", config.get("propsmanager"))]
+    for share, opts in config.get("provider_mapping", {}).items():
+        if isinstance(opts, dict):
+            for key in ("locksmanager", "propsmanager"):
+                if key in opts:
+                    managers.append(("{} of share {!r}".format(key, share), opts[key]))
+
+    res = []
+    for name, manager in managers:
+        if not manager:
+            continue
+        elif manager is True:
+            res.append("{}: in-memory storage".format(name))
+            continue
+        # LockManager delegates to a storage
+        storage = getattr(manager, "storage", manager)
+        if not getattr(storage, "multiProcessSafe", False):
+            res.append("{}: {!r}".format(name, storage))
+    return res
+
+
+class _PipeEvent(object):
+    """Event-like object that signals readiness of a worker to the supervisor."""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def set(self):
+        try:
+            os.write(self._fd, b"1")
+            os.close(self._fd)
+        except OSError:
+            pass  # Supervisor is not waiting
+
+
+# ========================================================================
+# PreforkServer
+# ========================================================================
+class PreforkServer(object):
+    """Run WsgiDAV in multiple worker processes, that share one port.
+
+    `config` is the complete WsgiDAV configuration, which is used by the
+    workers to create their WsgiDAVApp.
+    """
+
+    def __init__(self, config, workers=None, shutdown_timeout=10, min_uptime=5):
+        self.config = config
+        self.host = config["host"]
+        self.port = config["port"]
+        self.workers = workers or multiprocessing.cpu_count()
+        self.shutdownTimeout = shutdown_timeout
+        self.minUptime = min_uptime
+        self._children = {}  # {pid: (slot, startTime)}
+        self._restartAt = {}  # {slot: time}
+        self._failures = {}  # {slot: number of crashes right after start}
+        self._stopping = False
+        self._socket = None
+
+    def __repr__(self):
+        return "PreforkServer({}:{}, workers={})".format(self.host, self.port, self.workers)
+
+    def _checkConfig(self):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("Prefork mode requires SO_REUSEPORT (Linux 3.9+, BSD).")
+        problems = checkMultiProcessSafe(self.config)
+        if problems:
+            raise RuntimeError(
+                "Prefork mode requires multi-process safe lock and property managers "
+                "(or disable them, e.g. 'locksmanager: False'):\n  {}"
+                .format("\n  ".join(problems)))
+        if not self.config.get("auth_secret"):
+            _logger.info("Using a random auth_secret for all workers.")
+            self.config["auth_secret"] = binascii.hexlify(os.urandom(32)).decode("ascii")
+
+    def _reservePort(self):
+        """Bind the port, so it stays ours, even if all workers are restarting."""
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self._socket = sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+
+    def serve(self, startup_event=None):
+        """Start the workers and supervise them until SIGTERM or SIGINT."""
+        self._checkConfig()
+        self._reservePort()
+        _logger.info("Starting {}...".format(self))
+
+        prevHandlers = {}
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            prevHandlers[signum] = signal.signal(signum, self._handleStop)
+        try:
+            readyFds = [self._spawn(slot) for slot in range(self.workers)]
+            self._waitReady(readyFds, 30)
+            if startup_event:
+                startup_event.set()
+            while not self._stopping:
+                self._reap()
+                self._restartWorkers()
+                time.sleep(0.2)
+        finally:
+            self._shutdown()
+            self._socket.close()
+            for signum, handler in prevHandlers.items():
+                signal.signal(signum, handler)
+        _logger.info("{} stopped.".format(self))
+
+    def _handleStop(self, signum, frame):
+        if not self._stopping:
+            _logger.info("Received signal {}, shutting down...".format(signum))
+        self._stopping = True
+
+    def _waitReady(self, fds, timeout):
+        end = time.time() + timeout
+        fds = [fd for fd in fds if fd is not None]
+        while fds and not self._stopping and time.time() < end:
+            readable, _, _ = select.select(fds, [], [], 0.2)
+            for fd in readable:
+                os.close(fd)
+                fds.remove(fd)
+        for fd in fds:
+            os.close(fd)
+        if fds and not self._stopping:
+            _logger.warn("{} workers did not start within {} seconds".format(len(fds), timeout))
+
+    def _spawn(self, slot):
+        """Fork a worker and return a file descriptor, that is readable when it listens."""
+        readFd, writeFd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readFd)
+            self._runWorker(slot, writeFd)  # Does not return
+        os.close(writeFd)
+        self._children[pid] = (slot, time.time())
+        _logger.info("Started worker #{} (pid {})".format(slot, pid))
+        return readFd
+
+    def _runWorker(self, slot, readyFd):
+        """Run the server in a worker process (called after fork)."""
+        exitCode = 1
+        try:
+            # Ctrl-C is sent to the whole process group: let the supervisor
+            # handle it and wait for SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self._socket.close()
+
+            from wsgidav.server.asyncio_server import AsyncioServer
+            from wsgidav.wsgidav_app import WsgiDAVApp
+
+            app = WsgiDAVApp(self.config)
+            server_args = {"reuse_port": True}
+            server_args.update(self.config.get("server_args", {}))
+            server_args["multiprocess"] = True
+            server = AsyncioServer(app, self.host, self.port, **server_args)
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+            server.serve(_PipeEvent(readyFd))
+            exitCode = 0
+        except Exception:
+            _logger.error("Worker #{} failed:\n{}".format(slot, traceback.format_exc()))
+        finally:
+            os._exit(exitCode)
+
+    def _reap(self):
+        """Collect terminated workers and schedule restarts."""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot, startTime = self._children.pop(pid, (None, 0))
+            if slot is None or self._stopping:
+                continue
+            if os.WIFSIGNALED(status):
+                reason = "was killed by signal {}".format(os.WTERMSIG(status))
+            else:
+                reason = "exited with code {}".format(os.WEXITSTATUS(status))
+            if time.time() - startTime < self.minUptime:
+                self._failures[slot] = self._failures.get(slot, 0) + 1
+                delay = min(2 ** (self._failures[slot] - 1), MAX_RESTART_DELAY)
+            else:
+                self._failures[slot] = 0
+                delay = 0
+            _logger.warn("Worker #{} (pid {}) {}; restarting in {} seconds"
+                         .format(slot, pid, reason, delay))
+            self._restartAt[slot] = time.time() + delay
+
+    def _restartWorkers(self):
+        now = time.time()
+        for slot, restartAt in list(self._restartAt.items()):
+            if restartAt <= now:
+                del self._restartAt[slot]
+                os.close(self._spawn(slot))
+
+    def _shutdown(self):
+        """Stop all workers: gracefully, then forcibly after `shutdown_timeout`."""
+        self._stopping = True
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        end = time.time() + self.shutdownTimeout
+        while self._children and time.time() < end:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self._children):
+            _logger.warn("Killing worker pid {}".format(pid))
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._children.clear()
@@ -130,10 +130,14 @@ See https://github.com/mar10/wsgidav for additional information.
                         # type=arg_is_dir,
                         help="path to a file system folder to publish as share '/'.")
     parser.add_argument("--server",
-                        choices=("cheroot", "cherrypy-wsgiserver", "ext-wsgiutils", "flup-fcgi",
-                                 "flup-fcgi-fork", "paste", "wsgiref"),
+                        choices=("asyncio", "cheroot", "cherrypy-wsgiserver", "ext-wsgiutils",
+                                 "flup-fcgi", "flup-fcgi-fork", "paste", "prefork", "wsgiref"),
                         default="cheroot",
-                        help="type of pre-installed WSGI server to use (default: %(default)s).")
+                        help="type of pre-installed WSGI server to use (default: %(default)s).\n"
+                             "'prefork' runs multiple processes and requires multi-process safe\n"
+                             "managers: no lock storage shipped with WsgiDAV is, so configure\n"
+                             "'locksmanager: False' (and e.g. SQLitePropertyManager as\n"
+                             "'propsmanager').")
     parser.add_argument("--ssl-adapter",
                         choices=("builtin", "pyopenssl"),
                         default="builtin",
@@ -573,7 +577,7 @@ def _runExtWsgiutils(app, config, mode):
     from wsgidav.server import ext_wsgiutils_server
     _logger.info("Running WsgiDAV {} on wsgidav.ext_wsgiutils_server...".format(__version__))
     _logger.warn(
-            "WARNING: This single threaded server (ext-wsgiutils) is not meant for production.")
+            "WARNING: This simple server (ext-wsgiutils) is not meant for heavy production use.")
     try:
         ext_wsgiutils_server.serve(config, app)
     except KeyboardInterrupt:
@@ -581,8 +585,56 @@ def _runExtWsgiutils(app, config, mode):
     return
 
 
+def _makeAsyncioSSLContext(config):
+    if sys.version_info < (3, 4):
+        raise RuntimeError("Servers 'asyncio' and 'prefork' require Python 3.")
+    from wsgidav.server import asyncio_server
+
+    ssl_certificate = _get_checked_path(config.get("ssl_certificate"))
+    ssl_private_key = _get_checked_path(config.get("ssl_private_key"))
+    ssl_certificate_chain = _get_checked_path(config.get("ssl_certificate_chain"))
+    ssl_context = None
+    if ssl_certificate and ssl_private_key:
+        ssl_context = asyncio_server.makeSSLContext(
+            ssl_certificate, ssl_private_key, ssl_certificate_chain)
+        _logger.info("SSL / HTTPS enabled.")
+    elif ssl_certificate or ssl_private_key:
+        raise RuntimeError("Option 'ssl_certificate' and 'ssl_private_key' must be used together.")
+    return ssl_context
+
+
+def _runAsyncio(app, config, mode):
+    """Run WsgiDAV using asyncio_server from the wsgidav package (Python 3.4+)."""
+    from wsgidav.server import asyncio_server
+
+    server_args = {"ssl_context": _makeAsyncioSSLContext(config)}
+    server_args.update(config.get("server_args", {}))
+    server = asyncio_server.AsyncioServer(app, config["host"], config["port"], **server_args)
+    _logger.info("Running WsgiDAV {} on {}...".format(__version__, server))
+    try:
+        server.serve(config.get("startup_event"))
+    except KeyboardInterrupt:
+        _logger.warn("Caught Ctrl-C, shutting down...")
+    return
+
+
+def _runPrefork(app, config, mode):
+    """Run WsgiDAV in multiple asyncio_server worker processes (POSIX, Python 3.5+)."""
+    from wsgidav.server import prefork
+
+    server_args = {"ssl_context": _makeAsyncioSSLContext(config)}
+    server_args.update(config.get("server_args", {}))
+    config["server_args"] = server_args
+    server = prefork.PreforkServer(config, **config.get("prefork", {}))
+    _logger.info("Running WsgiDAV {} on {}...".format(__version__, server))
+    server.serve(config.get("startup_event"))
+    return
+
+
 def run():
-    SUPPORTED_SERVERS = {"paste": _runPaste,
+    SUPPORTED_SERVERS = {"asyncio": _runAsyncio,
+                         "prefork": _runPrefork,
+                         "paste": _runPaste,
                          "cheroot": _runCheroot,
                          "cherrypy": _runCherryPy,
                          "ext-wsgiutils": _runExtWsgiutils,
@@ -594,14 +646,15 @@ def run():
 
     util.initLogging(config["verbose"], config.get("enable_loggers", []))
 
-    app = WsgiDAVApp(config)
-
     server = config["server"]
     handler = SUPPORTED_SERVERS.get(server)
     if not handler:
         raise RuntimeError("Unsupported server type {!r} (expected {!r})"
                            .format(server, "', '".join(SUPPORTED_SERVERS.keys())))
 
+    # Prefork workers create their application after fork()
+    app = None if server == "prefork" else WsgiDAVApp(config)
+
     if not useLxml:  # and config["verbose"] >= 1:
         _logger.warn("WARNING: Could not import lxml: using xml instead (slower). "
                      "Consider installing lxml https://pypi.python.org/pypi/lxml.")
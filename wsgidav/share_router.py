@@ -0,0 +1,131 @@
+# (c) 2009-2018 Martin Wendt and contributors; see WsgiDAV https://github.com/mar10/wsgidav
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license.php
+"""
+Implements ``ShareRouter``, which maps request paths to share names.
+
+The router is a trie of case-insensitive path segments, so the longest
+matching share is found in O(path depth), independent of the number of
+registered shares::
+
+    router = ShareRouter(["/", "/pub", "/home/joe"])
+    router.resolve("/HOME/joe/file.txt")  # -> "/home/joe"
+    router.resolve("/home/jane/file.txt")  # -> "/"
+
+Shares can be added and removed while requests are resolved. Only writers
+are serialized by a lock: every modification is a single dict operation (or
+attribute assignment), which is atomic in CPython, so ``resolve()`` never
+sees a half-built branch.
+
+See :class:`~wsgidav.wsgidav_app.WsgiDAVApp`
+"""
+import threading
+
+from wsgidav import util
+
+__docformat__ = "reStructuredText"
+
+_logger = util.getModuleLogger(__name__)
+
+
+def _splitShare(share):
+    """Return the case-folded path segments of a share or path."""
+    share = share.strip("/")
+    if not share:
+        return []
+    return share.upper().split("/")
+
+
+class _Node(object):
+    __slots__ = ("share", "children")
+
+    def __init__(self):
+        self.share = None
+        self.children = {}
+
+
+# ========================================================================
+# ShareRouter
+# ========================================================================
+class ShareRouter(object):
+    """Map request paths to the longest matching share (case-insensitive)."""
+
+    def __init__(self, shares=None):
+        self._root = _Node()
+        self._count = 0
+        self._lock = threading.Lock()
+        for share in shares or ():
+            self.addShare(share)
+
+    def __repr__(self):
+        return "ShareRouter({} shares)".format(self._count)
+
+    def __len__(self):
+        return self._count
+
+    def addShare(self, share):
+        """Register a share name, e.g. '/pub'."""
+        segments = _splitShare(share)
+        with self._lock:
+            node = self._root
+            for i, seg in enumerate(segments):
+                child = node.children.get(seg)
+                if child is None:
+                    # Build the missing branch first, then attach it at once
+                    branch = leaf = _Node()
+                    for rest in segments[i + 1:]:
+                        leaf.children[rest] = _Node()
+                        leaf = leaf.children[rest]
+                    leaf.share = share
+                    node.children[seg] = branch
+                    self._count += 1
+                    return
+                node = child
+            if node.share is None:
+                self._count += 1
+            node.share = share
+
+    def removeShare(self, share):
+        """Unregister a share name; return False, if it was not registered."""
+        segments = _splitShare(share)
+        with self._lock:
+            path = [self._root]
+            for seg in segments:
+                node = path[-1].children.get(seg)
+                if node is None:
+                    return False
+                path.append(node)
+            if path[-1].share is None:
+                return False
+            path[-1].share = None
+            self._count -= 1
+            # Prune branches that don't lead to a share anymore
+            for i in range(len(segments), 0, -1):
+                node = path[i]
+                if node.share is not None or node.children:
+                    break
+                path[i - 1].children.pop(segments[i - 1], None)
+        return True
+
+    def resolve(self, path):
+        """Return the longest share that matches `path` (or None)."""
+        node = self._root
+        share = node.share
+        for seg in path.upper().split("/")[1:]:
+            node = node.children.get(seg)
+            if node is None:
+                break
+            if node.share is not None:
+                share = node.share
+        return share
+
+    def getShares(self):
+        """Return a list of all registered share names."""
+        res = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.share is not None:
+                res.append(node.share)
+            stack.extend(node.children.values())
+        return res
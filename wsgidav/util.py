@@ -7,6 +7,7 @@ Miscellaneous support functions for WsgiDAV.
 """
 import base64
 import calendar
+import itertools
 import locale
 import logging
 import mimetypes
@@ -113,6 +114,85 @@ def _parsegmtime(timestring):
     return None
 
 
+# ========================================================================
+# Request timing
+# ========================================================================
+class PhaseTimer(object):
+    """Sum up the durations of named phases of a request.
+
+    If enabled, a PhaseTimer is passed as ``environ["wsgidav.timer"]``.
+    The phases are reported in the ``Server-Timing`` response header and the
+    access log.
+    """
+
+    __slots__ = ("start", "phases")
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = []  # [[name, seconds], ...] in order of first occurrence
+
+    def __repr__(self):
+        return "PhaseTimer({})".format(self.getServerTiming())
+
+    def add(self, name, seconds):
+        for phase in self.phases:
+            if phase[0] == name:
+                phase[1] += seconds
+                return
+        self.phases.append([name, seconds])
+
+    def getDurations(self):
+        """Return {phase: milliseconds}."""
+        return dict((name, round(1000 * seconds, 3)) for name, seconds in self.phases)
+
+    def getServerTiming(self):
+        """Return the value of a Server-Timing header, e.g. 'auth;dur=0.3, total;dur=5.1'."""
+        res = ["{};dur={:.3f}".format(name, 1000 * seconds) for name, seconds in self.phases]
+        res.append("total;dur={:.3f}".format(1000 * (time.time() - self.start)))
+        return ", ".join(res)
+
+
+class _PhaseContext(object):
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.timer.add(self.name, time.time() - self.start)
+
+
+class _NullContext(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_nullContext = _NullContext()
+
+
+def timePhase(environ, name):
+    """Return a context manager that adds its run time to the request's PhaseTimer.
+
+    This is a no-op, if request timing is disabled::
+
+        with util.timePhase(environ, "props"):
+            ...
+    """
+    timer = environ.get("wsgidav.timer")
+    if timer is None:
+        return _nullContext
+    return _PhaseContext(timer, name)
+
+
 # ========================================================================
 # Logging
 # ========================================================================
@@ -482,6 +562,23 @@ def readAndDiscardInput(environ):
         except Exception:
             _logger.error("--> wsgi_input.read(): {}".format(sys.exc_info()))
 
+    elif READ_ALL:
+        # Any other stream: read the body in blocks (the server limits reads
+        # to CONTENT_LENGTH)
+        n = cl
+        try:
+            while n > 0:
+                body = wsgi_input.read(min(n, 65536))
+                if not body:
+                    break
+                n -= len(body)
+            _logger.debug("Discarded {} bytes of unread request body".format(cl - n))
+        except Exception:
+            _logger.error("--> wsgi_input.read(): {}".format(sys.exc_info()))
+        if n > 0:
+            # Don't re-use the connection
+            environ["wsgidav.all_input_read"] = 0
+
 
 def fail(value, contextinfo=None, srcexception=None, errcondition=None):
     """Wrapper to raise (and log) DAVError."""
@@ -523,6 +620,37 @@ class SubAppStartResponse(object):
         self.__exc_info = exc_info
 
 
+class PassThroughIterator(object):
+    """Response iterable that returns `chunks`, then the rest of `it`.
+
+    Middlewares that only need to see the first chunk of a response return
+    this, instead of re-yielding every chunk: iteration is done by
+    ``itertools.chain`` in C, so no Python frame is added per chunk.
+
+    ``close()`` is passed to `app_iter` (the iterable that `it` was taken
+    from) and then calls `onClose`, if given.
+    """
+
+    __slots__ = ("_iter", "_app_iter", "_onClose")
+
+    def __init__(self, chunks, it, app_iter=None, onClose=None):
+        self._iter = itertools.chain(chunks, it)
+        self._app_iter = it if app_iter is None else app_iter
+        self._onClose = onClose
+
+    def __iter__(self):
+        return self._iter
+
+    def close(self):
+        try:
+            if hasattr(self._app_iter, "close"):
+                self._app_iter.close()
+        finally:
+            onClose, self._onClose = self._onClose, None
+            if onClose:
+                onClose()
+
+
 # ========================================================================
 # URLs
 # ========================================================================
@@ -743,7 +871,8 @@ def sendMultiStatusResponse(environ, start_response, multistatusEL):
     # Hotfix for Windows XP
     # PROPFIND XML response is not recognized, when pretty_print = True!
     # (Vista and others would accept this).
-    xml_data = xmlToBytes(multistatusEL, pretty_print=False)
+    with timePhase(environ, "xml"):
+        xml_data = xmlToBytes(multistatusEL, pretty_print=False)
     # If not, Content-Length is wrong!
     assert compat.is_bytes(xml_data), xml_data
 
@@ -39,10 +39,12 @@ For every request:
     Note: The OPTIONS method for the '*' path is handled directly.
 
 """
+import functools
 import sys
 import time
 
-from wsgidav import compat, util
+from wsgidav import call_stats, compat, util
+from wsgidav.access_log import AccessLogger
 from wsgidav.dav_provider import DAVProvider
 from wsgidav.debug_filter import WsgiDavDebugFilter
 from wsgidav.dir_browser import WsgiDavDirBrowser
@@ -53,7 +55,8 @@ from wsgidav.lock_manager import LockManager
 from wsgidav.lock_storage import LockStorageDict
 from wsgidav.property_manager import PropertyManager
 from wsgidav.request_resolver import RequestResolver
-from wsgidav.util import safeReEncode
+from wsgidav.share_router import ShareRouter
+from wsgidav.xml_tools import XMLValueCache
 
 __docformat__ = "reStructuredText"
 
@@ -73,6 +76,10 @@ DEFAULT_CONFIG = {
     #    "use_text_files": False,
 
     "propsmanager": None,  # True: use property_manager.PropertyManager
+    # Max. number of parsed dead property values to cache (0: disable)
+    "property_value_cache_size": 10000,
+    # Map Win32* properties of Microsoft clients to file metadata (FilesystemProvider)
+    "map_win32_props": False,
     "locksmanager": True,  # True: use lock_manager.LockManager
 
     # HTTP Authentication Options
@@ -84,6 +91,17 @@ DEFAULT_CONFIG = {
     "defaultdigest": True,    # True (default digest) or False (default basic)
     # Name of a header field that will be accepted as authorized user
     "trusted_auth_header": None,
+    # Seconds to cache successful basic auth verifications (0: disable)
+    "auth_cache_ttl": 0,
+    "auth_cache_size": 1000,  # Max. number of cached verifications
+    # Seconds to reject repeated failed credentials (doubled on every failure)
+    "auth_fail_backoff": 1.0,
+    # Seconds a signed session cookie is accepted instead of credentials (0: disable)
+    "auth_session_ttl": 0,
+    "auth_session_cookie": "wsgidav_session",
+    # Secret for signing digest nonces and session cookies (None: random, per process)
+    "auth_secret": None,
+    "auth_nonce_ttl": 300,  # Seconds until a digest nonce is stale
 
     # Error printer options
     "catchall": False,
@@ -91,6 +109,15 @@ DEFAULT_CONFIG = {
     "enable_loggers": [
     ],
 
+    # Access log (written if verbose >= 3)
+    "access_log_format": "text",  # 'text' or 'json'
+    # Log only a fraction of successful requests, e.g. {"PROPFIND": 0.1}
+    "access_log_sampling": {},
+    "access_log_async": True,  # Write entries on a background thread (Python 3)
+    # Add a Server-Timing response header with per-phase durations
+    # (route, auth, resource, locks, props, xml, total)
+    "server_timing": False,
+
     # Verbose Output
     "verbose": 1,        # 0 - no output (excepting application exceptions)
                          # 1 - show single line request summaries (for HTTP logging)
@@ -108,6 +135,31 @@ DEFAULT_CONFIG = {
         "ms_sharepoint_plugin": True,  # Invoke MS Offce documents for editing using WebDAV
         "ms_sharepoint_urls": False,  # Prepend 'ms-word:ofe|u|' to URL for MS Offce documents
     },
+    # Options for wsgidav.metrics.WsgiDavMetrics (if added to middleware_stack)
+    "metrics": {
+        "path": "/_metrics",  # URL of the Prometheus metrics (not authenticated!)
+        "per_share": True,  # Count requests and bytes per share
+    },
+    # Middlewares only intercept start_response and the first chunk of a
+    # response, and return the rest unchanged (False: re-yield every chunk)
+    "response_pass_through": True,
+    # If a request is rejected before its body was read, discard up to this
+    # number of bytes to keep the connection; close it for bigger bodies
+    # (-1: always read the whole body)
+    "discard_input_limit": 65536,
+    # Count provider, lock and property manager calls per request, and log
+    # requests that make more than `max_calls_per_resource` calls per returned
+    # resource (and at least `min_calls`)
+    "call_stats": {
+        "enable": False,
+        "max_calls_per_resource": 3,
+        "min_calls": 20,
+    },
+    # Options for wsgidav.profiler.WsgiDavProfiler (if added to middleware_stack)
+    "profiler": {
+        "sample_rate": 0.01,  # Fraction of profiled requests
+        "users": None,  # Users that may read the profiles (None: all authenticated users)
+    },
     "middleware_stack": [
         WsgiDavDirBrowser,
         HTTPAuthenticator,
@@ -117,6 +169,34 @@ DEFAULT_CONFIG = {
 }
 
 
+def _makeLocksManager(lockStorage):
+    """Return a LockManager for a `locksmanager` option (None, if disabled).
+
+    The option may be True (in-memory storage), a lock storage, or an existing
+    LockManager instance (which is then shared).
+    """
+    if not lockStorage:
+        return None
+    elif isinstance(lockStorage, LockManager):
+        return lockStorage
+    elif lockStorage is True:
+        lockStorage = LockStorageDict()
+    return LockManager(lockStorage)
+
+
+def _makePropsManager(propsManager):
+    """Return a property manager for a `propsmanager` option (None, if disabled).
+
+    The option may be True (in-memory), or a property manager instance.
+    """
+    if not propsManager:
+        # Normalize False, 0 to None
+        return None
+    elif propsManager is True:
+        return PropertyManager()
+    return propsManager
+
+
 def _checkConfig(config):
     mandatoryFields = ["provider_mapping",
                        ]
@@ -146,53 +226,35 @@ class WsgiDAVApp(object):
 #        response_trailer = config.get("response_trailer", "")
         self._verbose = config.get("verbose", 3)
 
-        lockStorage = config.get("locksmanager")
-        if lockStorage is True:
-            lockStorage = LockStorageDict()
+        # Default managers, used by all shares that don't configure their own
+        locksManager = _makeLocksManager(config.get("locksmanager"))
+        propsManager = _makePropsManager(config.get("propsmanager"))
 
-        if not lockStorage:
-            locksManager = None
-        else:
-            locksManager = LockManager(lockStorage)
-
-        propsManager = config.get("propsmanager")
-        if not propsManager:
-            # Normalize False, 0 to None
-            propsManager = None
-        elif propsManager is True:
-            propsManager = PropertyManager()
-
-        mount_path = config.get("mount_path")
+        self._accessLogger = None
+        if self._verbose >= 3:
+            self._accessLogger = AccessLogger(config)
+        self._serverTiming = bool(config.get("server_timing"))
+        self._passThrough = config.get("response_pass_through", True)
+        self._discardInputLimit = config.get("discard_input_limit", 65536)
+
+        self._locksManager = locksManager
+        self._propsManager = propsManager
+        self._propValueCache = None
+        self._authenticator = None
+        self._callStatsChecker = None
+        # Caches one RequestServer per provider
+        self._requestResolver = RequestResolver()
+        if (config.get("call_stats") or {}).get("enable"):
+            self._callStatsChecker = call_stats.CallStatsChecker(config)
 
         # Instantiate DAV resource provider objects for every share
         self.providerMap = {}
+        self._shareRouter = ShareRouter()
         for (share, provider) in provider_mapping.items():
-            # Make sure share starts with, or is, '/'
-            share = "/" + share.strip("/")
-
-            # We allow a simple string as 'provider'. In this case we interpret
-            # it as a file system root folder that is published.
-            if compat.is_basestring(provider):
-                provider = FilesystemProvider(provider)
-
-            assert isinstance(provider, DAVProvider)
-
-            provider.setSharePath(share)
-            if mount_path:
-                provider.setMountPath(mount_path)
-
-            # TODO: someday we may want to configure different lock/prop
-            # managers per provider
-            provider.setLockManager(locksManager)
-            provider.setPropManager(propsManager)
-
-            self.providerMap[share] = {
-                "provider": provider,
-                "allow_anonymous": False,
-                }
+            self.addProvider(share, provider)
 
         # Define WSGI application stack
-        application = RequestResolver()
+        application = self._requestResolver
 
         domain_controller = None
         dir_browser = config.get("dir_browser", {})
@@ -214,14 +276,15 @@ class WsgiDAVApp(object):
                 application = mw(application, config)
 
                 if issubclass(mw, HTTPAuthenticator):
+                    self._authenticator = application
                     domain_controller = application.getDomainController()
                     # check anonymous access
                     for share, data in self.providerMap.items():
                         if application.allowAnonymousAccess(share):
                             data["allow_anonymous"] = True
             else:
-                # if self._verbose >= 2:
-                _logger.warn("- SKIPPING middleware {} (not suitable)".format(mw))
+                # The middleware decided itself, e.g. WsgiDavDebugFilter with verbose < 3
+                _logger.debug("  - SKIPPING middleware {} (not suitable)".format(mw))
 
         # Print info
         if self._verbose >= 3:
@@ -231,7 +294,7 @@ class WsgiDAVApp(object):
             _logger.info("Registered DAV providers:")
             for share, data in self.providerMap.items():
                 hint = " (anonymous)" if data["allow_anonymous"] else ""
-                _logger.info("  Share '{}': {}{}".format(share, provider, hint))
+                _logger.info("  Share '{}': {}{}".format(share, data["provider"], hint))
         if self._verbose >= 2:
             for share, data in self.providerMap.items():
                 if data["allow_anonymous"]:
@@ -240,6 +303,76 @@ class WsgiDAVApp(object):
 
         self._application = application
 
+    def addProvider(self, share, provider):
+        """Publish a DAV provider (or a file system folder) as share.
+
+        `provider` may also be a dict with the keys 'provider', and optionally
+        'locksmanager' and 'propsmanager', to override the default managers
+        for this share. A manager instance may be passed to several shares,
+        `True` creates a new in-memory manager that is used by this share only.
+
+        This may also be called while the application is serving requests.
+        """
+        # Make sure share starts with, or is, '/'
+        share = "/" + share.strip("/")
+
+        locksManager = self._locksManager
+        propsManager = self._propsManager
+        if isinstance(provider, dict):
+            shareOpts = provider
+            provider = shareOpts["provider"]
+            if "locksmanager" in shareOpts:
+                locksManager = _makeLocksManager(shareOpts["locksmanager"])
+            if "propsmanager" in shareOpts:
+                propsManager = _makePropsManager(shareOpts["propsmanager"])
+
+        # We allow a simple string as 'provider'. In this case we interpret
+        # it as a file system root folder that is published.
+        if compat.is_basestring(provider):
+            provider = FilesystemProvider(provider)
+
+        assert isinstance(provider, DAVProvider)
+
+        provider.setSharePath(share)
+        mount_path = self.config.get("mount_path")
+        if mount_path:
+            provider.setMountPath(mount_path)
+
+        # The value cache is keyed by URL, so all shares can use the same one
+        cacheSize = self.config.get("property_value_cache_size", 0)
+        if propsManager and cacheSize and self._propValueCache is None:
+            self._propValueCache = XMLValueCache(cacheSize)
+
+        if self._callStatsChecker:
+            call_stats.instrumentProvider(provider)
+            locksManager = self._callStatsChecker.getProxy(locksManager, "lockManager")
+            propsManager = self._callStatsChecker.getProxy(propsManager, "propManager")
+
+        provider.setLockManager(locksManager)
+        provider.setPropManager(propsManager)
+        provider.setPropValueCache(self._propValueCache if propsManager else None)
+        # The allowed methods depend on the managers
+        self._requestResolver.forgetProvider(provider)
+
+        allow_anonymous = bool(self._authenticator
+                               and self._authenticator.allowAnonymousAccess(share))
+        self.providerMap[share] = {
+            "provider": provider,
+            "allow_anonymous": allow_anonymous,
+            }
+        self._shareRouter.addShare(share)
+        return provider
+
+    def removeProvider(self, share):
+        """Unpublish a share; return False, if it was not registered."""
+        share = "/" + share.strip("/")
+        if not self._shareRouter.removeShare(share):
+            return False
+        data = self.providerMap.pop(share, None)
+        if data:
+            self._requestResolver.forgetProvider(data["provider"])
+        return True
+
     def __call__(self, environ, start_response):
 
         # util.log("SCRIPT_NAME='{}', PATH_INFO='{}'".format(
@@ -277,30 +410,23 @@ class WsgiDAVApp(object):
         environ["wsgidav.config"] = self.config
         environ["wsgidav.provider"] = None
         environ["wsgidav.verbose"] = self._verbose
+        if self._serverTiming or self._accessLogger:
+            environ["wsgidav.timer"] = util.PhaseTimer()
 
-        # Find DAV provider that matches the share
-
-        # sorting share list by reverse length
-#        shareList = self.providerMap.keys()
-#        shareList.sort(key=len, reverse=True)
-        shareList = sorted(self.providerMap.keys(), key=len, reverse=True)
-
-        share = None
-        for r in shareList:
-            # @@: Case sensitivity should be an option of some sort here;
-            # os.path.normpath might give the preferred case for a filename.
-            if r == "/":
-                share = r
-                break
-            elif path.upper() == r.upper() or path.upper().startswith(r.upper() + "/"):
-                share = r
-                break
+        # Find DAV provider that matches the share (longest prefix, ignoring case)
+        # @@: Case sensitivity should be an option of some sort here;
+        # os.path.normpath might give the preferred case for a filename.
+        with util.timePhase(environ, "route"):
+            share = self._shareRouter.resolve(path)
 
         # Note: we call the next app, even if provider is None, because OPTIONS
         #       must still be handled.
         #       All other requests will result in '404 Not Found'
-        if share is not None:
-            share_data = self.providerMap.get(share)
+        share_data = self.providerMap.get(share) if share is not None else None
+        if share_data is None:
+            # May have been removed concurrently
+            share = None
+        else:
             environ["wsgidav.provider"] = share_data["provider"]
         # TODO: test with multi-level realms: 'aa/bb'
         # TODO: test security: url contains '..'
@@ -361,73 +487,85 @@ class WsgiDAVApp(object):
                         .format(headerDict.get("content-length")))
                 forceCloseConnection = True
 
-            # HOTFIX for Vista and Windows 7 (GC issue 13, issue 23)
-            # It seems that we must read *all* of the request body, otherwise
-            # clients may miss the response.
-            # For example Vista MiniRedir didn't understand a 401 response,
-            # when trying an anonymous PUT of big files. As a consequence, it
-            # doesn't retry with credentials and the file copy fails.
-            # (XP is fine however).
-            util.readAndDiscardInput(environ)
+            self._discardInput(environ)
 
             # Make sure the socket is not reused, unless we are 100% sure all
             # current input was consumed
             if(util.getContentLength(environ) != 0 and not environ.get("wsgidav.all_input_read")):
-                _logger.error("Input stream not completely consumed: closing connection")
+                _logger.info("Input stream not completely consumed: closing connection")
                 forceCloseConnection = True
 
             if forceCloseConnection and headerDict.get("connection") != "close":
                 _logger.error("Adding 'Connection: close' header")
                 response_headers.append(("Connection", "close"))
 
+            if self._serverTiming:
+                response_headers.append(
+                    ("Server-Timing", environ["wsgidav.timer"].getServerTiming()))
+
             # Log request
-            if self._verbose >= 3:
-                userInfo = environ.get("http_authenticator.username")
-                if not userInfo:
-                    userInfo = "(anonymous)"
-                extra = []
-                if "HTTP_DESTINATION" in environ:
-                    extra.append('dest="{}"'.format(environ.get("HTTP_DESTINATION")))
-                if environ.get("CONTENT_LENGTH", "") != "":
-                    extra.append("length={}".format(environ.get("CONTENT_LENGTH")))
-                if "HTTP_DEPTH" in environ:
-                    extra.append("depth={}".format(environ.get("HTTP_DEPTH")))
-                if "HTTP_RANGE" in environ:
-                    extra.append("range={}".format(environ.get("HTTP_RANGE")))
-                if "HTTP_OVERWRITE" in environ:
-                    extra.append("overwrite={}".format(environ.get("HTTP_OVERWRITE")))
-                if self._verbose >= 1 and "HTTP_EXPECT" in environ:
-                    extra.append('expect="{}"'.format(environ.get("HTTP_EXPECT")))
-                if self._verbose >= 2 and "HTTP_CONNECTION" in environ:
-                    extra.append('connection="{}"'.format(environ.get("HTTP_CONNECTION")))
-                if self._verbose >= 2 and "HTTP_USER_AGENT" in environ:
-                    extra.append('agent="{}"'.format(environ.get("HTTP_USER_AGENT")))
-                if self._verbose >= 2 and "HTTP_TRANSFER_ENCODING" in environ:
-                    extra.append("transfer-enc={}".format(environ.get("HTTP_TRANSFER_ENCODING")))
-                if self._verbose >= 1:
-                    extra.append("elap={:.3f}sec".format(time.time() - start_time))
-                extra = ", ".join(extra)
-
-#               This is the CherryPy format:
-#                127.0.0.1 - - [08/Jul/2009:17:25:23] "GET /loginPrompt?redirect=/renderActionList%3Frelation%3Dpersonal%26key%3D%26filter%3DprivateSchedule&reason=0 HTTP/1.1" 200 1944 "http://127.0.0.1:8002/command?id=CMD_Schedule" "Mozilla/5.0 (Windows; U; Windows NT 6.0; de; rv:1.9.1) Gecko/20090624 Firefox/3.5"  # noqa
-                _logger.info('{} - {} - [{}] "{}" {} -> {}'.format(
-                    environ.get("REMOTE_ADDR", ""),
-                    userInfo,
-                    util.getLogTime(),
-                    environ.get("REQUEST_METHOD") + " " +
-                    safeReEncode(environ.get("PATH_INFO", ""),  sys.stdout.encoding),
-                    extra,
-                    status,
-                    # response_headers.get(""), # response Content-Length
-                    # referer
-                ))
+            if self._accessLogger:
+                self._accessLogger.log(environ, status, start_time)
             return start_response(status, response_headers, exc_info)
 
-        # Call next middleware
-        app_iter = self._application(environ, _start_response_wrapper)
-        for v in app_iter:
-            yield v
-        if hasattr(app_iter, "close"):
-            app_iter.close()
+        onClose = None
+        if self._callStatsChecker:
+            callCounter = environ["wsgidav.call_counter"] = call_stats.CallCounter()
+            callCounter.start()
+            onClose = functools.partial(self._checkCallStats, environ, callCounter)
+
+        if not self._passThrough:
+            return self._iterResponse(environ, _start_response_wrapper, onClose)
+
+        # Call next middleware and return its response unchanged (the server
+        # calls close() when the response was sent)
+        try:
+            app_iter = self._application(environ, _start_response_wrapper)
+        except Exception:
+            if onClose:
+                onClose()
+            raise
+        if onClose is None:
+            return app_iter
+        return util.PassThroughIterator((), app_iter, onClose=onClose)
+
+    def _checkCallStats(self, environ, callCounter):
+        callCounter.stop()
+        self._callStatsChecker.check(environ, callCounter)
+
+    def _discardInput(self, environ):
+        """Read the request body, if the response is sent before it was read.
+
+        Otherwise the connection is closed after the response.
+        """
+        if environ.get("wsgidav.some_input_read") or environ.get("wsgidav.all_input_read"):
+            return
+        contentLength = util.getContentLength(environ)
+        if contentLength == 0:
+            return
+        if "Microsoft-WebDAV-MiniRedir" in environ.get("HTTP_USER_AGENT", ""):
+            # HOTFIX for Vista and Windows 7 (GC issue 13, issue 23)
+            # It seems that we must read *all* of the request body, otherwise
+            # clients may miss the response.
+            # For example Vista MiniRedir didn't understand a 401 response,
+            # when trying an anonymous PUT of big files. As a consequence, it
+            # doesn't retry with credentials and the file copy fails.
+            # (XP is fine however).
+            util.readAndDiscardInput(environ)
+        elif environ.get("HTTP_EXPECT", "").lower() == "100-continue":
+            # The server sends '100 Continue' when we start reading, so the
+            # client did not send the body yet. Reading now would transfer it.
+            _logger.debug("Rejected 'Expect: 100-continue' request without reading the body")
+        elif self._discardInputLimit < 0 or contentLength <= self._discardInputLimit:
+            util.readAndDiscardInput(environ)
 
-        return
+    def _iterResponse(self, environ, start_response, onClose):
+        try:
+            app_iter = self._application(environ, start_response)
+            for v in app_iter:
+                yield v
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        finally:
+            if onClose:
+                onClose()
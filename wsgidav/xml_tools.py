@@ -7,7 +7,10 @@ Small wrapper for different etree packages.
 """
 # from __future__ import print_function
 
+import copy
 import logging
+import threading
+from collections import OrderedDict
 
 from wsgidav import compat
 
@@ -64,6 +67,77 @@ def stringToXML(text):
         raise
 
 
+class XMLValueCache(object):
+    """Bounded LRU cache of parsed dead property values.
+
+    Entries are grouped by resource URL and remember the serialized value they
+    were parsed from, i.e. the effective key is (refUrl, propname, value).
+    A modified property is therefore never served from the cache, even if the
+    entry was not invalidated.
+
+    The returned elements are deep copies, because appending an element to a
+    response tree would detach it from the cache (and copying is still
+    considerably cheaper than parsing).
+    """
+
+    def __init__(self, maxSize=10000):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()  # {refUrl: {propname: (value, element)}}
+        self._count = 0
+
+    def __repr__(self):
+        return "XMLValueCache({}/{} entries, {} hits, {} misses)".format(
+            self._count, self.maxSize, self.hits, self.misses)
+
+    def getElement(self, refUrl, propname, value):
+        """Return the value string parsed into a etree.Element."""
+        element = None
+        with self._lock:
+            # Pop and re-insert, so the resource becomes most recently used
+            props = self._urls.pop(refUrl, None)
+            if props is not None:
+                self._urls[refUrl] = props
+                entry = props.get(propname)
+                if entry is not None and entry[0] == value:
+                    self.hits += 1
+                    element = entry[1]
+        if element is not None:
+            return copy.deepcopy(element)
+
+        element = stringToXML(value)
+        with self._lock:
+            self.misses += 1
+            props = self._urls.pop(refUrl, None) or {}
+            if propname not in props:
+                self._count += 1
+            props[propname] = (value, element)
+            self._urls[refUrl] = props
+            while self._count > self.maxSize and len(self._urls) > 1:
+                _url, evicted = self._urls.popitem(last=False)
+                self._count -= len(evicted)
+        return copy.deepcopy(element)
+
+    def invalidate(self, refUrl, withChildren=False):
+        """Remove cached values of a resource (and its descendants)."""
+        with self._lock:
+            urls = [refUrl]
+            if withChildren:
+                prefix = refUrl.rstrip("/") + "/"
+                urls.extend(url for url in self._urls if url.startswith(prefix))
+            for url in urls:
+                props = self._urls.pop(url, None)
+                if props:
+                    self._count -= len(props)
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+            self._count = 0
+
+
 def xmlToBytes(element, pretty_print=False):
     """Wrapper for etree.tostring, that takes care of unsupported pretty_print
     option and prepends an encoding header."""